@@ -2,7 +2,7 @@ import shutil
 from pathlib import Path
 from functools import lru_cache
 from typing import TYPE_CHECKING
-from typing import Optional, Generator, TextIO, Set
+from typing import Optional, Generator, List, TextIO, Set
 from rigour.mime.types import JSON
 from nomenklatura.statement import Statement
 from nomenklatura.statement.serialize import read_pack_statements_decoded
@@ -10,7 +10,8 @@ from nomenklatura.versions import Version, VersionHistory
 
 from zavod import settings
 from zavod.logs import get_logger
-from zavod.archive.backend import get_archive_backend, ArchiveObject
+from zavod.archive.backend import get_archive_backend, ArchiveObject, file_md5
+from zavod.archive.compress import open_read, COMPRESSIONS
 
 if TYPE_CHECKING:
     from zavod.meta.dataset import Dataset
@@ -20,6 +21,8 @@ StatementGen = Generator[Statement, None, None]
 DATASETS = "datasets"
 ARTIFACTS = "artifacts"
 STATEMENTS_FILE = "statements.pack"
+# Compressed variants of the statements file, chosen by file extension:
+STATEMENTS_FILES = [f"{STATEMENTS_FILE}{c}" for c in COMPRESSIONS] + [STATEMENTS_FILE]
 HASH_FILE = "entities.hash"
 DELTA_EXPORT_FILE = "entities.delta.json"
 DELTA_INDEX_FILE = "delta.json"
@@ -27,6 +30,7 @@ STATISTICS_FILE = "statistics.json"
 ISSUES_LOG = "issues.log"
 ISSUES_FILE = "issues.json"
 RESOURCES_FILE = "resources.json"
+SOURCES_FILE = "sources.json"
 INDEX_FILE = "index.json"
 CATALOG_FILE = "catalog.json"
 VERSIONS_FILE = "versions.json"
@@ -34,10 +38,11 @@ ARTIFACT_FILES = [
     ISSUES_FILE,
     ISSUES_LOG,
     INDEX_FILE,
-    STATEMENTS_FILE,
+    *STATEMENTS_FILES,
     STATISTICS_FILE,
     VERSIONS_FILE,
     RESOURCES_FILE,
+    SOURCES_FILE,
     DELTA_EXPORT_FILE,
     DELTA_INDEX_FILE,
     HASH_FILE,
@@ -76,6 +81,18 @@ def dataset_resource_path(dataset_name: str, resource: str) -> Path:
     return dataset_path.joinpath(resource)
 
 
+def statements_file_name() -> str:
+    """The name of the statements file written by a crawler, which is compressed
+    if configured via `ZAVOD_STATEMENTS_COMPRESSION`."""
+    suffix = settings.STATEMENTS_COMPRESSION.strip(".").lower()
+    if not len(suffix):
+        return STATEMENTS_FILE
+    name = f"{STATEMENTS_FILE}.{suffix}"
+    if name not in STATEMENTS_FILES:
+        raise ValueError(f"Invalid statements compression: {suffix}")
+    return name
+
+
 def get_dataset_artifact(
     dataset_name: str,
     resource: str,
@@ -131,29 +148,58 @@ def iter_dataset_versions(dataset_name: str) -> Generator[Version, None, None]:
 
 def get_artifact_object(
     dataset_name: str, resource: str, version: Optional[str] = None
+) -> Optional[ArchiveObject]:
+    return _find_artifact_object(dataset_name, [resource], version=version)
+
+
+def get_statements_object(
+    dataset_name: str, version: Optional[str] = None
+) -> Optional[ArchiveObject]:
+    """Find the statements artifact of the given or latest version of a dataset, in
+    any of its compressed or uncompressed variants."""
+    return _find_artifact_object(dataset_name, STATEMENTS_FILES, version=version)
+
+
+def _find_artifact_object(
+    dataset_name: str, resources: List[str], version: Optional[str] = None
 ) -> Optional[ArchiveObject]:
     backend = get_archive_backend()
     if version is not None:
-        name = f"{ARTIFACTS}/{dataset_name}/{version}/{resource}"
-        object = backend.get_object(name)
-        if object.exists():
-            return object
+        versions = [version]
     else:
-        for v in iter_dataset_versions(dataset_name):
-            name = f"{ARTIFACTS}/{dataset_name}/{v.id}/{resource}"
+        versions = [v.id for v in iter_dataset_versions(dataset_name)]
+    for v in versions:
+        for resource in resources:
+            name = f"{ARTIFACTS}/{dataset_name}/{v}/{resource}"
             object = backend.get_object(name)
             if object.exists():
                 return object
 
     # FIXME: legacy fallback option of using the latest release
     # REMOVE THIS AFTER MIGRATION
-    name = f"{DATASETS}/latest/{dataset_name}/{resource}"
-    object = backend.get_object(name)
-    if object.exists():
-        return object
+    for resource in resources:
+        name = f"{DATASETS}/latest/{dataset_name}/{resource}"
+        object = backend.get_object(name)
+        if object.exists():
+            return object
     return None
 
 
+def _publish_object(
+    object: ArchiveObject,
+    path: Path,
+    checksum: str,
+    mime_type: Optional[str] = None,
+    ttl: Optional[int] = None,
+) -> None:
+    """Upload a file to the archive, unless the object already has the same
+    content and metadata. This makes re-running an interrupted publication cheap."""
+    if object.is_published(checksum, mime_type=mime_type, ttl=ttl):
+        log.info(f"Skipping unchanged object: {object.name}", checksum=checksum)
+        return
+    object.publish(path, mime_type=mime_type, ttl=ttl, checksum=checksum)
+
+
 def publish_dataset_version(dataset_name: str) -> None:
     """Publish the history of versions for a given dataset to the artifact directory."""
     path = dataset_resource_path(dataset_name, VERSIONS_FILE)
@@ -163,7 +209,7 @@ def publish_dataset_version(dataset_name: str) -> None:
     backend = get_archive_backend()
     name = f"{ARTIFACTS}/{dataset_name}/{VERSIONS_FILE}"
     object = backend.get_object(name)
-    object.publish(path, mime_type=JSON, ttl=TTL_SHORT)
+    _publish_object(object, path, file_md5(path), mime_type=JSON, ttl=TTL_SHORT)
     get_versions_data.cache_clear()
 
 
@@ -178,7 +224,7 @@ def publish_artifact(
     name = f"{ARTIFACTS}/{dataset_name}/{version.id}/{resource}"
     backend = get_archive_backend()
     object = backend.get_object(name)
-    object.publish(path, mime_type=mime_type, ttl=TTL_LONG)
+    _publish_object(object, path, file_md5(path), mime_type=mime_type, ttl=TTL_LONG)
 
 
 def publish_resource(
@@ -194,14 +240,16 @@ def publish_resource(
     if dataset_name is not None:
         assert path.relative_to(dataset_data_path(dataset_name))
         resource = f"{dataset_name}/{resource}"
+    checksum = file_md5(path)
     release_name = f"{DATASETS}/{settings.RELEASE}/{resource}"
     release_object = backend.get_object(release_name)
-    release_object.publish(path, mime_type=mime_type, ttl=ttl)
+    _publish_object(release_object, path, checksum, mime_type=mime_type, ttl=ttl)
 
     if latest and settings.RELEASE != "latest":
         latest_name = f"{DATASETS}/latest/{resource}"
         latest_object = backend.get_object(latest_name)
-        latest_object.republish(release_name)
+        if not latest_object.is_published(checksum, mime_type=mime_type, ttl=ttl):
+            latest_object.republish(release_name)
 
 
 def _read_fh_statements(fh: TextIO, external: bool) -> StatementGen:
@@ -220,11 +268,13 @@ def iter_dataset_statements(dataset: "Dataset", external: bool = True) -> Statem
 def iter_local_statements(dataset: "Dataset", external: bool = True) -> StatementGen:
     """Create a generator that yields all statements in the given dataset."""
     assert not dataset.is_collection
-    path = dataset_resource_path(dataset.name, STATEMENTS_FILE)
-    if not path.exists():
-        raise FileNotFoundError(f"Statements not found: {dataset.name}")
-    with open(path, "r") as fh:
-        yield from _read_fh_statements(fh, external)
+    for name in STATEMENTS_FILES:
+        path = dataset_resource_path(dataset.name, name)
+        if path.exists():
+            with open_read(path) as fh:
+                yield from _read_fh_statements(fh, external)
+            return
+    raise FileNotFoundError(f"Statements not found: {dataset.name}")
 
 
 def _iter_scope_statements(dataset: "Dataset", external: bool = True) -> StatementGen:
@@ -234,7 +284,7 @@ def _iter_scope_statements(dataset: "Dataset", external: bool = True) -> Stateme
     except FileNotFoundError:
         pass
 
-    object = get_artifact_object(dataset.name, STATEMENTS_FILE)
+    object = get_statements_object(dataset.name)
     if object is not None:
         log.info(
             "Streaming statements...",
@@ -253,7 +303,7 @@ def iter_previous_statements(
     """Load the statements from the previous release of the dataset by streaming them
     from the data archive."""
     for scope in dataset.leaves:
-        object = get_artifact_object(dataset.name, STATEMENTS_FILE, version)
+        object = get_statements_object(dataset.name, version)
         if object is not None:
             log.info(
                 "Streaming backfilled statements...",
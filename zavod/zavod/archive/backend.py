@@ -1,22 +1,58 @@
+import os
+import json
+import base64
 import shutil
 import warnings
+from hashlib import md5
 from pathlib import Path
 from functools import cache
-from typing import cast, Dict, Optional, Type, TextIO
+from concurrent.futures import ThreadPoolExecutor
+from typing import cast, Any, BinaryIO, Dict, Optional, Type, TextIO
 from google.cloud.storage import Client, Blob  # type: ignore
+from google.cloud.storage import transfer_manager
 
 from zavod import settings
 from zavod.logs import get_logger
 from zavod.exc import ConfigurationException
+from zavod.archive.compress import wrap_reader
 
 
 log = get_logger(__name__)
 BLOB_CHUNK = 40 * 1024 * 1024
+# Object metadata key holding the MD5 of the uploaded file, which GCS doesn't
+# compute for objects uploaded in parts:
+MD5_KEY = "zavod-md5"
 warnings.filterwarnings(
     "ignore", "Your application has authenticated using end user credentials"
 )
 
 
+def file_md5(path: Path) -> str:
+    """Compute the hex MD5 checksum of a file, as used to compare it to an archive
+    object."""
+    digest = md5()
+    with open(path, "rb") as fh:
+        while True:
+            chunk = fh.read(BLOB_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_control(ttl: Optional[int]) -> Optional[str]:
+    """The Cache-Control header of an object published with the given TTL."""
+    if ttl is None:
+        return None
+    return f"public, max-age={ttl}"
+
+
+def is_multipart(source: Path) -> bool:
+    """Check if a file is large enough to be uploaded in concurrent parts."""
+    threshold = settings.PUBLISH_MULTIPART_SIZE * 1024 * 1024
+    return threshold > 0 and source.stat().st_size >= threshold
+
+
 class ArchiveObject(object):
     def __init__(self, name: str) -> None:
         self.name = name
@@ -27,6 +63,20 @@ class ArchiveObject(object):
     def size(self) -> int:
         raise NotImplementedError
 
+    def checksum(self) -> Optional[str]:
+        """The hex MD5 checksum of the object, if it exists and is known."""
+        raise NotImplementedError
+
+    def is_published(
+        self,
+        checksum: str,
+        mime_type: Optional[str] = None,
+        ttl: Optional[int] = None,
+    ) -> bool:
+        """Check if the object has the content with the given checksum, and was
+        published with the same MIME type and TTL."""
+        raise NotImplementedError
+
     def backfill(self, dest: Path) -> None:
         raise NotImplementedError
 
@@ -35,6 +85,7 @@ class ArchiveObject(object):
         source: Path,
         mime_type: Optional[str] = None,
         ttl: Optional[int] = False,
+        checksum: Optional[str] = None,
     ) -> None:
         raise NotImplementedError
 
@@ -78,11 +129,35 @@ class GoogleCloudObject(ArchiveObject):
             return 0
         return self.blob.size or 0
 
+    def checksum(self) -> Optional[str]:
+        if self.blob is None:
+            return None
+        metadata = self.blob.metadata or {}
+        if MD5_KEY in metadata:
+            return str(metadata[MD5_KEY])
+        if self.blob.md5_hash is None:
+            return None
+        return base64.b64decode(self.blob.md5_hash).hex()
+
+    def is_published(
+        self,
+        checksum: str,
+        mime_type: Optional[str] = None,
+        ttl: Optional[int] = None,
+    ) -> bool:
+        if self.checksum() != checksum or self.blob is None:
+            return False
+        # Without a MIME type, the client guesses it from the file name:
+        if mime_type is not None and self.blob.content_type != mime_type:
+            return False
+        return bool(self.blob.cache_control == cache_control(ttl))
+
     def open(self) -> TextIO:
         if self.blob is None:
             raise RuntimeError("Object does not exist: %s" % self.name)
         self.blob.reload()
-        return cast(TextIO, self.blob.open(mode="r", chunk_size=BLOB_CHUNK))
+        fh = self.blob.open(mode="rb", chunk_size=BLOB_CHUNK)
+        return wrap_reader(self.name, cast(BinaryIO, fh))
 
     def backfill(self, dest: Path) -> None:
         if self.blob is None:
@@ -94,10 +169,28 @@ class GoogleCloudObject(ArchiveObject):
         source: Path,
         mime_type: Optional[str] = None,
         ttl: Optional[int] = None,
+        checksum: Optional[str] = None,
     ) -> None:
         self._blob = self.backend.bucket.blob(self.name)
         if ttl is not None:
-            self._blob.cache_control = f"public, max-age={ttl}"
+            self._blob.cache_control = cache_control(ttl)
+        if checksum is not None:
+            self._blob.metadata = {MD5_KEY: checksum}
+        if is_multipart(source):
+            log.info(
+                f"Uploading blob in parts: {source.name}",
+                blob_name=self.name,
+                max_age=ttl,
+            )
+            transfer_manager.upload_chunks_concurrently(
+                source.as_posix(),
+                self._blob,
+                content_type=mime_type,
+                chunk_size=BLOB_CHUNK,
+                worker_type=transfer_manager.THREAD,
+                max_workers=max(1, settings.PUBLISH_WORKERS),
+            )
+            return
         log.info(f"Uploading blob: {source.name}", blob_name=self.name, max_age=ttl)
         self._blob.upload_from_filename(source, content_type=mime_type)
 
@@ -134,9 +227,14 @@ class AnonymousGoogleCloudBackend(GoogleCloudBackend):
 
 
 class FileSystemObject(ArchiveObject):
+    """A file in the archive directory. The checksum and metadata it was published
+    with are kept in a hidden file next to it, so that they can be compared without
+    reading the object."""
+
     def __init__(self, backend: "FileSystemBackend", name: str) -> None:
         self.backend = backend
         self.path = settings.ARCHIVE_PATH / name
+        self.meta_path = self.path.with_name(f".{self.path.name}.meta.json")
         self.name = name
 
     def exists(self) -> bool:
@@ -147,8 +245,31 @@ class FileSystemObject(ArchiveObject):
             return 0
         return self.path.stat().st_size
 
+    def _read_meta(self) -> Optional[Dict[str, Any]]:
+        if not self.path.is_file() or not self.meta_path.is_file():
+            return None
+        with open(self.meta_path, "r") as fh:
+            return cast(Dict[str, Any], json.load(fh))
+
+    def checksum(self) -> Optional[str]:
+        if not self.path.is_file():
+            return None
+        meta = self._read_meta()
+        if meta is not None:
+            return str(meta["md5"])
+        return file_md5(self.path)
+
+    def is_published(
+        self,
+        checksum: str,
+        mime_type: Optional[str] = None,
+        ttl: Optional[int] = None,
+    ) -> bool:
+        meta = self._read_meta()
+        return meta == {"md5": checksum, "mime_type": mime_type, "ttl": ttl}
+
     def open(self) -> TextIO:
-        return open(self.path, "r", buffering=BLOB_CHUNK)
+        return wrap_reader(self.name, open(self.path, "rb", buffering=BLOB_CHUNK))
 
     def backfill(self, dest: Path) -> None:
         log.info(
@@ -163,6 +284,7 @@ class FileSystemObject(ArchiveObject):
         source: Path,
         mime_type: str | None = None,
         ttl: Optional[int] = None,
+        checksum: Optional[str] = None,
     ) -> None:
         log.info(
             f"Copying file: {self.path.name} to archive",
@@ -170,7 +292,36 @@ class FileSystemObject(ArchiveObject):
             dest=self.path,
         )
         self.path.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copyfile(source, self.path)
+        # Write to a temporary file, so an interrupted copy never leaves behind a
+        # truncated object, and drop the old metadata first so it is never taken
+        # to describe the new content:
+        self.meta_path.unlink(missing_ok=True)
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        if is_multipart(source):
+            self._copy_parts(source, tmp_path)
+        else:
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, self.path)
+        if checksum is None:
+            checksum = file_md5(self.path)
+        meta = {"md5": checksum, "mime_type": mime_type, "ttl": ttl}
+        with open(self.meta_path, "w") as fh:
+            json.dump(meta, fh)
+
+    def _copy_parts(self, source: Path, dest: Path) -> None:
+        # Mirrors the concurrent uploads of large files to GCS:
+        size = source.stat().st_size
+        with open(source, "rb") as src, open(dest, "wb") as dst:
+            dst.truncate(size)
+
+            def copy_part(offset: int) -> None:
+                length = min(BLOB_CHUNK, size - offset)
+                data = os.pread(src.fileno(), length, offset)
+                os.pwrite(dst.fileno(), data, offset)
+
+            workers = max(1, settings.PUBLISH_WORKERS)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(copy_part, range(0, size, BLOB_CHUNK)))
 
     def republish(self, source: str) -> None:
         source_path = settings.ARCHIVE_PATH / source
@@ -180,7 +331,11 @@ class FileSystemObject(ArchiveObject):
             dest=self.path,
         )
         self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.meta_path.unlink(missing_ok=True)
         shutil.copyfile(source_path, self.path)
+        source_meta = FileSystemObject(self.backend, source).meta_path
+        if source_meta.is_file():
+            shutil.copyfile(source_meta, self.meta_path)
 
 
 class FileSystemBackend(ArchiveBackend):
@@ -0,0 +1,67 @@
+import io
+import gzip
+from importlib import import_module
+from pathlib import Path
+from typing import Any, BinaryIO, Optional, TextIO, cast
+from normality.encoding import DEFAULT_ENCODING
+
+from zavod.exc import ConfigurationException
+
+GZIP = ".gz"
+ZSTD = ".zst"
+COMPRESSIONS = (GZIP, ZSTD)
+# Size of the buffered reads and writes on the compressed stream:
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def compression_suffix(name: str) -> Optional[str]:
+    """Get the compression suffix of the given file name, if any."""
+    for suffix in COMPRESSIONS:
+        if name.endswith(suffix):
+            return suffix
+    return None
+
+
+def _zstandard() -> Any:
+    # zstandard is an optional dependency, install with `zavod[zstd]`:
+    try:
+        return import_module("zstandard")
+    except ImportError as exc:
+        raise ConfigurationException("zstd compression requires: zstandard") from exc
+
+
+def wrap_reader(name: str, fh: BinaryIO) -> TextIO:
+    """Wrap a binary stream in a text reader, decompressing it on the fly based on
+    the file name extension. Memory use is constant regardless of file size."""
+    suffix = compression_suffix(name)
+    stream: Any = fh
+    if suffix == GZIP:
+        stream = gzip.GzipFile(fileobj=fh, mode="rb")
+        stream.myfileobj = fh
+    elif suffix == ZSTD:
+        dctx = _zstandard().ZstdDecompressor()
+        stream = dctx.stream_reader(fh, read_size=CHUNK_SIZE, closefd=True)
+    stream = io.BufferedReader(stream, buffer_size=CHUNK_SIZE)
+    return cast(TextIO, io.TextIOWrapper(stream, encoding=DEFAULT_ENCODING))
+
+
+def open_read(path: Path) -> TextIO:
+    """Open a local, possibly compressed, text file for reading."""
+    return wrap_reader(path.name, open(path, "rb"))
+
+
+def open_write(path: Path) -> TextIO:
+    """Open a local text file for writing, compressing it based on the file name
+    extension."""
+    suffix = compression_suffix(path.name)
+    fh = open(path, "wb")
+    stream: Any = fh
+    if suffix == GZIP:
+        stream = gzip.GzipFile(fileobj=fh, mode="wb", compresslevel=6)
+        # GzipFile doesn't close a file object it didn't open itself:
+        stream.myfileobj = fh
+    elif suffix == ZSTD:
+        cctx = _zstandard().ZstdCompressor(level=9, threads=-1)
+        stream = cctx.stream_writer(fh, closefd=True)
+    stream = io.BufferedWriter(stream, buffer_size=CHUNK_SIZE)
+    return cast(TextIO, io.TextIOWrapper(stream, encoding=DEFAULT_ENCODING))
@@ -22,6 +22,7 @@ from zavod.runtime.versions import make_version
 from zavod.publish import publish_dataset, publish_failure
 from zavod.tools.load_db import load_dataset_to_db
 from zavod.tools.dump_file import dump_dataset_to_file
+from zavod.exporters.parquet import PARQUET
 from zavod.tools.summarize import summarize as _summarize
 from zavod.exc import RunFailedException
 from zavod.reset import reset_caches
@@ -30,7 +31,7 @@ from zavod.validators import validate_dataset
 
 
 log = get_logger(__name__)
-STMT_FORMATS = click.Choice(FORMATS, case_sensitive=False)
+STMT_FORMATS = click.Choice(FORMATS + [PARQUET], case_sensitive=False)
 
 
 def _load_dataset(path: Path) -> Dataset:
@@ -138,9 +139,10 @@ def run(
         publish_failure(dataset, latest=latest)
         sys.exit(0)
     # Crawl
+    unchanged = False
     if dataset.entry_point is not None and not dataset.is_collection:
         try:
-            crawl_dataset(dataset, dry_run=False)
+            unchanged = crawl_dataset(dataset, dry_run=False).unchanged
         except RunFailedException:
             publish_failure(dataset, latest=latest)
             sys.exit(1)
@@ -152,9 +154,10 @@ def run(
     store = get_store(dataset, linker)
     # Validate
     try:
-        store.sync(clear=True)
+        store.sync(incremental=True)
         view = store.view(dataset, external=False)
-        if not dataset.is_collection:
+        # Statements re-used from the previous version were validated back then:
+        if not dataset.is_collection and not unchanged:
             validate_dataset(dataset, view)
     except Exception:
         log.exception("Validation failed for %r" % dataset.name)
@@ -1,8 +1,11 @@
 import orjson
 from pathlib import Path
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
 from functools import cached_property
 from typing import Any, Optional, Union, Dict, List
+from typing import Callable, Deque, Generator, Iterable, Tuple, TypeVar
 from requests import Response
 from prefixdate import DatePrefix
 from lxml import html, etree
@@ -11,6 +14,7 @@ from followthemoney.schema import Schema
 from followthemoney.util import make_entity_id
 from nomenklatura.versions import Version
 from nomenklatura.cache import Cache
+from nomenklatura.statement import Statement
 from nomenklatura.util import PathLike
 from rigour.urls import build_url, ParamsType
 from structlog.contextvars import clear_contextvars, bind_contextvars
@@ -20,19 +24,26 @@ from zavod.audit import inspect
 from zavod.meta import Dataset, DataResource
 from zavod.entity import Entity
 from zavod.archive import dataset_resource_path, dataset_data_path
+from zavod.archive import iter_previous_statements
 from zavod.runtime.versions import get_latest
 from zavod.runtime.stats import ContextStats
 from zavod.runtime.sink import DatasetSink
 from zavod.runtime.issues import DatasetIssues
 from zavod.runtime.resources import DatasetResources
+from zavod.runtime.sources import DatasetSources
 from zavod.runtime.timestamps import TimeStampIndex
 from zavod.runtime.cache import get_cache
 from zavod.runtime.versions import make_version
 from zavod.runtime.http_ import fetch_file, make_session, request_hash
+from zavod.runtime.http_ import revalidate_file, validators_key
+from zavod.runtime.http_ import conditional_headers, response_validators
+from zavod.runtime.http_ import HostLimiter, get_rate_limiter
 from zavod.runtime.http_ import _Auth, _Headers, _Body
 from zavod.logs import get_logger
 from zavod.util import join_slug, prefixed_hash_id
 
+T = TypeVar("T")
+
 
 class Context:
     """The context is a utility object that is passed as an argument into crawlers
@@ -52,10 +63,13 @@ class Context:
         self.sink = DatasetSink(dataset)
         self.issues = DatasetIssues(dataset)
         self.resources = DatasetResources(dataset)
+        self.sources = DatasetSources(dataset)
         self.log = get_logger(dataset.name)
         self.http = make_session(dataset.http)
         self._cache: Optional[Cache] = None
         self._timestamps: Optional[TimeStampIndex] = None
+        self._timestamps_future: Optional[Future[TimeStampIndex]] = None
+        self._timestamps_executor: Optional[ThreadPoolExecutor] = None
 
         self._data_time: datetime = settings.RUN_TIME
         # If the dataset has a fixed end time which is in the past,
@@ -87,9 +101,31 @@ class Context:
         """An index of the first_seen time of every statement previous emitted by
         the dataset. This is used to determine if a statement is new or not."""
         if self._timestamps is None:
-            self._timestamps = TimeStampIndex.build(self.dataset)
+            if self._timestamps_future is not None:
+                try:
+                    self._timestamps = self._timestamps_future.result()
+                finally:
+                    self._stop_preload()
+            else:
+                self._timestamps = TimeStampIndex.build(self.dataset)
         return self._timestamps
 
+    def preload_timestamps(self) -> None:
+        """Start building the timestamp index in a background thread, so that the
+        crawler can start fetching data while the previous version is indexed."""
+        if self._timestamps is not None or self._timestamps_future is not None:
+            return
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="timestamps")
+        self._timestamps_future = executor.submit(TimeStampIndex.build, self.dataset)
+        self._timestamps_executor = executor
+
+    def _stop_preload(self) -> None:
+        # Join the builder thread, so that it isn't running when workers are forked:
+        if self._timestamps_executor is not None:
+            self._timestamps_executor.shutdown(wait=True)
+            self._timestamps_executor = None
+        self._timestamps_future = None
+
     @property
     def data_url(self) -> str:
         """The URL of the source data for the dataset."""
@@ -112,7 +148,8 @@ class Context:
     def data_time(self, value: datetime) -> None:
         """Modify the data time."""
         self._data_time = value
-        del self.data_time_iso
+        # Reset the cached ISO representation, if it was computed:
+        self.__dict__.pop("data_time_iso", None)
 
     @cached_property
     def data_time_iso(self) -> str:
@@ -133,20 +170,41 @@ class Context:
         if clear and not self.dry_run:
             self.resources.clear()
             self.issues.clear()
+        if not self.dry_run:
+            self.sources.clear()
         self.stats.reset()
 
     def close(self) -> None:
         """Flush and tear down the context."""
+        limiter = get_rate_limiter(self.http)
+        if limiter is not None and limiter.waits > 0:
+            self.log.info(
+                "HTTP rate limit waits",
+                requests=limiter.requests,
+                waits=limiter.waits,
+                wait_time=round(limiter.wait_time, 2),
+                throttled=limiter.throttled,
+            )
         self.http.close()
         if self._cache is not None:
             self._cache.close()
+        if self._timestamps_future is not None:
+            # Wait for the background build to release the index:
+            try:
+                self._timestamps = self._timestamps_future.result()
+            except Exception as exc:
+                self.log.warning("Timestamp index build failed: %s" % exc)
+            self._stop_preload()
         if self._timestamps is not None:
             self._timestamps.close()
+            self._timestamps = None
         self.sink.close()
         clear_contextvars()
         self.issues.close()
         if not self.dry_run:
             self.issues.export()
+            if self.sources.enabled:
+                self.sources.save()
 
     def get_resource_path(self, name: PathLike) -> Path:
         """Get the path to a file in the dataset data folder.
@@ -186,10 +244,18 @@ class Context:
         headers: Optional[Any] = None,
         method: str = "GET",
         data: _Body = None,
+        revalidate: bool = False,
     ) -> Path:
         """Fetch a URL into a file located in the current run folder,
-        if it does not exist."""
-        return fetch_file(
+        if it does not exist. With `revalidate`, an existing file is instead
+        checked against the server and downloaded again if it has changed
+        (see `revalidate_resource`)."""
+        if revalidate:
+            if method != "GET" or data is not None:
+                raise ValueError("Only GET requests can be revalidated.")
+            path, _ = self.revalidate_resource(name, url, auth=auth, headers=headers)
+            return path
+        path = fetch_file(
             self.http,
             url,
             name,
@@ -199,6 +265,95 @@ class Context:
             method=method,
             data=data,
         )
+        if not self.dry_run:
+            self.sources.add_file(request_hash(url, method=method, data=data), path)
+        return path
+
+    def revalidate_resource(
+        self,
+        name: str,
+        url: str,
+        auth: _Auth = None,
+        headers: _Headers = None,
+    ) -> Tuple[Path, bool]:
+        """Fetch a URL into a file located in the current run folder. If the file
+        already exists, the `ETag` and `Last-Modified` headers of the previous
+        download are used to make a conditional request, so that an unchanged
+        file costs a single `304 Not Modified` response.
+
+        Args:
+            name: The file name of the resource.
+            url: The URL to be fetched.
+            auth: HTTP basic authorization username and password to be included.
+            headers: HTTP request headers to be included.
+
+        Returns:
+            A tuple of the file path and whether the file has changed since it
+            was last downloaded.
+        """
+        path = dataset_data_path(self.dataset.name).joinpath(name)
+        key = validators_key(request_hash(url, auth=auth))
+        validators = self.cache.get_json(key)
+        changed, validators = revalidate_file(
+            self.http, url, path, validators, auth=auth, headers=headers
+        )
+        if changed:
+            self.cache.set_json(key, validators)
+        else:
+            self.log.info("Resource has not changed", url=url, path=path.as_posix())
+        if not self.dry_run:
+            self.sources.add_file(request_hash(url), path)
+        return path, changed
+
+    def skip_unchanged(self) -> bool:
+        """Re-use the statements of the latest published version of the dataset if
+        the source files fetched so far (via `fetch_resource`), the dataset
+        metadata and the crawler code are all identical to those of that version.
+        The statements are emitted with an updated `last_seen` time, so the crawler
+        can return without parsing the source data again:
+
+            path = context.fetch_resource("source.xml", URL)
+            if context.skip_unchanged():
+                return
+
+        Returns:
+            Whether the previous statements were emitted instead of running the
+            crawler.
+        """
+        if self.dry_run:
+            return False
+        # Publish the fingerprint, so that the next crawl can be compared to it:
+        self.sources.enabled = True
+        if not settings.REUSE_UNCHANGED:
+            return False
+        version = self.sources.unchanged()
+        if version is None:
+            return False
+        self.log.info("Sources are unchanged, re-using statements", version=version)
+        batch: List[Statement] = []
+        target = False
+        for stmt in iter_previous_statements(self.dataset, version=version):
+            if len(batch) and batch[-1].entity_id != stmt.entity_id:
+                self.sink.emit_many(batch)
+                self.stats.targets += int(target)
+                batch = []
+                target = False
+            if stmt.prop == Statement.BASE:
+                self.stats.entities += 1
+            # The target flag given to emit() isn't stored with the statements, so
+            # it is derived from the topics, like `Entity.target`:
+            if stmt.prop == "topics" and stmt.value in settings.TARGET_TOPICS:
+                target = True
+            if stmt.first_seen != self.data_time_iso:
+                self.stats.changed += 1
+            stmt.last_seen = self.data_time_iso
+            batch.append(stmt)
+            self.stats.statements += 1
+        if len(batch):
+            self.sink.emit_many(batch)
+            self.stats.targets += int(target)
+        self.stats.unchanged = True
+        return True
 
     def fetch_response(
         self,
@@ -260,7 +415,9 @@ class Context:
     ) -> Optional[str]:
         """Execute an HTTP request using the contexts' session and return
         the decoded response body. If a `cache_days` argument is provided, a
-        cache will be used for the given number of days.
+        cache will be used for the given number of days. Once a cached GET
+        response has expired, it is revalidated with the server using its
+        `ETag` or `Last-Modified` headers, and re-used if it hasn't changed.
 
         Args:
             url: The URL to be fetched.
@@ -275,34 +432,151 @@ class Context:
             The decoded response body as a string.
         """
         url = build_url(url, params)
+        fingerprint = request_hash(url, auth=auth, method=method, data=data)
+        stale: Optional[str] = None
+        validators: Optional[Dict[str, str]] = None
 
         if cache_days is not None:
-            fingerprint = request_hash(url, auth=auth, method=method, data=data)
-            text = None
-
-            if method == "GET":
-                # keeping the old caching keys that was GET requests only
-                text = self.cache.get(url, max_age=cache_days)
-
-            if text is None:
-                # if the old cache is empty, try to get the cache by fingerprint
-                text = self.cache.get(fingerprint, max_age=cache_days)
-
+            text = self._get_cached(
+                url, cache_days, auth=auth, method=method, data=data
+            )
             if text is not None:
-                self.log.debug("HTTP cache hit", url=url, fingerprint=fingerprint)
                 return text
+            if method == "GET":
+                # An expired response can be revalidated with the server:
+                validators = self.cache.get_json(validators_key(fingerprint))
+                if validators is not None:
+                    stale = self.cache.get(fingerprint)
+                    if stale is not None:
+                        headers = conditional_headers(headers, validators)
 
         response = self.fetch_response(
             url, headers=headers, auth=auth, method=method, data=data
         )
+        if response.status_code == 304 and stale is not None:
+            self.log.debug("HTTP cache revalidated", url=url)
+            self.cache.set(fingerprint, stale)
+            return stale
         text = response.text
         if text is None:
             return None
 
         if cache_days is not None:
             self.cache.set(fingerprint, text)
+            if method == "GET":
+                validators = response_validators(response)
+                if len(validators):
+                    self.cache.set_json(validators_key(fingerprint), validators)
         return text
 
+    def _get_cached(
+        self,
+        url: str,
+        cache_days: int,
+        auth: _Auth = None,
+        method: str = "GET",
+        data: _Body = None,
+    ) -> Optional[str]:
+        fingerprint = request_hash(url, auth=auth, method=method, data=data)
+        text = None
+
+        if method == "GET":
+            # keeping the old caching keys that was GET requests only
+            text = self.cache.get(url, max_age=cache_days)
+
+        if text is None:
+            # if the old cache is empty, try to get the cache by fingerprint
+            text = self.cache.get(fingerprint, max_age=cache_days)
+
+        if text is not None:
+            self.log.debug("HTTP cache hit", url=url, fingerprint=fingerprint)
+        return text
+
+    def fetch_many(
+        self,
+        urls: Iterable[str],
+        headers: _Headers = None,
+        auth: _Auth = None,
+        cache_days: Optional[int] = None,
+        method: str = "GET",
+        data: _Body = None,
+        ordered: bool = True,
+        workers: Optional[int] = None,
+    ) -> Generator[Tuple[str, Optional[str]], None, None]:
+        """Execute a batch of HTTP requests concurrently using the contexts' session
+        and yield the URL and decoded response body of each. Requests are run by a
+        bounded pool of threads, and the number of concurrent requests to each host
+        is limited by the `http.max_concurrency` dataset metadata. If a `cache_days`
+        argument is provided, a cache will be used for the given number of days.
+
+        Args:
+            urls: The URLs to be fetched.
+            headers: HTTP request headers to be included.
+            auth: HTTP basic authorization username and password to be included.
+            cache_days: Number of days to retain cached responses for. `None` to disable.
+            method: The HTTP method to use for the requests.
+            data: The data to be sent in the request bodies.
+            ordered: Yield the responses in the order of the given URLs, rather than
+                as they complete.
+            workers: Number of threads used to run requests, defaults to the
+                `ZAVOD_HTTP_FETCH_WORKERS` setting.
+
+        Returns:
+            A generator of tuples of the URL and the decoded response body.
+        """
+        if workers is None:
+            workers = settings.HTTP_FETCH_WORKERS
+        limiter = HostLimiter(self.dataset.http.max_concurrency)
+
+        def fetch(url: str) -> Optional[str]:
+            with limiter.acquire(url):
+                response = self.fetch_response(
+                    url, headers=headers, auth=auth, method=method, data=data
+                )
+                return response.text
+
+        # Each pending request is tracked as (url, future, is it a cache miss):
+        pending: Deque[Tuple[str, "Future[Optional[str]]", bool]] = deque()
+
+        def take() -> Tuple[str, Optional[str]]:
+            if ordered:
+                entry = pending.popleft()
+            else:
+                wait([e[1] for e in pending], return_when=FIRST_COMPLETED)
+                entry = next(e for e in pending if e[1].done())
+                pending.remove(entry)
+            url, future, miss = entry
+            text = future.result()
+            # The cache isn't thread-safe, so it is only used from this thread:
+            if miss and cache_days is not None and text is not None:
+                fingerprint = request_hash(url, auth=auth, method=method, data=data)
+                self.cache.set(fingerprint, text)
+            return url, text
+
+        window = max(1, workers) * 2
+        pool = ThreadPoolExecutor(
+            max_workers=max(1, workers), thread_name_prefix="fetch"
+        )
+        try:
+            for url in urls:
+                text = None
+                if cache_days is not None:
+                    text = self._get_cached(
+                        url, cache_days, auth=auth, method=method, data=data
+                    )
+                if text is not None:
+                    future: Future[Optional[str]] = Future()
+                    future.set_result(text)
+                else:
+                    future = pool.submit(fetch, url)
+                pending.append((url, future, text is None))
+                while len(pending) >= window:
+                    yield take()
+            while len(pending):
+                yield take()
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
     def fetch_json(
         self,
         url: str,
@@ -542,11 +816,17 @@ class Context:
         if target:
             self.stats.targets += 1
         if self.stats.entities % 10000 == 0:
+            self.stats.sink_backlog = self.sink.backlog
             self.log.info(
                 "Emitted %s entities" % self.stats.entities,
                 statements=self.stats.statements,
+                backlog=self.stats.sink_backlog,
             )
-        stamps = {} if self.dry_run else self.timestamps.get(entity.id)
+        stamps: Dict[str, str] = {}
+        if not self.dry_run:
+            stmt_ids = (stmt.id for stmt in entity.statements if stmt.id is not None)
+            stamps = self.timestamps.get(entity.id, stmt_ids)
+        statements: List[Statement] = []
         for stmt in entity.statements:
             if stmt.id is None:
                 self.log.warn("Statement has no ID", stmt=stmt.to_dict())
@@ -561,9 +841,41 @@ class Context:
             if stmt.first_seen != self.data_time_iso:
                 self.stats.changed += 1
             stmt.last_seen = self.data_time_iso
-            if not self.dry_run:
-                self.sink.emit(stmt)
-            self.stats.statements += 1
+            statements.append(stmt)
+        self.stats.statements += len(statements)
+        if not self.dry_run:
+            self.sink.emit_many(statements)
+
+    def map_shards(
+        self,
+        items: Iterable[T],
+        fn: Callable[["Context", T], None],
+        workers: Optional[int] = None,
+    ) -> None:
+        """Run a crawl function for each of a set of independent items (e.g. the
+        archive files of a source) in parallel worker processes. Each shard gets
+        its own context, and the entities and issues it emits are merged into this
+        context once it completes, in the order of the items.
+
+        Shard functions should only emit entities and log issues, and must be
+        defined at the module level so that they can be passed to the workers.
+
+        Args:
+            items: The items to be processed, which must be picklable.
+            fn: A function called with a shard context and one item.
+            workers: Number of processes to use, defaults to the
+                `ZAVOD_SHARD_WORKERS` setting. With one worker, the items are
+                processed in this process.
+        """
+        if workers is None:
+            workers = settings.SHARD_WORKERS
+        if workers <= 1:
+            for item in items:
+                fn(self, item)
+            return
+        from zavod.runtime.shards import run_shards
+
+        run_shards(self, items, fn, workers)
 
     def __hash__(self) -> int:
         return hash(self.dataset.name)
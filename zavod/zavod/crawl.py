@@ -25,6 +25,8 @@ def crawl_dataset(dataset: Dataset, dry_run: bool = False) -> ContextStats:
 
     try:
         context.begin(clear=True)
+        if not dry_run:
+            context.preload_timestamps()
         context.log.info(
             "Running dataset",
             data_path=dataset_data_path(dataset.name),
@@ -43,6 +45,7 @@ def crawl_dataset(dataset: Dataset, dry_run: bool = False) -> ContextStats:
             entities=context.stats.entities,
             statements=context.stats.statements,
             changed=context.stats.changed,
+            unchanged=context.stats.unchanged,
         )
         if settings.DEBUG:
             context.debug_lookups()
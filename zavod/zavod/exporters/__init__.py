@@ -1,7 +1,8 @@
-from typing import List, Dict, Type, Set
+from typing import List, Dict, Type, Set, Optional
 
+from zavod import settings
 from zavod.logs import get_logger
-from zavod.store import View
+from zavod.store import View, CachedView
 from zavod.context import Context
 from zavod.meta import Dataset
 from zavod.exporters.common import Exporter
@@ -13,7 +14,9 @@ from zavod.exporters.senzing import SenzingExporter
 from zavod.exporters.statistics import StatisticsExporter
 from zavod.exporters.securities import SecuritiesExporter
 from zavod.exporters.statements import StatementsCSVExporter
+from zavod.exporters.parquet import StatementsParquetExporter
 from zavod.exporters.delta import DeltaExporter
+from zavod.exporters.pipeline import export_parallel
 from zavod.exporters.metadata import write_dataset_index, write_issues
 from zavod.exporters.metadata import write_catalog, write_delta_index
 
@@ -37,13 +40,28 @@ EXPORTERS: Dict[str, Type[Exporter]] = {
     SenzingExporter.FILE_NAME: SenzingExporter,
     SecuritiesExporter.FILE_NAME: SecuritiesExporter,
     StatementsCSVExporter.FILE_NAME: StatementsCSVExporter,
+    StatementsParquetExporter.FILE_NAME: StatementsParquetExporter,
     DeltaExporter.FILE_NAME: DeltaExporter,
 }
 
 __all__ = ["export_dataset", "write_dataset_index", "write_issues"]
 
 
-def export_data(context: Context, view: View) -> None:
+def export_data(context: Context, view: View, parallel: Optional[bool] = None) -> None:
+    """Feed all entities in the view to the exporters configured for the dataset.
+
+    Args:
+        context: The context of the dataset being exported.
+        view: The store view to read entities from.
+        parallel: Run each exporter in a worker thread. Defaults to the
+            `ZAVOD_EXPORT_PARALLEL` setting.
+    """
+    if parallel is None:
+        parallel = settings.EXPORT_PARALLEL
+    cached: Optional[CachedView] = None
+    if settings.EXPORT_ADJACENT_CACHE > 0:
+        cached = CachedView(view, settings.EXPORT_ADJACENT_CACHE)
+        view = cached
     exporter_names = set(context.dataset.exports)
     if not len(exporter_names):
         exporter_names.update(DEFAULT_EXPORTERS)
@@ -60,18 +78,38 @@ def export_data(context: Context, view: View) -> None:
         "Exporting dataset...",
         dataset=context.dataset.name,
         exporters=len(exporters),
+        parallel=parallel,
     )
-    for exporter in exporters:
-        exporter.setup()
+    ready: List[Exporter] = []
+    try:
+        for exporter in exporters:
+            exporter.setup()
+            ready.append(exporter)
+
+        if parallel:
+            export_parallel(context, view, exporters, settings.EXPORT_QUEUE_SIZE)
+        else:
+            for idx, entity in enumerate(view.entities()):
+                if idx > 0 and idx % 10000 == 0:
+                    log.info(
+                        "Exported %s entities..." % idx, dataset=context.dataset.name
+                    )
+                for exporter in exporters:
+                    exporter.feed(entity)
 
-    for idx, entity in enumerate(view.entities()):
-        if idx > 0 and idx % 10000 == 0:
-            log.info("Exported %s entities..." % idx, dataset=context.dataset.name)
         for exporter in exporters:
-            exporter.feed(entity)
+            exporter.finish()
+    finally:
+        for exporter in ready:
+            exporter.close()
 
-    for exporter in exporters:
-        exporter.finish()
+    if cached is not None:
+        log.info(
+            "Adjacency cache usage",
+            dataset=context.dataset.name,
+            hits=cached.hits,
+            misses=cached.misses,
+        )
 
 
 def export_dataset(dataset: Dataset, view: View) -> None:
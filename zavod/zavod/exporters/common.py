@@ -23,6 +23,11 @@ class Exporter(object):
     def feed(self, entity: Entity) -> None:
         raise NotImplementedError()
 
+    def close(self) -> None:
+        """Release temporary files and other resources held by the exporter. This
+        is called after `finish`, and also if the export has failed."""
+        pass
+
     def finish(self) -> None:
         try:
             resource = self.context.export_resource(
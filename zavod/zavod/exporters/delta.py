@@ -1,12 +1,23 @@
-from typing import Any, Generator
+import orjson
+from zavod import settings
 from zavod.entity import Entity
-from zavod.archive import DELTA_EXPORT_FILE
+from zavod.archive import DELTA_EXPORT_FILE, dataset_state_path
 from zavod.exporters.common import Exporter
-from zavod.runtime.delta import HashDelta
-from zavod.util import write_json
+from zavod.runtime.delta import HashDelta, SortedHashes
+from zavod.util import write_json, json_default
+
+JSON_OPTIONS = orjson.OPT_NON_STR_KEYS
 
 
 class DeltaExporter(Exporter):
+    """Export the entities added, modified or deleted since the previous version.
+
+    While entities are fed, those which may have changed are serialized to a spool
+    file, and their offset in it is indexed by ID. Once the delta has been computed,
+    the changes are written in ID order by reading each entity back from the spool,
+    so they don't have to be loaded from the store again.
+    """
+
     TITLE = "Delta files"
     FILE_NAME = DELTA_EXPORT_FILE
     MIME_TYPE = "application/json"
@@ -15,6 +26,12 @@ class DeltaExporter(Exporter):
         super().setup()
         self.delta = HashDelta(self.dataset)
         self.delta.backfill()
+        state_path = dataset_state_path(self.dataset.name)
+        self.spool_path = state_path / "delta_spool.json"
+        self.spool = open(self.spool_path, "w+b")
+        self.offsets = SortedHashes(
+            state_path / "delta_offsets", settings.DELTA_MEMORY_LIMIT
+        )
         self.counts = {
             "ADD": 0,
             "MOD": 0,
@@ -22,24 +39,39 @@ class DeltaExporter(Exporter):
         }
 
     def feed(self, entity: Entity) -> None:
-        self.delta.feed(entity)
-
-    def generate(self) -> Generator[Any, None, None]:
-        for op, entity_id in self.delta.generate():
-            if op == "DEL":
-                yield {"op": "DEL", "entity": {"id": entity_id}}
-                continue
-            entity = self.view.get_entity(entity_id)
-            if entity is None:  # watman
-                continue
-            yield {"op": op, "entity": entity.to_dict()}
+        if entity.id is None or not self.delta.feed(entity):
+            return
+        self.offsets.add(entity.id, str(self.spool.tell()))
+        self.spool.write(
+            orjson.dumps(entity.to_dict(), option=JSON_OPTIONS, default=json_default)
+        )
+        self.spool.write(b"\n")
 
     def finish(self) -> None:
+        self.spool.flush()
+        # Both the delta and the offsets are iterated in ID order:
+        offsets = iter(self.offsets)
+        offset = next(offsets, None)
         with open(self.path, "wb") as fh:
-            for op in self.generate():
-                self.counts[op["op"]] += 1
-                write_json(op, fh)
-        self.delta.close()
+            for op, entity_id in self.delta.generate():
+                if op == "DEL":
+                    self.counts[op] += 1
+                    write_json({"op": "DEL", "entity": {"id": entity_id}}, fh)
+                    continue
+                while offset is not None and offset[0] < entity_id:
+                    offset = next(offsets, None)
+                if offset is None or offset[0] != entity_id:
+                    self.context.log.warning(
+                        "Delta entity was not exported, skipping",
+                        entity_id=entity_id,
+                        op=op,
+                    )
+                    continue
+                self.counts[op] += 1
+                self.spool.seek(int(offset[1]))
+                data = self.spool.readline().rstrip(b"\n")
+                fh.write(b'{"op":"%s","entity":%s}\n' % (op.encode(), data))
+        self.close()
         self.context.log.info(
             "Delta export complete",
             version=str(self.context.version),
@@ -51,3 +83,10 @@ class DeltaExporter(Exporter):
         )
 
         super().finish()
+
+    def close(self) -> None:
+        if not self.spool.closed:
+            self.spool.close()
+            self.delta.close()
+        self.spool_path.unlink(missing_ok=True)
+        self.offsets.clear()
@@ -1,9 +1,25 @@
+from collections import OrderedDict
+from time import perf_counter
+from typing import Any, Dict, FrozenSet, List, Set, Tuple
+
+from zavod import settings
 from zavod.exporters.common import Exporter
 from zavod.util import write_json
 from zavod.entity import Entity
 
+NestedData = Dict[str, Any]
+CacheEntry = Tuple[NestedData, FrozenSet[str], FrozenSet[str]]
+
 
 class NestedTargetsJSONExporter(Exporter):
+    """Export each target with its adjacent entities nested into its properties.
+
+    This produces the same output as `Entity.to_nested_dict`, but keeps an LRU
+    cache of nested adjacent entities (e.g. sanctions or shared owners), so that
+    they are not re-assembled for every target referencing them. The nesting depth
+    and the number of nested entities per property can be capped.
+    """
+
     TITLE = "Targets as nested JSON"
     FILE_NAME = "targets.nested.json"
     MIME_TYPE = "application/json"
@@ -11,12 +27,86 @@ class NestedTargetsJSONExporter(Exporter):
     def setup(self) -> None:
         super().setup()
         self.fh = open(self.path, "wb")
+        self.depth = settings.NESTED_DEPTH
+        self.max_fanout = settings.NESTED_MAX_FANOUT
+        self.cache_size = settings.NESTED_CACHE_SIZE
+        self.cache: OrderedDict[Tuple[str, int], CacheEntry] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.truncated = 0
+        self.targets = 0
+        self.seconds = 0.0
+
+    def _nest(
+        self, entity: Entity, depth: int, path: List[str]
+    ) -> Tuple[NestedData, Set[str]]:
+        # Returns the nested entity and the IDs of all adjacent entities that were
+        # considered for nesting into it, including those skipped as ancestors.
+        next_depth = depth if entity.schema.edge else depth - 1
+        next_path = list(path)
+        if entity.id is not None:
+            next_path.append(entity.id)
+        data = entity.to_dict()
+        touched: Set[str] = set()
+        if next_depth < 0:
+            return data, touched
+        nested: Dict[str, List[Any]] = {}
+        for prop, adjacent in self.view.get_adjacent(entity):
+            if adjacent.id is not None:
+                touched.add(adjacent.id)
+            if adjacent.id in next_path:
+                continue
+            values = nested.setdefault(prop.name, [])
+            if self.max_fanout > 0 and len(values) >= self.max_fanout:
+                self.truncated += 1
+                continue
+            value, adjacent_touched = self._nest_adjacent(
+                adjacent, next_depth, next_path
+            )
+            touched.update(adjacent_touched)
+            values.append(value)
+        data["properties"].update(nested)
+        return data, touched
+
+    def _nest_adjacent(
+        self, entity: Entity, depth: int, path: List[str]
+    ) -> Tuple[NestedData, Set[str]]:
+        if entity.id is None or self.cache_size <= 0:
+            return self._nest(entity, depth, path)
+        # A cached entity can be re-used if the same adjacent entities are
+        # excluded for being ancestors on the current path:
+        key = (entity.id, depth)
+        cached = self.cache.get(key)
+        if cached is not None:
+            data, touched, excluded = cached
+            if touched.intersection(path) == excluded:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return data, set(touched)
+        self.misses += 1
+        data, touched_set = self._nest(entity, depth, path)
+        touched = frozenset(touched_set)
+        self.cache[key] = (data, touched, touched.intersection(path))
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return data, touched_set
 
     def feed(self, entity: Entity) -> None:
         if entity.target:
-            data = entity.to_nested_dict(self.view)
+            start = perf_counter()
+            data, _ = self._nest(entity, self.depth, [])
+            self.seconds += perf_counter() - start
+            self.targets += 1
             write_json(data, self.fh)
 
     def finish(self) -> None:
         self.fh.close()
+        self.context.log.info(
+            "Nested %d targets in %.2fs" % (self.targets, self.seconds),
+            dataset=self.dataset.name,
+            cache_hits=self.hits,
+            cache_misses=self.misses,
+            truncated=self.truncated,
+        )
         super().finish()
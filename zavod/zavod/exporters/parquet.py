@@ -0,0 +1,102 @@
+from importlib import import_module
+from typing import Any, BinaryIO, Dict, List, Optional, Union, cast
+from nomenklatura.statement import Statement
+
+from zavod.entity import Entity
+from zavod.exc import ConfigurationException
+from zavod.exporters.common import Exporter
+
+PARQUET = "parquet"
+# Number of statements buffered in memory and written as one Parquet row group:
+ROW_GROUP_SIZE = 250_000
+# Columns with few distinct values, which are dictionary-encoded:
+DICTIONARY_COLUMNS = [
+    "prop",
+    "prop_type",
+    "schema",
+    "dataset",
+    "lang",
+    "first_seen",
+    "last_seen",
+]
+COLUMNS = [
+    "id",
+    "entity_id",
+    "canonical_id",
+    "prop",
+    "prop_type",
+    "schema",
+    "value",
+    "dataset",
+    "lang",
+    "original_value",
+    "external",
+    "first_seen",
+    "last_seen",
+]
+
+
+def _pyarrow() -> Any:
+    # pyarrow is only imported once a Parquet file is written:
+    try:
+        import_module("pyarrow.parquet")
+        return import_module("pyarrow")
+    except ImportError as exc:
+        raise ConfigurationException("Parquet export requires: pyarrow") from exc
+
+
+class ParquetStatementWriter(object):
+    """Write statements to a Parquet file in row groups of `ROW_GROUP_SIZE`, so
+    that memory use is bounded regardless of the number of statements. Columns
+    like `prop` and `dataset` are dictionary-encoded."""
+
+    def __init__(self, fh: Union[BinaryIO, str]) -> None:
+        self.pa = _pyarrow()
+        fields = [(c, self.pa.string()) for c in COLUMNS if c != "external"]
+        fields.insert(COLUMNS.index("external"), ("external", self.pa.bool_()))
+        self.schema = self.pa.schema(fields)
+        self.writer = self.pa.parquet.ParquetWriter(
+            fh,
+            self.schema,
+            compression="zstd",
+            use_dictionary=DICTIONARY_COLUMNS,
+        )
+        self.columns: Dict[str, List[Optional[Any]]] = {c: [] for c in COLUMNS}
+
+    def write(self, stmt: Statement) -> None:
+        data = cast(Dict[str, Any], stmt.to_dict())
+        for column, values in self.columns.items():
+            values.append(data[column])
+        if len(self.columns["id"]) >= ROW_GROUP_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if not len(self.columns["id"]):
+            return
+        table = self.pa.table(self.columns, schema=self.schema)
+        self.writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+        self.columns = {c: [] for c in COLUMNS}
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.close()
+
+
+class StatementsParquetExporter(Exporter):
+    TITLE = "Statement-based granular Parquet"
+    FILE_NAME = "statements.parquet"
+    MIME_TYPE = "application/vnd.apache.parquet"
+
+    def setup(self) -> None:
+        super().setup()
+        self.fh = open(self.path, "wb")
+        self.writer = ParquetStatementWriter(self.fh)
+
+    def feed(self, entity: Entity) -> None:
+        for stmt in entity.statements:
+            self.writer.write(stmt)
+
+    def finish(self) -> None:
+        self.writer.close()
+        self.fh.close()
+        super().finish()
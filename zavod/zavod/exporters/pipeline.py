@@ -0,0 +1,90 @@
+from time import perf_counter
+from queue import Queue
+from threading import Thread
+from typing import List, Optional
+
+from zavod.logs import get_logger
+from zavod.entity import Entity
+from zavod.store import View
+from zavod.context import Context
+from zavod.exporters.common import Exporter
+
+log = get_logger(__name__)
+
+
+class ExportWorker(Thread):
+    """Run a single exporter in its own thread, fed from a bounded queue so that
+    the entity iteration cannot run away from a slow exporter."""
+
+    def __init__(self, exporter: Exporter, queue_size: int) -> None:
+        name = f"export-{exporter.FILE_NAME}"
+        super().__init__(name=name, daemon=True)
+        self.exporter = exporter
+        self.queue: Queue[Optional[Entity]] = Queue(maxsize=queue_size)
+        self.error: Optional[BaseException] = None
+        self.count = 0
+        self.busy = 0.0
+
+    def run(self) -> None:
+        while True:
+            entity = self.queue.get()
+            if entity is None:
+                return
+            # Keep draining the queue after a failure so the producer never
+            # blocks on a dead worker:
+            if self.error is not None:
+                continue
+            start = perf_counter()
+            try:
+                self.exporter.feed(entity)
+            except BaseException as exc:
+                self.error = exc
+            self.busy += perf_counter() - start
+            self.count += 1
+
+    def check(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+
+def export_parallel(
+    context: Context, view: View, exporters: List[Exporter], queue_size: int
+) -> None:
+    """Fan out each entity to all exporters, each running in a worker thread. The
+    exporters see the entities in the same order as in the serial export, so the
+    generated files are identical."""
+    workers = [ExportWorker(exporter, queue_size) for exporter in exporters]
+    for worker in workers:
+        worker.start()
+
+    start = perf_counter()
+    idx = 0
+    try:
+        for idx, entity in enumerate(view.entities(), 1):
+            if idx % 10000 == 0:
+                log.info(
+                    "Exported %s entities..." % idx,
+                    dataset=context.dataset.name,
+                    backlog=max(w.queue.qsize() for w in workers),
+                )
+            for worker in workers:
+                worker.check()
+                worker.queue.put(entity)
+    finally:
+        for worker in workers:
+            worker.queue.put(None)
+        for worker in workers:
+            worker.join()
+
+    for worker in workers:
+        worker.check()
+    elapsed = perf_counter() - start
+    for worker in workers:
+        log.info(
+            "Exporter throughput: %s" % worker.exporter.FILE_NAME,
+            dataset=context.dataset.name,
+            entities=worker.count,
+            busy=round(worker.busy, 2),
+            elapsed=round(elapsed, 2),
+            rate=round(worker.count / max(worker.busy, 0.001), 1),
+        )
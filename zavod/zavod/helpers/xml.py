@@ -1,4 +1,9 @@
+from zipfile import ZipFile
+from contextlib import ExitStack
+from typing import IO, BinaryIO, Dict, Generator, Optional, Union, cast
 from lxml import etree
+from nomenklatura.util import PathLike
+
 from zavod.util import ElementOrTree
 
 
@@ -28,3 +33,64 @@ def remove_namespace(el: ElementOrTree) -> ElementOrTree:
                 elem.attrib[local_key] = value
     etree.cleanup_namespaces(el)
     return el
+
+
+def _resolve_tag(tag: str, namespaces: Optional[Dict[str, str]]) -> str:
+    if tag.startswith("{"):
+        return tag
+    if ":" in tag:
+        prefix, local = tag.split(":", 1)
+        if namespaces is None or prefix not in namespaces:
+            raise ValueError("Unknown namespace prefix: %r" % tag)
+        return f"{{{namespaces[prefix]}}}{local}"
+    return f"{{*}}{tag}"
+
+
+def iter_xml_elements(
+    source: Union[PathLike, BinaryIO],
+    tag: str,
+    namespaces: Optional[Dict[str, str]] = None,
+    member: Optional[str] = None,
+) -> Generator[etree._Element, None, None]:
+    """Stream the elements with a given tag from an XML document, without loading
+    the whole document into memory. Each element is cleared after it has been
+    processed, along with its preceding siblings, so that memory use remains
+    constant for very large files.
+
+    Elements must be fully processed before the next one is requested, and
+    matching elements must not be nested inside each other.
+
+    Args:
+        source: A file path or a binary file handle of the XML document, or the
+            path of a ZIP archive if `member` is given.
+        tag: The tag of the elements to yield. Either a local name, which matches
+            any namespace, a prefixed name like `x:name`, or a `{uri}name` tag.
+        namespaces: A mapping of namespace prefixes to URIs.
+        member: The name of the XML document inside the ZIP archive at `source`.
+
+    Returns:
+        A generator of the matching elements.
+    """
+    with ExitStack() as stack:
+        if hasattr(source, "read"):
+            if member is not None:
+                raise ValueError("A ZIP member requires an archive path.")
+            fh: IO[bytes] = cast(BinaryIO, source)
+        elif member is not None:
+            archive = stack.enter_context(ZipFile(source, "r"))
+            fh = stack.enter_context(archive.open(member, "r"))
+        else:
+            fh = stack.enter_context(open(source, "rb"))
+        events = etree.iterparse(
+            fh,
+            events=("end",),
+            tag=_resolve_tag(tag, namespaces),
+            huge_tree=True,
+        )
+        for _, elem in events:
+            yield elem
+            elem.clear(keep_tail=True)
+            parent = elem.getparent()
+            if parent is not None:
+                while elem.getprevious() is not None:
+                    del parent[0]
@@ -1,10 +1,18 @@
 import csv
 import duckdb
 import logging
+import multiprocessing
+from time import perf_counter
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from importlib import import_module
+from hashlib import sha1
 from io import TextIOWrapper
 from pathlib import Path
 from shutil import rmtree
-from typing import Any, Dict, Generator, Iterable, List, Optional, Tuple
+from typing import Any, Deque, Dict, Generator, Iterable, List, Optional, Sequence
+from typing import Tuple
+from followthemoney import model
 from followthemoney.types import registry
 from nomenklatura.dataset import DS
 from nomenklatura.entity import CE
@@ -12,17 +20,33 @@ from nomenklatura.index.common import BaseIndex
 from nomenklatura.resolver import Pair, Identifier
 from nomenklatura.store import View
 
-from zavod.integration.tokenizer import tokenize_entity
+from zavod import settings
+from zavod.integration.tokenizer import tokenize_entity, tokenize_values
 from zavod.integration.tokenizer import NAME_PART_FIELD, WORD_FIELD, PHONETIC_FIELD
+from zavod.integration.tokenizer import TOKENIZER_VERSION
 
 BlockingMatches = List[Tuple[Identifier, float]]
 
 log = logging.getLogger(__name__)
 
 BATCH_SIZE = 1000
+# Number of entities tokenized in one batch, locally or by a worker process:
+TOKENIZE_BATCH_SIZE = 1000
+# Number of token rows buffered before they are loaded into the database:
+LOAD_BATCH_SIZE = 100_000
 
+# Columns of (entity ID, field, token) rows:
+TokenColumns = Tuple[List[str], List[str], List[str]]
+# The ID, schema and matchable (property, value) pairs of an entity:
+EntityValues = Tuple[str, str, List[Tuple[str, str]]]
+# Tables derived from the token entries, in the order they are built:
+FREQUENCY_TABLES = ["token_caps", "stopwords", "field_len", "mentions"]
+FREQUENCY_TABLES.append("term_frequencies")
 
-def csv_writer(fh: TextIOWrapper) -> Any:  # Any because csv writer types seem to be special
+
+def csv_writer(
+    fh: TextIOWrapper,
+) -> Any:  # Any because csv writer types seem to be special
     return csv.writer(
         fh,
         dialect=csv.unix_dialect,
@@ -31,6 +55,123 @@ def csv_writer(fh: TextIOWrapper) -> Any:  # Any because csv writer types seem t
     )
 
 
+def _pyarrow() -> Any:
+    # Without pyarrow, tokens are bulk loaded via a CSV file, which is slower:
+    try:
+        return import_module("pyarrow")
+    except ImportError:
+        log.warning("pyarrow is not installed, loading tokens via a CSV file.")
+        return None
+
+
+def _entity_values(entity: CE) -> EntityValues:
+    assert entity.id is not None
+    values = [(p.name, v) for p, v in entity.itervalues() if p.matchable]
+    return entity.id, entity.schema.name, values
+
+
+def _values_digest(values: EntityValues) -> str:
+    """Fingerprint the tokenized values of an entity, to detect changes. The
+    tokenizer version is included, so that a persistent index built by another
+    version of the tokenizer is re-tokenized."""
+    _, schema, props = values
+    digest = sha1(f"{TOKENIZER_VERSION}:{schema}".encode("utf-8"))
+    for prop, value in sorted(props):
+        digest.update(f"\n{prop}:{value}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _tokenize_batch(batch: List[EntityValues]) -> TokenColumns:
+    ids: List[str] = []
+    fields: List[str] = []
+    tokens: List[str] = []
+    for entity_id, schema_name, values in batch:
+        schema = model.get(schema_name)
+        assert schema is not None, schema_name
+        props = ((schema.properties[prop], value) for prop, value in values)
+        for field, token in tokenize_values(props):
+            ids.append(entity_id)
+            fields.append(field)
+            tokens.append(token)
+    return ids, fields, tokens
+
+
+class TokenLoader(object):
+    """Buffer (id, field, token) rows in columns and bulk load them into a table,
+    as Arrow tables if pyarrow is installed, or via a CSV file otherwise."""
+
+    def __init__(
+        self,
+        con: duckdb.DuckDBPyConnection,
+        table: str,
+        path: Path,
+        names: Sequence[str] = ("id", "field", "token"),
+    ):
+        self.con = con
+        self.table = table
+        self.path = path
+        self.names = names
+        self.pa = _pyarrow()
+        self.columns: List[List[str]] = [[] for _ in names]
+        self.rows = 0
+        self.fh: Optional[TextIOWrapper] = None
+        if self.pa is None:
+            self.path.unlink(missing_ok=True)
+            self.fh = open(self.path, "w")
+            self.writer = csv_writer(self.fh)
+
+    def add(self, entity_id: str, tokens: Iterable[Tuple[str, str]]) -> None:
+        """Add the tokens of an entity."""
+        ids, fields, values = self.columns
+        for field, token in tokens:
+            ids.append(entity_id)
+            fields.append(field)
+            values.append(token)
+        if len(ids) >= LOAD_BATCH_SIZE:
+            self.flush()
+
+    def append(self, row: Sequence[str]) -> None:
+        """Add a single row."""
+        for column, value in zip(self.columns, row):
+            column.append(value)
+        if len(self.columns[0]) >= LOAD_BATCH_SIZE:
+            self.flush()
+
+    def extend(self, columns: Sequence[List[str]]) -> None:
+        """Add a batch of rows in columnar form."""
+        for column, values in zip(self.columns, columns):
+            column.extend(values)
+        if len(self.columns[0]) >= LOAD_BATCH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if not len(self.columns[0]):
+            return
+        self.rows += len(self.columns[0])
+        if self.pa is not None:
+            batch = self.pa.table(dict(zip(self.names, self.columns)))
+            self.con.register("token_batch", batch)
+            names = ", ".join(self.names)
+            self.con.execute(
+                f"INSERT INTO {self.table} SELECT {names} FROM token_batch"
+            )
+            self.con.unregister("token_batch")
+        else:
+            self.writer.writerows(zip(*self.columns))
+        self.columns = [[] for _ in self.names]
+
+    def close(self) -> None:
+        """Load all remaining rows into the table."""
+        self.flush()
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+            self.con.execute(
+                f"COPY {self.table} FROM '{self.path}' "
+                "(HEADER false, AUTO_DETECT false, ESCAPE '\\')"
+            )
+
+
 class DuckDBIndex(BaseIndex[DS, CE]):
     """
     An index using DuckDB for token matching and scoring, keeping data in memory
@@ -38,6 +179,11 @@ class DuckDBIndex(BaseIndex[DS, CE]):
 
     Pairs match if they share one or more tokens. A basic similarity score is calculated
     cumulatively based on each token's Term Frequency (TF) and the field's boost factor.
+
+    A persistent index is kept in `data_dir` between runs. It records the version
+    of the view it was built from, and a digest of the values of each entity, so
+    that only the tokens of entities which were added, changed or removed since
+    the last build need to be updated.
     """
 
     BOOSTS = {
@@ -54,10 +200,15 @@ class DuckDBIndex(BaseIndex[DS, CE]):
     __slots__ = "view", "fields", "tokenizer", "entities"
 
     def __init__(
-        self, view: View[DS, CE], data_dir: Path, options: Dict[str, Any] = {}
+        self,
+        view: View[DS, CE],
+        data_dir: Path,
+        options: Dict[str, Any] = {},
+        persistent: bool = False,
     ):
         self.view = view
-        memory_budget = options.get("memory_budget", None)
+        self.persistent = persistent
+        memory_budget = options.get("memory_budget", settings.INDEX_MEMORY_BUDGET)
         # https://duckdb.org/docs/guides/performance/environment
         # > For ideal performance,
         # > aggregation-heavy workloads require approx. 5 GB memory per thread and
@@ -67,90 +218,249 @@ class DuckDBIndex(BaseIndex[DS, CE]):
             int(memory_budget) if memory_budget else None
         )
         """Memory budget in megabytes"""
+        self.threads = int(options.get("threads", settings.INDEX_THREADS))
+        """Number of threads used by DuckDB, e.g. for the self-join in `pairs`"""
+        max_token_freq = options.get("max_token_freq", settings.INDEX_MAX_TOKEN_FREQ)
+        self.max_token_freq: Dict[Optional[str], int] = {}
+        """Tokens occurring more often than this, either for all fields or by
+        field name, are treated as stopwords"""
+        if isinstance(max_token_freq, dict):
+            self.max_token_freq.update({f: int(c) for f, c in max_token_freq.items()})
+        elif max_token_freq:
+            self.max_token_freq[None] = int(max_token_freq)
         self.max_candidates = int(options.get("max_candidates", 50))
         self.stopwords_pct: float = float(options.get("stopwords_pct", 0.8))
+        self.tokenize_workers = int(
+            options.get("tokenize_workers", settings.INDEX_TOKENIZE_WORKERS)
+        )
+        """Number of processes used to tokenize the entities of the view"""
         self.data_dir = data_dir.resolve()
-        if self.data_dir.exists():
-            rmtree(self.data_dir)
-        self.data_dir.mkdir(parents=True)
         data_file = self.data_dir / "index.duckdb"
         tmp_dir = self.data_dir / "index.duckdb.tmp"
+        if self.data_dir.exists():
+            if persistent and data_file.exists():
+                rmtree(tmp_dir, ignore_errors=True)
+            else:
+                rmtree(self.data_dir)
+        self.data_dir.mkdir(parents=True, exist_ok=True)
         config = {
             "preserve_insertion_order": False,
             # > If you have a limited amount of memory, try to limit the number of threads
-            "threads": 1,
+            "threads": self.threads,
             "temp_directory": tmp_dir.as_posix(),
         }
         if self.memory_budget is not None:
             config["max_memory"] = f"{self.memory_budget}MB"
         self.con = duckdb.connect(data_file.as_posix(), config=config)
-        self.matching_path = self.data_dir / "matching.csv"
-        self.matching_path.unlink(missing_ok=True)
-        self.matching_dump: TextIOWrapper | None = open(self.matching_path, "w")
-        writer = csv_writer(self.matching_dump)
-        writer.writerow(["id", "field", "token"])
-
-    def build(self) -> None:
-        """Index all entities in the dataset."""
+        self.con.execute("DROP TABLE IF EXISTS matching")
+        self.con.execute("CREATE TABLE matching (id TEXT, field TEXT, token TEXT)")
+        matching_path = self.data_dir / "matching.csv"
+        self.matching: Optional[TokenLoader] = TokenLoader(
+            self.con, "matching", matching_path
+        )
+
+    def build(self, version: Optional[str] = None) -> None:
+        """Index all entities in the dataset.
+
+        Args:
+            version: Identifies the contents of the view. A persistent index that
+                was built from the same version is re-used as it is.
+        """
         log.info("Building index from: %r...", self.view)
-        self.con.execute("CREATE TABLE boosts (field TEXT, boost FLOAT)")
+        self.con.execute("CREATE OR REPLACE TABLE boosts (field TEXT, boost FLOAT)")
         for field, boost in self.BOOSTS.items():
             self.con.execute("INSERT INTO boosts VALUES (?, ?)", [field, boost])
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        options = repr(
+            (self.stopwords_pct, sorted(self.max_token_freq.items(), key=str))
+        )
+        state = dict(self.con.execute("SELECT key, value FROM state").fetchall())
+        if self.persistent and "version" in state:
+            if version is not None and state.get("version") == version:
+                if state.get("options") != options:
+                    self._build_frequencies()
+                    self._set_state("options", options)
+                log.info("Index is up to date (version: %s).", version)
+                return
+            self._update()
+        else:
+            self._build_entries()
+            self._build_frequencies()
+        self._set_state("options", options)
+        self._set_state("version", version or "")
+        log.info("Index built.")
 
-        self.con.execute("CREATE TABLE matching (id TEXT, field TEXT, token TEXT)")
+    def _set_state(self, key: str, value: str) -> None:
+        self.con.execute("INSERT OR REPLACE INTO state VALUES (?, ?)", [key, value])
+
+    def _build_entries(self) -> None:
+        for table in ("entries", "digests"):
+            self.con.execute(f"DROP TABLE IF EXISTS {table}")
         self.con.execute("CREATE TABLE entries (id TEXT, field TEXT, token TEXT)")
-        csv_path = self.data_dir / "mentions.csv"
-        log.info("Dumping entity tokens to CSV for bulk load into the database...")
-        with open(csv_path, "w") as fh:
-            writer = csv_writer(fh)
-            for idx, entity in enumerate(self.view.entities()):
-                if not entity.schema.matchable or entity.id is None:
-                    continue
-                for field, token in tokenize_entity(entity):
-                    writer.writerow([entity.id, field, token])
-
-                if idx % 50000 == 0 and idx > 0:
-                    log.info("Dumped %s entities" % idx)
+        self.con.execute("CREATE TABLE digests (id TEXT, digest TEXT)")
+        loader = TokenLoader(self.con, "entries", self.data_dir / "mentions.csv")
+        digests = TokenLoader(
+            self.con, "digests", self.data_dir / "digests.csv", ("id", "digest")
+        )
+        log.info(
+            "Tokenizing entities (workers: %d, arrow: %s)...",
+            self.tokenize_workers,
+            loader.pa is not None,
+        )
+        for columns in self._tokenize(self._batches(self.view.entities(), digests)):
+            loader.extend(columns)
         log.info("Loading data...")
+        loader.close()
+        digests.close()
+        log.info("Done, %d tokens.", loader.rows)
+
+    def _update(self) -> None:
+        """Update the tokens of the entities which have changed since the index
+        was built, and the term frequencies of those entities."""
+        log.info("Updating index...")
+        self.con.execute("DROP TABLE IF EXISTS current")
+        self.con.execute("CREATE TABLE current (id TEXT, digest TEXT)")
+        current = TokenLoader(
+            self.con, "current", self.data_dir / "digests.csv", ("id", "digest")
+        )
+        for _ in self._batches(self.view.entities(), current):
+            pass
+        current.close()
         self.con.execute(
-            f"COPY entries FROM '{csv_path}' (HEADER false, AUTO_DETECT false, ESCAPE '\\')"
+            """
+            CREATE OR REPLACE TABLE stale AS
+            SELECT id FROM (
+                SELECT id, digest FROM digests
+                EXCEPT
+                SELECT id, digest FROM current
+            )
+            UNION
+            SELECT id FROM (
+                SELECT id, digest FROM current
+                EXCEPT
+                SELECT id, digest FROM digests
+            )
+            """
         )
-        log.info("Done.")
+        changed = self.con.execute(
+            """
+            SELECT current.id FROM current
+            JOIN stale ON stale.id = current.id
+            """
+        ).fetchall()
+        stale = self.con.execute("SELECT count(*) FROM stale").fetchone()
+        assert stale is not None
+        log.info("%d entities have changed, %d are stale.", len(changed), stale[0])
+        self.con.execute("DELETE FROM entries WHERE id IN (SELECT id FROM stale)")
+        loader = TokenLoader(self.con, "entries", self.data_dir / "mentions.csv")
+        entities = (self.view.get_entity(id) for (id,) in changed)
+        batches = self._batches((e for e in entities if e is not None))
+        for columns in self._tokenize(batches):
+            loader.extend(columns)
+        loader.close()
+        self.con.execute("DROP TABLE digests")
+        self.con.execute("ALTER TABLE current RENAME TO digests")
+        self._update_frequencies()
+        self.con.execute("DROP TABLE stale")
 
-        self._build_frequencies()
-        log.info("Index built.")
+    def _batches(
+        self, entities: Iterable[CE], digests: Optional[TokenLoader] = None
+    ) -> Generator[List[EntityValues], None, None]:
+        batch: List[EntityValues] = []
+        for idx, entity in enumerate(entities):
+            if idx % 50000 == 0 and idx > 0:
+                log.info("Tokenized %s entities" % idx)
+            if not entity.schema.matchable or entity.id is None:
+                continue
+            values = _entity_values(entity)
+            if digests is not None:
+                digests.append((entity.id, _values_digest(values)))
+            batch.append(values)
+            if len(batch) >= TOKENIZE_BATCH_SIZE:
+                yield batch
+                batch = []
+        if len(batch):
+            yield batch
+
+    def _tokenize(
+        self, batches: Iterable[List[EntityValues]]
+    ) -> Generator[TokenColumns, None, None]:
+        """Tokenize entities in batches, in a pool of worker processes if more than
+        one worker is configured. The batches are returned in order."""
+        if self.tokenize_workers <= 1:
+            for batch in batches:
+                yield _tokenize_batch(batch)
+            return
+        # The DuckDB connection runs threads of its own, so the workers are started
+        # from a fork server rather than forked from this process:
+        mp_context = multiprocessing.get_context("forkserver")
+        pool = ProcessPoolExecutor(self.tokenize_workers, mp_context=mp_context)
+        try:
+            pending: Deque[Future[TokenColumns]] = deque()
+            for batch in batches:
+                pending.append(pool.submit(_tokenize_batch, batch))
+                # Bound the number of batches in flight to cap memory use:
+                if len(pending) >= self.tokenize_workers * 2:
+                    yield pending.popleft().result()
+            while len(pending):
+                yield pending.popleft().result()
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
 
-    def _build_field_len(self) -> None:
+    def _build_table(self, table: str, query: str, stale: bool, id_col: str) -> None:
+        """Create a table from a query with a `{filter}` placeholder, or update the
+        rows of the stale entities only."""
+        if not stale:
+            self.con.execute(f"CREATE TABLE {table} AS {query.format(filter='')}")
+            return
+        self.con.execute(f"DELETE FROM {table} WHERE id IN (SELECT id FROM stale)")
+        filter = f"AND {id_col} IN (SELECT id FROM stale)"
+        self.con.execute(f"INSERT INTO {table} {query.format(filter=filter)}")
+
+    def _build_field_len(self, stale: bool = False) -> None:
         log.info("Calculating field lengths...")
         field_len_query = """
-            CREATE TABLE IF NOT EXISTS field_len as
             SELECT entries.field, entries.id, count(*) as field_len from entries
             LEFT OUTER JOIN stopwords
             ON stopwords.field = entries.field AND stopwords.token = entries.token
-            WHERE token_freq is NULL
+            WHERE token_freq is NULL {filter}
             GROUP BY entries.field, entries.id
         """
-        self.con.execute(field_len_query)
+        self._build_table("field_len", field_len_query, stale, "entries.id")
 
-    def _build_mentions(self) -> None:
+    def _build_mentions(self, stale: bool = False) -> None:
         log.info("Calculating mention counts...")
         mentions_query = """
-            CREATE TABLE IF NOT EXISTS mentions as
             SELECT entries.field, entries.id, entries.token, count(*) as mentions
             FROM entries
             LEFT OUTER JOIN stopwords
             ON stopwords.field = entries.field AND stopwords.token = entries.token
-            WHERE token_freq is NULL
+            WHERE token_freq is NULL {filter}
             GROUP BY entries.field, entries.id, entries.token
         """
-        self.con.execute(mentions_query)
+        self._build_table("mentions", mentions_query, stale, "entries.id")
+
+    def _build_term_frequencies(self, stale: bool = False) -> None:
+        log.info("Calculating term frequencies...")
+        term_frequencies_query = """
+            SELECT mentions.field, mentions.token, mentions.id, mentions/field_len as tf
+            FROM field_len
+            JOIN mentions
+            ON field_len.field = mentions.field AND field_len.id = mentions.id
+            {filter}
+        """
+        self._build_table(
+            "term_frequencies", term_frequencies_query, stale, "mentions.id"
+        )
 
     def _build_stopwords(self) -> None:
         token_freq_query = """
             SELECT field, token, count(*) as token_freq
             FROM entries
             GROUP BY field, token
-            ORDER BY token_freq DESC
+            ORDER BY token_freq DESC, field, token
         """
         token_freq = self.con.sql(token_freq_query)  # noqa
         num_tokens_results = self.con.execute(
@@ -164,13 +474,28 @@ class DuckDBIndex(BaseIndex[DS, CE]):
             limit,
             self.stopwords_pct,
         )
+        self.con.execute("CREATE TABLE token_caps (field TEXT, cap INTEGER)")
+        for field, cap in self.max_token_freq.items():
+            if field is not None:
+                self.con.execute("INSERT INTO token_caps VALUES (?, ?)", [field, cap])
+        # Capping the frequency of tokens bounds the size of the self-join in
+        # `pairs`, which grows quadratically with the frequency of a token:
         self.con.execute(
             """
-            CREATE TABLE IF NOT EXISTS stopwords as
-            SELECT * FROM token_freq LIMIT ?
+            CREATE TABLE stopwords as
+            SELECT * FROM (SELECT * FROM token_freq LIMIT ?)
+            UNION
+            SELECT token_freq.* FROM token_freq
+            LEFT OUTER JOIN token_caps
+            ON token_caps.field = token_freq.field
+            WHERE token_freq.token_freq > coalesce(token_caps.cap, ?)
             """,
-            [limit],
+            [limit, self.max_token_freq.get(None)],
         )
+        if len(self.max_token_freq):
+            capped = self.con.execute("SELECT count(*) FROM stopwords").fetchone()
+            assert capped is not None
+            log.info("%d stopwords including capped tokens.", capped[0])
         least_common_query = """
             SELECT field, token, token_freq
             FROM stopwords
@@ -184,18 +509,101 @@ class DuckDBIndex(BaseIndex[DS, CE]):
         log.info("5 Least common stopwords:\n%s\n", least_common)
 
     def _build_frequencies(self) -> None:
+        for table in FREQUENCY_TABLES:
+            self.con.execute(f"DROP TABLE IF EXISTS {table}")
         self._build_stopwords()
         self._build_field_len()
         self._build_mentions()
-        log.info("Calculating term frequencies...")
-        term_frequencies_query = """
-            CREATE TABLE IF NOT EXISTS term_frequencies as
-            SELECT mentions.field, mentions.token, mentions.id, mentions/field_len as tf
-            FROM field_len
-            JOIN mentions
-            ON field_len.field = mentions.field AND field_len.id = mentions.id
+        self._build_term_frequencies()
+        self.log_field_stats()
+
+    def _update_frequencies(self) -> None:
+        """Update the term frequencies of the stale entities. The stopwords are
+        global, so entities with a token which became or stopped being a stopword
+        are updated as well."""
+        self.con.execute(
+            "CREATE OR REPLACE TABLE previous_stopwords AS "
+            "SELECT field, token FROM stopwords"
+        )
+        for table in ("token_caps", "stopwords"):
+            self.con.execute(f"DROP TABLE IF EXISTS {table}")
+        self._build_stopwords()
+        self.con.execute(
+            """
+            CREATE OR REPLACE TABLE changed_stopwords AS
+            (
+                SELECT field, token FROM previous_stopwords
+                EXCEPT
+                SELECT field, token FROM stopwords
+            )
+            UNION
+            (
+                SELECT field, token FROM stopwords
+                EXCEPT
+                SELECT field, token FROM previous_stopwords
+            )
+            """
+        )
+        self.con.execute(
+            """
+            INSERT INTO stale
+            SELECT DISTINCT entries.id FROM entries
+            JOIN changed_stopwords
+            ON changed_stopwords.field = entries.field
+            AND changed_stopwords.token = entries.token
+            WHERE entries.id NOT IN (SELECT id FROM stale)
+            """
+        )
+        changed = self.con.execute("SELECT count(*) FROM changed_stopwords").fetchone()
+        stale = self.con.execute("SELECT count(*) FROM stale").fetchone()
+        assert changed is not None and stale is not None
+        log.info(
+            "%d stopwords have changed, updating %d entities...", changed[0], stale[0]
+        )
+        self._build_field_len(stale=True)
+        self._build_mentions(stale=True)
+        self._build_term_frequencies(stale=True)
+        for table in ("previous_stopwords", "changed_stopwords"):
+            self.con.execute(f"DROP TABLE {table}")
+        self.log_field_stats()
+
+    def field_stats(self) -> List[Dict[str, Any]]:
+        """Get the number of term frequency rows and distinct tokens of each field,
+        and the number of pairs each field contributes to the self-join in
+        `pairs`, which is useful to tune the field `BOOSTS` and token caps."""
+        stats_query = """
+            SELECT field, count(*) AS tokens, sum(n) AS rows,
+                sum(n * (n - 1) / 2) AS pairs, max(n) AS max_freq
+            FROM (
+                SELECT field, token, count(*) AS n
+                FROM term_frequencies
+                GROUP BY field, token
+            )
+            GROUP BY field
+            ORDER BY pairs DESC
         """
-        self.con.execute(term_frequencies_query)
+        stats: List[Dict[str, Any]] = []
+        for field, tokens, rows, pairs, max_freq in self.con.sql(
+            stats_query
+        ).fetchall():
+            stats.append(
+                {
+                    "field": field,
+                    "tokens": tokens,
+                    "rows": int(rows),
+                    "pairs": int(pairs),
+                    "max_freq": max_freq,
+                }
+            )
+        return stats
+
+    def log_field_stats(self) -> None:
+        for stat in self.field_stats():
+            log.info(
+                "Field %(field)s: %(rows)d rows, %(tokens)d tokens, "
+                "max frequency %(max_freq)d, %(pairs)d join pairs",
+                stat,
+            )
 
     def pairs(
         self, max_pairs: int = BaseIndex.MAX_PAIRS
@@ -212,28 +620,39 @@ class DuckDBIndex(BaseIndex[DS, CE]):
             ORDER BY score DESC
             LIMIT ?
         """
+        start = perf_counter()
         results = self.con.execute(pairs_query, [max_pairs])
+        log.info(
+            "Pairs query took %.2fs (threads: %d).",
+            perf_counter() - start,
+            self.threads,
+        )
+        count = 0
         while batch := results.fetchmany(BATCH_SIZE):
             for left, right, score in batch:
+                count += 1
                 yield (Identifier.get(left), Identifier.get(right)), score
+        log.info("Generated %d pairs in %.2fs.", count, perf_counter() - start)
 
     def add_matching_subject(self, entity: CE) -> None:
-        if self.matching_dump is None:
+        if self.matching is None:
             raise Exception("Cannot add matching subject after getting candidates.")
-        writer = csv_writer(self.matching_dump)
-        for field, token in tokenize_entity(entity):
-            writer.writerow([entity.id, field, token])
+        if entity.id is not None:
+            self.matching.add(entity.id, tokenize_entity(entity))
 
     def matches(
         self,
     ) -> Generator[Tuple[Identifier, BlockingMatches], None, None]:
-        if self.matching_dump is not None:
-            self.matching_dump.close()
-            self.matching_dump = None
+        """Get the top `max_candidates` candidates of each matching subject, by
+        descending score, grouped by subject."""
+        if self.matching is not None:
             log.info("Loading matching subjects...")
-            self.con.execute(f"COPY matching from '{self.matching_path}'")
+            self.matching.close()
+            self.matching = None
             log.info("Finished loading matching subjects.")
 
+        # Only the top `max_candidates` of each subject are returned, so that
+        # they can be cut off in the database rather than in Python:
         match_query = """
             SELECT matching.id, matches.id, sum(matches.tf * ifnull(boost, 1)) as score
             FROM term_frequencies as matches
@@ -242,9 +661,12 @@ class DuckDBIndex(BaseIndex[DS, CE]):
             LEFT OUTER JOIN boosts
             ON matches.field = boosts.field
             GROUP BY matches.id, matching.id
-            ORDER BY matching.id, score DESC
+            QUALIFY row_number() OVER (
+                PARTITION BY matching.id ORDER BY score DESC, matches.id
+            ) <= ?
+            ORDER BY matching.id, score DESC, matches.id
         """
-        results = self.con.execute(match_query)
+        results = self.con.execute(match_query, [self.max_candidates])
         previous_id = None
         matches: BlockingMatches = []
         while batch := results.fetchmany(BATCH_SIZE):
@@ -261,7 +683,11 @@ class DuckDBIndex(BaseIndex[DS, CE]):
                 matches.append((Identifier.get(match_id), score))
         # Last pair or subject and candidates
         if matches and previous_id is not None:
-            yield Identifier.get(previous_id), matches[: self.max_candidates]
+            yield Identifier.get(previous_id), matches
+
+    def close(self) -> None:
+        """Close the database, which persists a persistent index."""
+        self.con.close()
 
     def __repr__(self) -> str:
         return "<DuckDBIndex(%r, %r)>" % (
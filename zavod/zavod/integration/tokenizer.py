@@ -2,7 +2,9 @@ from normality import WS
 from rigour.ids import StrictFormat
 from rigour.text.phonetics import metaphone
 from rigour.text.scripts import is_modern_alphabet
-from typing import Generator, Set, Tuple
+from functools import lru_cache
+from typing import Generator, Iterable, List, Set, Tuple
+from followthemoney.property import Property
 from followthemoney.types import registry
 
 from nomenklatura.entity import CE
@@ -12,6 +14,11 @@ from nomenklatura.util import name_words, clean_text_basic
 WORD_FIELD = "wd"
 NAME_PART_FIELD = "np"
 PHONETIC_FIELD = "ph"
+# Increment when a change to the tokenizer changes the tokens of an entity, so
+# that persistent indexes are re-tokenized:
+TOKENIZER_VERSION = 1
+# Number of distinct names and texts whose normalised tokens are memoised:
+NORM_CACHE_SIZE = 200_000
 SKIP = (
     registry.url,
     registry.topic,
@@ -42,16 +49,43 @@ TEXT_TYPES = (
 )
 
 
-def tokenize_entity(entity: CE) -> Generator[Tuple[str, str], None, None]:
+@lru_cache(maxsize=NORM_CACHE_SIZE)
+def _text_words(value: str) -> Tuple[str, ...]:
+    return tuple(name_words(clean_text_basic(value), min_length=3))
+
+
+@lru_cache(maxsize=NORM_CACHE_SIZE)
+def _name_tokens(value: str) -> Tuple[Tuple[str, str], ...]:
+    norm = fingerprint_name(value)
+    if norm is None:
+        return ()
+    tokens: List[Tuple[str, str]] = [(registry.name.name, norm)]
+    alpha = is_modern_alphabet(value)
+    for token in norm.split(WS):
+        if len(token) > 2 and len(token) < 30:
+            tokens.append((NAME_PART_FIELD, norm))
+        if alpha and len(token) > 4:
+            phoneme = metaphone(token)
+            if len(phoneme) > 3:
+                tokens.append((PHONETIC_FIELD, phoneme))
+    return tuple(tokens)
+
+
+def tokenize_values(
+    values: Iterable[Tuple[Property, str]],
+) -> Generator[Tuple[str, str], None, None]:
+    """Generate the index tokens for the given property values of an entity. The
+    normalisation of text and name values is memoised, since names like "John"
+    or "Limited" recur across many entities."""
     unique: Set[Tuple[str, str]] = set()
-    for prop, value in entity.itervalues():
+    for prop, value in values:
         type = prop.type
         if not prop.matchable or type in SKIP:
             continue
         if type in EMIT_FULL:
             unique.add((type.name, value[:300].lower()))
         if type in TEXT_TYPES:
-            for word in name_words(clean_text_basic(value), min_length=3):
+            for word in _text_words(value):
                 yield WORD_FIELD, word
         if type == registry.date:
             if len(value) > 4:
@@ -59,17 +93,7 @@ def tokenize_entity(entity: CE) -> Generator[Tuple[str, str], None, None]:
             unique.add((type.name, value[:10]))
             continue
         if type == registry.name:
-            norm = fingerprint_name(value)
-            if norm is not None:
-                alpha = is_modern_alphabet(value)
-                unique.add((type.name, norm))
-                for token in norm.split(WS):
-                    if len(token) > 2 and len(token) < 30:
-                        unique.add((NAME_PART_FIELD, norm))
-                    if alpha and len(token) > 4:
-                        phoneme = metaphone(token)
-                        if len(phoneme) > 3:
-                            unique.add((PHONETIC_FIELD, phoneme))
+            unique.update(_name_tokens(value))
             continue
         if type == registry.identifier:
             clean_id = StrictFormat.normalize(value)
@@ -78,3 +102,7 @@ def tokenize_entity(entity: CE) -> Generator[Tuple[str, str], None, None]:
             continue
 
     yield from unique
+
+
+def tokenize_entity(entity: CE) -> Generator[Tuple[str, str], None, None]:
+    yield from tokenize_values(entity.itervalues())
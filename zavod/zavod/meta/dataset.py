@@ -110,6 +110,13 @@ class Dataset(NKDataset):
         self.dates: DatesSpec = DatesSpec(data.get("dates", {}))
         """Date parsing configuration for this dataset."""
 
+    def __getstate__(self) -> Dict[str, Any]:
+        # The cached lookups can't be pickled, e.g. to pass the dataset to a worker
+        # process:
+        state = dict(self.__dict__)
+        state.pop("lookups", None)
+        return state
+
     @cached_property
     def lookups(self) -> Dict[str, Lookup]:
         config = self._data.get("lookups", {})
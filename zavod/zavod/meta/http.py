@@ -1,4 +1,4 @@
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from urllib3.util import Retry
 from banal import ensure_list
 from zavod import settings
@@ -17,3 +17,9 @@ class HTTP(object):
         )
         self.retry_methods: List[str] = retry_methods
         self.user_agent: str = data.get("user_agent", settings.HTTP_USER_AGENT)
+        self.max_concurrency: int = int(data.get("max_concurrency", 4))
+        rate_limit = data.get("rate_limit")
+        self.rate_limit: Optional[float] = None
+        if rate_limit is not None:
+            self.rate_limit = float(rate_limit)
+        self.rate_burst: int = int(data.get("rate_burst", 1))
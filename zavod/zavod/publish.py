@@ -1,12 +1,16 @@
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
 from rigour.mime.types import JSON
 
+from zavod import settings
 from zavod.meta import Dataset
 from zavod.logs import get_logger
 from zavod.archive import publish_resource, dataset_resource_path
 from zavod.archive import publish_dataset_version, publish_artifact
 from zavod.archive import INDEX_FILE, CATALOG_FILE
-from zavod.archive import STATEMENTS_FILE, RESOURCES_FILE, STATISTICS_FILE
-from zavod.archive import VERSIONS_FILE, ARTIFACT_FILES
+from zavod.archive import STATEMENTS_FILES, RESOURCES_FILE, STATISTICS_FILE
+from zavod.archive import VERSIONS_FILE, SOURCES_FILE, ARTIFACT_FILES
 from zavod.archive import DELTA_EXPORT_FILE, DELTA_INDEX_FILE
 from zavod.runtime.resources import DatasetResources
 from zavod.runtime.versions import get_latest
@@ -15,26 +19,51 @@ from zavod.exporters import write_dataset_index, write_issues
 log = get_logger(__name__)
 
 
+def _run_uploads(uploads: List[Callable[[], None]]) -> None:
+    """Run a batch of uploads concurrently, and raise the first error (if any)
+    once all of them have finished."""
+    if settings.PUBLISH_WORKERS <= 1 or len(uploads) <= 1:
+        for upload in uploads:
+            upload()
+        return
+    with ThreadPoolExecutor(max_workers=settings.PUBLISH_WORKERS) as pool:
+        futures = [pool.submit(upload) for upload in uploads]
+    for future in futures:
+        future.result()
+
+
 def _publish_artifacts(dataset: Dataset) -> None:
     version = get_latest(dataset.name, backfill=False)
     if version is None:
         raise ValueError(f"No working version found for dataset: {dataset.name}")
+    uploads: List[Callable[[], None]] = []
     for artifact in ARTIFACT_FILES:
         path = dataset_resource_path(dataset.name, artifact)
         if path.is_file():
-            publish_artifact(
+            upload = partial(
+                publish_artifact,
                 path,
                 dataset.name,
                 version,
                 artifact,
                 mime_type=JSON if artifact.endswith(".json") else None,
             )
+            uploads.append(upload)
+    _run_uploads(uploads)
+    # The version history points to the artifacts, so it must be published last:
     publish_dataset_version(dataset.name)
 
 
 def publish_dataset(dataset: Dataset, latest: bool = True) -> None:
-    """Upload a dataset to the archive."""
+    """Upload a dataset to the archive.
+
+    Resources are uploaded concurrently, followed by the metadata files which
+    reference them, and then the version artifacts. Files whose content matches
+    the object already in the archive are skipped, so an interrupted publication
+    can be resumed by running it again.
+    """
     resources = DatasetResources(dataset)
+    uploads: List[Callable[[], None]] = []
     for resource in resources.all():
         if resource.name in ARTIFACT_FILES:
             # This is a bit hacky: the delta exporter and statistics exporter are
@@ -46,13 +75,18 @@ def publish_dataset(dataset: Dataset, latest: bool = True) -> None:
         if not path.is_file():
             log.error("Resource not found: %s" % path, dataset=dataset.name)
             continue
-        publish_resource(
+        upload = partial(
+            publish_resource,
             path,
             dataset.name,
             resource.name,
             latest=latest,
             mime_type=resource.mime_type,
         )
+        uploads.append(upload)
+    _run_uploads(uploads)
+
+    uploads = []
     files = [INDEX_FILE]
     if dataset.is_collection:
         files.extend([CATALOG_FILE])
@@ -62,7 +96,16 @@ def publish_dataset(dataset: Dataset, latest: bool = True) -> None:
             log.error("Metadata file not found: %s" % path, dataset=dataset.name)
             continue
         mime_type = JSON if meta.endswith(".json") else None
-        publish_resource(path, dataset.name, meta, latest=latest, mime_type=mime_type)
+        upload = partial(
+            publish_resource,
+            path,
+            dataset.name,
+            meta,
+            latest=latest,
+            mime_type=mime_type,
+        )
+        uploads.append(upload)
+    _run_uploads(uploads)
     _publish_artifacts(dataset)
 
 
@@ -71,11 +114,14 @@ def publish_failure(dataset: Dataset, latest: bool = True) -> None:
     # Clear out interim artifacts so they cannot pollute the metadata we're
     # generating.
     assert not dataset.is_collection
-    dataset_resource_path(dataset.name, STATEMENTS_FILE).unlink(missing_ok=True)
+    for statements_file in STATEMENTS_FILES:
+        dataset_resource_path(dataset.name, statements_file).unlink(missing_ok=True)
     dataset_resource_path(dataset.name, STATISTICS_FILE).unlink(missing_ok=True)
     dataset_resource_path(dataset.name, INDEX_FILE).unlink(missing_ok=True)
     dataset_resource_path(dataset.name, CATALOG_FILE).unlink(missing_ok=True)
     dataset_resource_path(dataset.name, RESOURCES_FILE).unlink(missing_ok=True)
+    # A failed run must not be used as the baseline for unchanged sources:
+    dataset_resource_path(dataset.name, SOURCES_FILE).unlink(missing_ok=True)
     dataset_resource_path(dataset.name, DELTA_EXPORT_FILE).unlink(missing_ok=True)
     dataset_resource_path(dataset.name, DELTA_INDEX_FILE).unlink(missing_ok=True)
     write_issues(dataset)
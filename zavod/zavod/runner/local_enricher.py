@@ -1,19 +1,25 @@
 from decimal import Decimal
 import logging
-from typing import Generator, List, Tuple
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from time import perf_counter
+from typing import Any, Deque, Dict, Generator, Iterable, List, Optional, Tuple
+from typing import Type, Union
 from followthemoney.types import registry
 from followthemoney.helpers import check_person_cutoff
 
 from nomenklatura.enrich.common import EnricherConfig
 from nomenklatura.enrich.common import EnrichmentException
 from nomenklatura.enrich.common import BaseEnricher
-from nomenklatura.matching import get_algorithm, LogicV1
+from nomenklatura.matching import get_algorithm, LogicV1, ScoringAlgorithm
 from nomenklatura.resolver import Identifier
 from nomenklatura.judgement import Judgement
 from nomenklatura.resolver import Resolver
 from nomenklatura.dataset import DS
 from nomenklatura.cache import Cache
 
+from zavod import settings
 from zavod.archive import dataset_state_path
 from zavod.context import Context
 from zavod.integration.dedupe import get_dataset_linker, get_resolver
@@ -24,6 +30,56 @@ from zavod.integration.duckdb_index import DuckDBIndex, BlockingMatches
 
 
 log = logging.getLogger(__name__)
+# Number of subjects whose candidates are scored in one batch by a worker:
+SCORING_BATCH_SIZE = 100
+
+# Subject and candidate entity data, as sent to the scoring workers:
+ScoringTask = Tuple[Dict[str, Any], List[Dict[str, Any]]]
+# The matches found for a subject, and the error raised while scoring them if any:
+ScoringResult = Tuple[List[Entity], Optional[EnrichmentException]]
+
+# Scoring configuration of a worker process, see `_init_scoring_worker`:
+_worker_config: Optional[Tuple[Any, Type[ScoringAlgorithm], float, int]] = None
+
+
+def _rank_matches(
+    algorithm: Type[ScoringAlgorithm],
+    cutoff: float,
+    limit: int,
+    entity: Entity,
+    matches: List[Entity],
+) -> List[int]:
+    """Score the candidate matches of an entity, and return the offsets of the
+    top `limit` candidates scoring above the cutoff, best first."""
+    scores: List[Tuple[float, int]] = []
+    for idx, match in enumerate(matches):
+        result = algorithm.compare(entity, match)
+        if result.score < cutoff:
+            continue
+        scores.append((result.score, idx))
+    scores.sort(key=lambda s: s[0], reverse=True)
+    return [idx for _, idx in scores[:limit]]
+
+
+def _init_scoring_worker(
+    dataset: Any, algorithm: Type[ScoringAlgorithm], cutoff: float, limit: int
+) -> None:
+    global _worker_config
+    _worker_config = (dataset, algorithm, cutoff, limit)
+
+
+def _score_batch(tasks: List[ScoringTask]) -> List[Union[List[int], str]]:
+    assert _worker_config is not None, "Scoring worker is not initialised"
+    dataset, algorithm, cutoff, limit = _worker_config
+    results: List[Union[List[int], str]] = []
+    for subject, candidates in tasks:
+        entity = Entity.from_data(dataset, subject)
+        matches = [Entity.from_data(dataset, c) for c in candidates]
+        try:
+            results.append(_rank_matches(algorithm, cutoff, limit, entity, matches))
+        except EnrichmentException as exc:
+            results.append(str(exc))
+    return results
 
 
 class LocalEnricher(BaseEnricher[DS]):
@@ -57,7 +113,11 @@ class LocalEnricher(BaseEnricher[DS]):
             bins to consider from a given search result.
           `algorithm`: `str` (default logic-v1) - the name of the algorithm
               to use for matching.
-          `index_options`: `dict` - options to pass to the index.
+          `workers`: `int` - (default `ZAVOD_ENRICH_WORKERS`) the number of
+            processes used to score match candidates.
+          `index_options`: `dict` - options to pass to the index, e.g.
+            `threads`, `memory_budget` (MB), `max_token_freq` and
+            `tokenize_workers`.
 
     """
 
@@ -67,13 +127,18 @@ class LocalEnricher(BaseEnricher[DS]):
         target_dataset = get_catalog().require(target_dataset_name)
         target_linker = get_dataset_linker(target_dataset)
         self.target_store = get_store(target_dataset, target_linker)
-        self.target_store.sync()
+        self.target_store.sync(incremental=True)
         self.target_view = self.target_store.view(target_dataset)
+        # The index is kept between runs and only updated for the entities which
+        # have changed in the target dataset:
         index_path = dataset_state_path(dataset.name) / "duckdb-enrich-index"
         self._index = DuckDBIndex(
-            self.target_view, index_path, config.get("index_options", {})
+            self.target_view,
+            index_path,
+            config.get("index_options", {}),
+            persistent=True,
         )
-        self._index.build()
+        self._index.build(version=self.target_store.version())
 
         algo_name = config.get("algorithm", LogicV1.NAME)
         _algorithm = get_algorithm(algo_name)
@@ -83,8 +148,13 @@ class LocalEnricher(BaseEnricher[DS]):
         self._cutoff = float(config.get("cutoff", 0.5))
         self._limit = int(config.get("limit", 5))
         self._max_bin = int(config.get("max_bin", 10))
+        self.workers = int(config.get("workers", settings.ENRICH_WORKERS))
+        """Number of processes used to score match candidates"""
+        self.pairs = 0
+        """Number of subject and candidate pairs scored"""
 
     def close(self) -> None:
+        self._index.close()
         self.target_store.close()
 
     def load(self, entity: Entity) -> None:
@@ -98,17 +168,19 @@ class LocalEnricher(BaseEnricher[DS]):
     def candidates(self) -> Generator[Tuple[Identifier, BlockingMatches], None, None]:
         yield from self._index.matches()
 
-    def match_candidates(
-        self, entity: Entity, candidates: BlockingMatches
-    ) -> Generator[Entity, None, None]:
+    def _same_id_match(self, entity: Entity) -> Optional[Entity]:
         # Make sure an entity with the same ID is yielded. E.g. a QID or ID scheme
         # intentionally consistent between datasets.
-        if entity.id is not None:
-            same_id_match = self.target_view.get_entity(entity.id)
-            if same_id_match is not None:
-                yield same_id_match
+        if entity.id is None:
+            return None
+        return self.target_view.get_entity(entity.id)
 
-        scores: List[Tuple[float, Entity]] = []
+    def _select_candidates(
+        self, entity: Entity, candidates: BlockingMatches
+    ) -> List[Entity]:
+        """Load the candidates in the top `max_bin` index score bins which the
+        entity could match."""
+        matches: List[Entity] = []
         last_rounded_score = None
         bin = 0
 
@@ -127,15 +199,93 @@ class LocalEnricher(BaseEnricher[DS]):
             if not entity.schema.can_match(match.schema):
                 continue
 
-            result = self._algorithm.compare(entity, match)
-            if result.score < self._cutoff:
-                continue
+            matches.append(match)
+        self.pairs += len(matches)
+        return matches
+
+    def match_candidates(
+        self, entity: Entity, candidates: BlockingMatches
+    ) -> Generator[Entity, None, None]:
+        same_id_match = self._same_id_match(entity)
+        if same_id_match is not None:
+            yield same_id_match
 
-            scores.append((result.score, match))
+        matches = self._select_candidates(entity, candidates)
+        ranked = _rank_matches(
+            self._algorithm, self._cutoff, self._limit, entity, matches
+        )
+        for idx in ranked:
+            yield matches[idx]
+
+    def match_subjects(
+        self, subjects: Iterable[Tuple[Entity, BlockingMatches]]
+    ) -> Generator[Tuple[Entity, ScoringResult], None, None]:
+        """Find the matches of each subject entity among its candidates, like
+        `match_candidates`. With more than one worker configured, the candidates
+        are scored in a pool of worker processes. The candidate entities are
+        loaded from the target store by this process, since LevelDB can't be
+        shared, and sent to the workers. Results are returned in order, and keep
+        the matches found before an error was raised."""
+        if self.workers <= 1:
+            for entity, candidates in subjects:
+                found: List[Entity] = []
+                try:
+                    for match in self.match_candidates(entity, candidates):
+                        found.append(match)
+                except EnrichmentException as exc:
+                    yield entity, (found, exc)
+                    continue
+                yield entity, (found, None)
+            return
 
-        scores.sort(key=lambda s: s[0], reverse=True)
-        for algo_score, proxy in scores[: self._limit]:
-            yield proxy
+        Batch = List[Tuple[Entity, Optional[Entity], List[Entity]]]
+
+        def results(
+            batch: Batch, ranked: List[Union[List[int], str]]
+        ) -> Generator[Tuple[Entity, ScoringResult], None, None]:
+            for (entity, same_id_match, matches), offsets in zip(batch, ranked):
+                found = [same_id_match] if same_id_match is not None else []
+                if isinstance(offsets, str):
+                    yield entity, (found, EnrichmentException(offsets))
+                    continue
+                found.extend(matches[idx] for idx in offsets)
+                yield entity, (found, None)
+
+        # The stores and the index run threads of their own, so the workers are
+        # started from a fork server rather than forked from this process:
+        mp_context = multiprocessing.get_context("forkserver")
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=mp_context,
+            initializer=_init_scoring_worker,
+            initargs=(self.dataset, self._algorithm, self._cutoff, self._limit),
+        )
+        pending: Deque[Tuple[Batch, Future[List[Union[List[int], str]]]]] = deque()
+
+        def submit(batch: Batch) -> None:
+            tasks = [(e.to_dict(), [m.to_dict() for m in ms]) for e, _, ms in batch]
+            pending.append((batch, pool.submit(_score_batch, tasks)))
+
+        try:
+            batch: Batch = []
+            for entity, candidates in subjects:
+                same_id_match = self._same_id_match(entity)
+                matches = self._select_candidates(entity, candidates)
+                batch.append((entity, same_id_match, matches))
+                if len(batch) >= SCORING_BATCH_SIZE:
+                    submit(batch)
+                    batch = []
+                # Bound the number of batches in flight to cap memory use:
+                while len(pending) >= self.workers * 2:
+                    done, future = pending.popleft()
+                    yield from results(done, future.result())
+            if len(batch):
+                submit(batch)
+            while len(pending):
+                done, future = pending.popleft()
+                yield from results(done, future.result())
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
 
     def _traverse_nested(
         self, entity: Entity, path: List[str] = []
@@ -214,21 +364,36 @@ def enrich(context: Context) -> None:
         for entity in subject_view.entities():
             enricher.load_wrapped(entity)
 
-        context.log.info("Matching candidates...")
-        for entity_idx, (entity_id, candidate_set) in enumerate(enricher.candidates()):
+        context.log.info("Matching candidates...", workers=enricher.workers)
+
+        def subjects() -> Generator[Tuple[Entity, BlockingMatches], None, None]:
+            for entity_id, candidate_set in enricher.candidates():
+                subject_entity = subject_view.get_entity(entity_id.id)
+                if subject_entity is None:
+                    context.log.error("Missing entity: %r" % entity_id)
+                    continue
+                yield subject_entity, candidate_set
+
+        start = perf_counter()
+        matched = enricher.match_subjects(subjects())
+        for entity_idx, (subject_entity, (matches, error)) in enumerate(matched):
             if entity_idx > 0 and entity_idx % 10000 == 0:
                 context.log.info("Enriched %s entities..." % entity_idx)
-            subject_entity = subject_view.get_entity(entity_id.id)
-            if subject_entity is None:
-                context.log.error("Missing entity: %r" % entity_id)
-                continue
             try:
-                for match in enricher.match_candidates(subject_entity, candidate_set):
+                for match in matches:
                     save_match(context, resolver, enricher, subject_entity, match)
+                if error is not None:
+                    raise error
             except EnrichmentException as exc:
                 context.log.error(
                     "Enrichment error %r: %s" % (subject_entity, str(exc))
                 )
+        elapsed = perf_counter() - start
+        context.log.info(
+            "Scored %d candidate pairs." % enricher.pairs,
+            elapsed=round(elapsed, 2),
+            pairs_per_second=round(enricher.pairs / max(elapsed, 0.001), 1),
+        )
         resolver.save()
         context.log.info("Enrichment process complete.")
     finally:
@@ -1,7 +1,18 @@
+import os
+import zlib
+from mmap import mmap, ACCESS_READ
+from pathlib import Path
+from hashlib import sha1
+from datetime import timedelta
 from functools import cache
+from typing import Dict, Optional, Set
 from sqlalchemy import MetaData, create_engine
 from sqlalchemy.engine import Engine
-from nomenklatura.cache import Cache
+from sqlalchemy.future import select
+from sqlalchemy.sql.expression import delete
+from nomenklatura.cache import Cache, Value
+from nomenklatura.dataset import Dataset as NKDataset
+from rigour.time import naive_now
 
 from zavod import settings
 from zavod.logs import get_logger
@@ -9,6 +20,8 @@ from zavod.meta import Dataset
 from zavod.archive import dataset_state_path
 
 log = get_logger(__name__)
+# Cache values which are stored as files are referenced by their content hash:
+BLOB_MARKER = "\x00blob:"
 
 
 @cache
@@ -24,14 +37,135 @@ def get_metadata(uri: str) -> MetaData:
     return MetaData()
 
 
+class BlobCache(Cache):
+    """A cache which keeps large values as compressed files named by the hash of
+    their content, so that the database only holds metadata. Identical values are
+    stored once, and files are evicted by age or to stay within a size budget."""
+
+    def __init__(
+        self,
+        engine: Engine,
+        metadata: MetaData,
+        dataset: NKDataset,
+        path: Path,
+        threshold: int,
+        create: bool = False,
+    ) -> None:
+        super().__init__(engine, metadata, dataset, create=create)
+        self.path = path
+        self.threshold = threshold
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.path / digest[:2] / f"{digest}.gz"
+
+    def set(self, key: str, value: Value) -> None:
+        if value is None or self.threshold <= 0 or len(value) < self.threshold:
+            return super().set(key, value)
+        data = value.encode("utf-8")
+        digest = sha1(data).hexdigest()
+        path = self._blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as fh:
+                fh.write(compressor.compress(data))
+                fh.write(compressor.flush())
+            tmp_path.replace(path)
+        super().set(key, f"{BLOB_MARKER}{digest}")
+
+    def get(self, key: str, max_age: Optional[int] = None) -> Optional[Value]:
+        value = super().get(key, max_age=max_age)
+        if value is None or not value.startswith(BLOB_MARKER):
+            return value
+        path = self._blob_path(value[len(BLOB_MARKER) :])
+        try:
+            with open(path, "rb") as fh:
+                with mmap(fh.fileno(), 0, access=ACCESS_READ) as mm:
+                    data = zlib.decompressobj(31).decompress(mm)
+        except (OSError, ValueError, zlib.error) as exc:
+            log.warning("Cache file is missing or corrupt: %s" % exc, key=key)
+            self.delete(key)
+            return None
+        return data.decode("utf-8")
+
+    def _blob_timestamps(self) -> Dict[str, float]:
+        """Get the latest use of each file referenced by a cache entry."""
+        table = self._table
+        q = select(table.c.text, table.c.timestamp)
+        q = q.filter(table.c.dataset == self.dataset.name)
+        q = q.filter(table.c.text.like(f"{BLOB_MARKER}%"))
+        timestamps: Dict[str, float] = {}
+        for row in self.conn.execute(q):
+            digest = row.text[len(BLOB_MARKER) :]
+            ts = row.timestamp.timestamp() if row.timestamp is not None else 0.0
+            timestamps[digest] = max(ts, timestamps.get(digest, ts))
+        return timestamps
+
+    def evict(
+        self, max_age: Optional[int] = None, max_size: Optional[int] = None
+    ) -> None:
+        """Remove entries older than `max_age` days, and the least recently stored
+        files beyond a total of `max_size` bytes. Files which are no longer
+        referenced by any entry are deleted."""
+        table = self._table
+        if max_age is not None and max_age > 0:
+            cutoff = naive_now() - timedelta(days=max_age)
+            pq = delete(table).where(table.c.dataset == self.dataset.name)
+            self.conn.execute(pq.where(table.c.timestamp < cutoff))
+        self._preload = {}
+        timestamps = self._blob_timestamps()
+        sizes: Dict[str, int] = {}
+        removed = 0
+        if self.path.is_dir():
+            for path in self.path.glob("*/*.gz"):
+                digest = path.name[: -len(".gz")]
+                if digest not in timestamps:
+                    path.unlink(missing_ok=True)
+                    removed += 1
+                else:
+                    sizes[digest] = path.stat().st_size
+        total = sum(sizes.values())
+        if max_size is not None and max_size > 0 and total > max_size:
+            evicted: Set[str] = set()
+            for digest in sorted(sizes, key=lambda d: timestamps[d]):
+                if total <= max_size:
+                    break
+                total -= sizes[digest]
+                evicted.add(digest)
+                self._blob_path(digest).unlink(missing_ok=True)
+                removed += 1
+            for digest in evicted:
+                pq = delete(table).where(table.c.dataset == self.dataset.name)
+                pq = pq.where(table.c.text == f"{BLOB_MARKER}{digest}")
+                self.conn.execute(pq)
+        if removed > 0:
+            log.info("Evicted cache files", removed=removed, size=total)
+
+    def close(self) -> None:
+        # Always sweep, since overwritten entries leave their old files behind:
+        self.evict(
+            max_age=settings.CACHE_MAX_AGE,
+            max_size=settings.CACHE_BLOB_BUDGET * 1024 * 1024,
+        )
+        super().close()
+
+
 @cache
 def get_cache(dataset: Dataset) -> Cache:
     """Get a cache object for the given dataset."""
     database_uri = settings.CACHE_DATABASE_URI
+    blob_path: Optional[Path] = None
     if database_uri is None:
-        cache_path = dataset_state_path(dataset.name) / "cache.sqlite3"
+        state_path = dataset_state_path(dataset.name)
+        cache_path = state_path / "cache.sqlite3"
         database_uri = f"sqlite:///{cache_path.as_posix()}"
+        blob_path = state_path / "cache"
     engine = get_engine(database_uri)
     metadata = get_metadata(database_uri)
     log.info("Using cache: %r" % engine, dataset=dataset.name)
-    return Cache(engine, metadata, dataset, create=True)
+    if blob_path is None:
+        # A shared database would reference files which only exist on one machine:
+        return Cache(engine, metadata, dataset, create=True)
+    threshold = settings.CACHE_BLOB_THRESHOLD
+    return BlobCache(engine, metadata, dataset, blob_path, threshold, create=True)
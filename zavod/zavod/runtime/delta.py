@@ -1,9 +1,14 @@
+import heapq
 import shutil
-import plyvel  # type: ignore
+import resource
+from pathlib import Path
+from time import perf_counter
 from banal import hash_data
-from typing import Optional, Generator, Tuple
+from operator import itemgetter
+from typing import Dict, Iterator, List, Optional, Generator, Tuple
 from nomenklatura.versions import Version
 
+from zavod import settings
 from zavod.logs import get_logger
 from zavod.meta import Dataset
 from zavod.entity import Entity
@@ -12,11 +17,85 @@ from zavod.archive import iter_dataset_versions, get_artifact_object, HASH_FILE
 from zavod.runtime.versions import get_latest
 
 log = get_logger(__name__)
+HashItem = Tuple[str, str]
+
+
+def _parse_line(line: str) -> HashItem:
+    # Hashes never contain a colon, entity IDs might:
+    entity_id, entity_hash = line.strip().rsplit(":", 1)
+    return entity_id, entity_hash
+
+
+class SortedHashes(object):
+    """A mapping of entity IDs to hashes which can be iterated in ID order.
+
+    Hashes are held in a dict until it reaches `limit` entries, at which point the
+    buffer is written to a sorted run file on disk. Iterating merges all runs, so
+    memory use is bounded by the limit rather than by the size of the dataset.
+    """
+
+    def __init__(self, path: Path, limit: int) -> None:
+        self.path = path
+        self.limit = max(1, limit)
+        self.buffer: Dict[str, str] = {}
+        self.runs: List[Path] = []
+        self.count = 0
+
+    def add(self, entity_id: str, entity_hash: str) -> None:
+        self.buffer[entity_id] = entity_hash
+        self.count += 1
+        if len(self.buffer) >= self.limit:
+            self._spill()
+
+    def _spill(self) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        run_path = self.path / f"run-{len(self.runs):05d}.txt"
+        with open(run_path, "w") as fh:
+            for entity_id in sorted(self.buffer):
+                fh.write(f"{entity_id}:{self.buffer[entity_id]}\n")
+        self.runs.append(run_path)
+        self.buffer = {}
+
+    def _read_run(self, path: Path) -> Iterator[HashItem]:
+        with open(path, "r") as fh:
+            for line in fh:
+                yield _parse_line(line)
+
+    def __iter__(self) -> Iterator[HashItem]:
+        if not len(self.runs):
+            for entity_id in sorted(self.buffer):
+                yield entity_id, self.buffer[entity_id]
+            return
+        if len(self.buffer):
+            self._spill()
+        # heapq.merge is stable, so a repeated ID yields the value from the latest
+        # run last, and that one wins - just like with the in-memory buffer:
+        runs = [self._read_run(p) for p in self.runs]
+        merged = heapq.merge(*runs, key=itemgetter(0))
+        item = next(merged, None)
+        for next_item in merged:
+            if item is not None and next_item[0] != item[0]:
+                yield item
+            item = next_item
+        if item is not None:
+            yield item
+
+    def clear(self) -> None:
+        self.buffer = {}
+        self.runs = []
+        shutil.rmtree(self.path, ignore_errors=True)
 
 
 class HashDelta(object):
+    """Compute the entities added, modified and deleted since the previous version
+    of a dataset by comparing per-entity content hashes.
 
-    def __init__(self, dataset: Dataset):
+    The previous and current hashes are each collected into a `SortedHashes`, and
+    the two are merge-joined on the entity ID. Below `ZAVOD_DELTA_MEMORY_LIMIT`
+    entities, this happens entirely in memory.
+    """
+
+    def __init__(self, dataset: Dataset, limit: Optional[int] = None) -> None:
         self.dataset = dataset
         self.curr = get_latest(dataset.name, backfill=False)
         self.prev: Optional[Version] = None
@@ -24,7 +103,10 @@ class HashDelta(object):
         self.fh = self.curr_path.open("w")
         self.db_path = dataset_state_path(dataset.name) / "hashes"
         shutil.rmtree(self.db_path, ignore_errors=True)
-        self.db = plyvel.DB(self.db_path.as_posix(), create_if_missing=True)
+        if limit is None:
+            limit = settings.DELTA_MEMORY_LIMIT
+        self.prev_hashes = SortedHashes(self.db_path / "prev", limit)
+        self.curr_hashes = SortedHashes(self.db_path / "curr", limit)
 
     def backfill(self) -> None:
         for version in iter_dataset_versions(self.dataset.name):
@@ -39,45 +121,49 @@ class HashDelta(object):
             )
             with obj.open() as fh:
                 for line in fh:
-                    entity_id, entity_hash = line.strip().split(":", 1)
-                    key = f"{entity_id}:{version.id}".encode("utf-8")
-                    self.db.put(key, entity_hash.encode("utf-8"))
+                    self.prev_hashes.add(*_parse_line(line))
             return
         log.info("No previous hash data found.", dataset=self.dataset.name)
 
-    def feed(self, entity: Entity) -> None:
+    def feed(self, entity: Entity) -> bool:
+        """Record the hash of an entity in the current version.
+
+        Returns:
+            False if the entity is known to be unchanged since the previous
+            version, True if it may have been added or modified.
+        """
         if entity.id is None or self.curr is None:
-            return
+            return False
         entity_hash = hash_data((entity.id, entity.schema.name, entity.properties))
         self.fh.write(f"{entity.id}:{entity_hash}\n")
-        key = f"{entity.id}:{self.curr.id}".encode("utf-8")
-        self.db.put(key, entity_hash.encode("utf-8"))
+        self.curr_hashes.add(entity.id, entity_hash)
+        # Once the previous hashes have spilled to disk, they can't be looked up:
+        if len(self.prev_hashes.runs):
+            return True
+        return self.prev_hashes.buffer.get(entity.id) != entity_hash
 
     def _collect(
         self,
     ) -> Generator[Tuple[str, Optional[str], Optional[str]], None, None]:
-        with self.db.iterator(include_key=True, fill_cache=False) as it:
-            entity_id: Optional[str] = None
-            prev_hash: Optional[str] = None
-            curr_hash: Optional[str] = None
-            for key, value in it:
-                new_id, version_id = key.decode("utf-8").split(":", 1)
-                hash = value.decode("utf-8")
-                if self.prev is None:
-                    yield new_id, None, hash
-                    continue
-                if new_id != entity_id:
-                    if entity_id is not None:
-                        yield entity_id, prev_hash, curr_hash
-                    entity_id, prev_hash, curr_hash = new_id, None, None
-                if self.curr is not None and version_id == self.curr.id:
-                    curr_hash = hash
-                else:
-                    prev_hash = hash
-            if entity_id is not None:
-                yield entity_id, prev_hash, curr_hash
+        prev_it = iter(self.prev_hashes)
+        curr_it = iter(self.curr_hashes)
+        prev = next(prev_it, None)
+        curr = next(curr_it, None)
+        while prev is not None or curr is not None:
+            if curr is None or (prev is not None and prev[0] < curr[0]):
+                assert prev is not None
+                yield prev[0], prev[1], None
+                prev = next(prev_it, None)
+            elif prev is None or curr[0] < prev[0]:
+                yield curr[0], None, curr[1]
+                curr = next(curr_it, None)
+            else:
+                yield curr[0], prev[1], curr[1]
+                prev = next(prev_it, None)
+                curr = next(curr_it, None)
 
     def generate(self) -> Generator[Tuple[str, str], None, None]:
+        start = perf_counter()
         for entity_id, prev_hash, curr_hash in self._collect():
             if prev_hash == curr_hash:
                 continue
@@ -87,7 +173,19 @@ class HashDelta(object):
                 yield "DEL", entity_id
             else:
                 yield "MOD", entity_id
+        # ru_maxrss is reported in kilobytes on Linux:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        log.info(
+            "Computed entity delta.",
+            dataset=self.dataset.name,
+            previous=self.prev_hashes.count,
+            current=self.curr_hashes.count,
+            runs=len(self.prev_hashes.runs) + len(self.curr_hashes.runs),
+            seconds=round(perf_counter() - start, 2),
+            max_rss_mb=max_rss // 1024,
+        )
 
     def close(self) -> None:
-        self.db.close()
+        self.prev_hashes.clear()
+        self.curr_hashes.clear()
         self.fh.close()
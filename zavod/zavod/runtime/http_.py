@@ -1,11 +1,16 @@
 import warnings
-from typing import Any, Optional, Tuple, Mapping, Union, List
+from typing import Any, Dict, Generator, Optional, Tuple, Mapping, Union, List
+from contextlib import contextmanager
 from functools import partial
 from pathlib import Path
+from threading import BoundedSemaphore, Lock
+from time import monotonic, sleep
+from urllib.parse import urlparse
 from banal import hash_data
-from requests import Session
-from requests.adapters import HTTPAdapter
-from urllib3.exceptions import InsecureRequestWarning
+from requests import PreparedRequest, Response, Session
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE
+from requests.exceptions import RetryError
+from urllib3.exceptions import InsecureRequestWarning, InvalidHeader, MaxRetryError
 from urllib3.util import Retry
 
 from zavod import settings
@@ -34,11 +39,189 @@ def make_session(http_conf: HTTP) -> Session:
         status_forcelist=http_conf.retry_statuses,
         allowed_methods=http_conf.retry_methods,
     )
-    session.mount("https://", HTTPAdapter(max_retries=retries))
-    session.mount("http://", HTTPAdapter(max_retries=retries))
+    limiter = RateLimiter(http_conf.rate_limit, burst=http_conf.rate_burst)
+    # Keep enough connections per host for the concurrent fetches:
+    pool_size = max(DEFAULT_POOLSIZE, http_conf.max_concurrency)
+    for prefix in ("https://", "http://"):
+        adapter = RateLimitedAdapter(
+            limiter, max_retries=retries, pool_maxsize=pool_size
+        )
+        session.mount(prefix, adapter)
     return session
 
 
+def get_rate_limiter(session: Session) -> Optional["RateLimiter"]:
+    """Get the rate limiter shared by the adapters of a session."""
+    adapter = session.get_adapter("https://")
+    if isinstance(adapter, RateLimitedAdapter):
+        return adapter.limiter
+    return None
+
+
+class _Bucket(object):
+    __slots__ = ["next_at", "paused_until", "slowdown"]
+
+    def __init__(self, now: float) -> None:
+        self.next_at = now
+        self.paused_until = now
+        self.slowdown = 1.0
+
+
+class RateLimiter(object):
+    """A token bucket rate limiter for each host that requests are sent to.
+
+    The bucket refills at `rate` requests per second and holds up to `burst`
+    requests. When a host signals that it is overloaded (HTTP 429 or 503), further
+    requests are paused for the duration given in the `Retry-After` header, and the
+    rate for that host is halved until it recovers with successful responses.
+    """
+
+    MAX_SLOWDOWN = 64.0
+
+    def __init__(self, rate: Optional[float] = None, burst: int = 1) -> None:
+        self.rate = rate if rate is not None and rate > 0 else None
+        self.burst = max(1, burst)
+        self.requests = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.throttled = 0
+        self._lock = Lock()
+        self._buckets: Dict[str, _Bucket] = {}
+
+    def _bucket(self, url: str, now: float) -> _Bucket:
+        host = urlparse(url).netloc.lower()
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = _Bucket(now)
+        return bucket
+
+    def wait(self, url: str) -> float:
+        """Block until a request to the host of the given URL is allowed, and return
+        the time spent waiting."""
+        with self._lock:
+            now = monotonic()
+            bucket = self._bucket(url, now)
+            delay = bucket.paused_until - now
+            if self.rate is not None:
+                # The bucket is tracked as the time at which it will be full again,
+                # so that waiting requests can reserve their slot in order:
+                interval = bucket.slowdown / self.rate
+                bucket.next_at = max(bucket.next_at, now)
+                allowed_at = bucket.next_at - (self.burst - 1) * interval
+                delay = max(delay, allowed_at - now)
+                bucket.next_at += interval
+            self.requests += 1
+            if delay > 0:
+                self.waits += 1
+                self.wait_time += delay
+        if delay > 0:
+            sleep(delay)
+            return delay
+        return 0.0
+
+    def throttle(self, url: str, retry_after: Optional[float]) -> None:
+        """Record that the host of the given URL has rejected a request for being
+        overloaded."""
+        with self._lock:
+            now = monotonic()
+            bucket = self._bucket(url, now)
+            bucket.slowdown = min(self.MAX_SLOWDOWN, bucket.slowdown * 2)
+            if retry_after is not None and retry_after > 0:
+                bucket.paused_until = max(bucket.paused_until, now + retry_after)
+            self.throttled += 1
+        log.info("Host is throttling requests", url=url, retry_after=retry_after)
+
+    def pause(self, url: str, seconds: float) -> None:
+        """Hold back further requests to the host of the given URL, without
+        lowering its rate."""
+        with self._lock:
+            now = monotonic()
+            bucket = self._bucket(url, now)
+            bucket.paused_until = max(bucket.paused_until, now + seconds)
+
+    def recover(self, url: str) -> None:
+        """Gradually restore the configured rate after a successful request."""
+        with self._lock:
+            bucket = self._bucket(url, monotonic())
+            bucket.slowdown = max(1.0, bucket.slowdown * 0.9)
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """An HTTP adapter which applies a rate limiter to all requests it sends.
+
+    Responses signalling an overloaded host (HTTP 429 or 503) are retried by the
+    adapter rather than by urllib3, so that every attempt waits for the token bucket
+    and the `Retry-After` pause (or the retry backoff) applies to all requests
+    made to the host.
+    """
+
+    THROTTLE_STATUSES = (429, 503)
+
+    def __init__(self, limiter: RateLimiter, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.limiter = limiter
+        self.throttle_retries: Retry = self.max_retries
+        forcelist = self.max_retries.status_forcelist or []
+        forcelist = [s for s in forcelist if s not in self.THROTTLE_STATUSES]
+        self.max_retries = self.max_retries.new(
+            status_forcelist=forcelist,
+            respect_retry_after_header=False,
+        )
+
+    def _retry_after(self, response: Response) -> Optional[float]:
+        header = response.headers.get("Retry-After")
+        if header is None:
+            return None
+        try:
+            return self.throttle_retries.parse_retry_after(header)
+        except InvalidHeader:
+            return None
+
+    def send(self, request: PreparedRequest, **kwargs: Any) -> Response:  # type: ignore
+        url = request.url or ""
+        method = request.method or "GET"
+        retries = self.throttle_retries
+        while True:
+            self.limiter.wait(url)
+            response = super().send(request, **kwargs)
+            if response.status_code not in self.THROTTLE_STATUSES:
+                if response.status_code < 400:
+                    self.limiter.recover(url)
+                return response
+            retry_after = self._retry_after(response)
+            self.limiter.throttle(url, retry_after)
+            has_retry_after = retry_after is not None
+            if not retries.is_retry(method, response.status_code, has_retry_after):
+                return response
+            try:
+                retries = retries.increment(method, url, response=response.raw)
+            except MaxRetryError as exc:
+                response.close()
+                raise RetryError(exc, request=request)
+            if retry_after is None or not retries.respect_retry_after_header:
+                self.limiter.pause(url, retries.get_backoff_time())
+            response.close()
+
+
+class HostLimiter(object):
+    """Limit the number of requests running concurrently against each host."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = max(1, limit)
+        self._lock = Lock()
+        self._hosts: Dict[str, BoundedSemaphore] = {}
+
+    @contextmanager
+    def acquire(self, url: str) -> Generator[None, None, None]:
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            semaphore = self._hosts.get(host)
+            if semaphore is None:
+                semaphore = self._hosts[host] = BoundedSemaphore(self.limit)
+        with semaphore:
+            yield
+
+
 def request_hash(
     url: str,
     auth: Optional[_Auth] = None,
@@ -59,6 +242,63 @@ def request_hash(
     return f"{url}[{hsh}]"
 
 
+def validators_key(fingerprint: str) -> str:
+    """The cache key under which the HTTP validators of a response are stored."""
+    return f"validators:{fingerprint}"
+
+
+def response_validators(response: Response) -> Dict[str, str]:
+    """Get the headers of a response that can be used to revalidate it."""
+    validators: Dict[str, str] = {}
+    for header in ("ETag", "Last-Modified"):
+        value = response.headers.get(header)
+        if value is not None:
+            validators[header] = value
+    return validators
+
+
+def conditional_headers(
+    headers: _Headers, validators: Optional[Dict[str, str]]
+) -> Dict[str, str]:
+    """Add the conditional request headers for the given validators, so that the
+    server can respond with `304 Not Modified` if the resource is unchanged."""
+    merged = dict(headers or {})
+    if validators is not None:
+        if "ETag" in validators:
+            merged["If-None-Match"] = validators["ETag"]
+        if "Last-Modified" in validators:
+            merged["If-Modified-Since"] = validators["Last-Modified"]
+    return merged
+
+
+def revalidate_file(
+    session: Session,
+    url: str,
+    path: Path,
+    validators: Optional[Dict[str, str]] = None,
+    auth: Optional[Any] = None,
+    headers: _Headers = None,
+) -> Tuple[bool, Dict[str, str]]:
+    """Download a file via HTTP unless the existing copy at the path is still valid
+    according to the given validators. Returns whether the file changed, and the
+    validators of the current version."""
+    if not path.exists():
+        validators = None
+    log.info("Fetching file", url=url, revalidate=validators is not None)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    req_headers = conditional_headers(headers, validators)
+    with session.get(url, auth=auth, headers=req_headers, stream=True) as res:
+        if res.status_code == 304 and validators is not None:
+            return False, validators
+        res.raise_for_status()
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with open(tmp_path, "wb") as fh:
+            for chunk in res.iter_content(chunk_size=8192 * 10):
+                fh.write(chunk)
+        tmp_path.replace(path)
+        return True, response_validators(res)
+
+
 def fetch_file(
     session: Session,
     url: str,
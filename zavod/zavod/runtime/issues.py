@@ -27,15 +27,23 @@ class Issue(TypedDict):
 class DatasetIssues(object):
     """A log of issues that occurred during the running and export of a dataset."""
 
-    def __init__(self, dataset: Dataset) -> None:
+    def __init__(self, dataset: Dataset, path: Optional[Path] = None) -> None:
         self.dataset = dataset
         self.fh: Optional[BinaryIO] = None
-        get_dataset_artifact(self.dataset.name, ISSUES_LOG)
+        self.path = path
+        if path is None:
+            get_dataset_artifact(self.dataset.name, ISSUES_LOG)
 
-    def write(self, event: Dict[str, Any]) -> None:
+    def _open(self) -> BinaryIO:
         if self.fh is None:
-            path = dataset_resource_path(self.dataset.name, ISSUES_LOG)
+            path = self.path
+            if path is None:
+                path = dataset_resource_path(self.dataset.name, ISSUES_LOG)
             self.fh = open(path, "ab")
+        return self.fh
+
+    def write(self, event: Dict[str, Any]) -> None:
+        fh = self._open()
         data = dict(event)
         for key, value in data.items():
             if key == "dataset" and value == self.dataset.name:
@@ -69,7 +77,16 @@ class DatasetIssues(object):
         record["data"] = data
         record["id"] = hash_data(record)
         out = orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
-        self.fh.write(out)
+        fh.write(out)
+
+    def append(self, path: Path) -> None:
+        """Append the records of another issues log, e.g. from a crawl shard."""
+        if not path.is_file():
+            return
+        fh = self._open()
+        with open(path, "rb") as src:
+            for line in src:
+                fh.write(line)
 
     def clear(self) -> None:
         """Clear (delete) the issues log file."""
@@ -1,5 +1,6 @@
 import json
-from typing import Dict, Any, List
+from pathlib import Path
+from typing import Dict, Any, List, Optional
 
 from zavod.meta import Dataset, DataResource
 from zavod.archive import dataset_resource_path, get_dataset_artifact
@@ -10,9 +11,12 @@ class DatasetResources(object):
     """Store information about the resources in the dataset that have been emitted
     from the context during runtime."""
 
-    def __init__(self, dataset: Dataset) -> None:
+    def __init__(self, dataset: Dataset, path: Optional[Path] = None) -> None:
         self.dataset = dataset
-        self.path = dataset_resource_path(dataset.name, RESOURCES_FILE)
+        self.custom_path = path is not None
+        if path is None:
+            path = dataset_resource_path(dataset.name, RESOURCES_FILE)
+        self.path = path
 
     def _store_resources(self, resources: List[DataResource]) -> None:
         with open(self.path, "w") as fh:
@@ -32,7 +36,7 @@ class DatasetResources(object):
     def all(self) -> List[DataResource]:
         resources: List[DataResource] = []
         data: Dict[str, Any] = {}
-        if not self.path.exists():
+        if not self.path.exists() and not self.custom_path:
             self.path = get_dataset_artifact(self.dataset.name, RESOURCES_FILE)
         if self.path.exists():
             with open(self.path, "r") as fh:
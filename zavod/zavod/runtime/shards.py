@@ -0,0 +1,160 @@
+import shutil
+import multiprocessing
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional
+from typing import Tuple, TypeVar
+from nomenklatura.statement import Statement
+from nomenklatura.statement.serialize import read_pack_statements_decoded
+from structlog.contextvars import bind_contextvars
+
+from zavod.meta import get_catalog
+from zavod.archive import dataset_state_path
+from zavod.runtime.sink import DatasetSink
+from zavod.runtime.issues import DatasetIssues
+from zavod.runtime.resources import DatasetResources
+from zavod.runtime.timestamps import TimeStampIndex
+from zavod.runtime.cache import get_cache, get_engine, get_metadata
+
+if TYPE_CHECKING:
+    from zavod.context import Context
+
+T = TypeVar("T")
+ShardFunc = Callable[["Context", T], None]
+_ShardResult = Tuple[int, int, int, Dict[str, str], Dict[str, Path]]
+
+
+def run_shards(
+    context: "Context", items: Iterable[T], fn: ShardFunc[T], workers: int
+) -> None:
+    """Run `fn` for each item in a pool of worker processes, each with its own
+    context writing to a separate statements file, issues log and resources file.
+    The shard outputs are then merged into the dataset in the order of the items."""
+    path = dataset_state_path(context.dataset.name) / "shards"
+    shutil.rmtree(path, ignore_errors=True)
+    path.mkdir(parents=True)
+    # Crawlers are loaded from their file path, so they can only be pickled into
+    # workers which are forked from this process. Stop the background threads of
+    # the context first, so none of them holds a lock while the process is forked.
+    # Resolving the timestamp index joins its builder, which a dry run doesn't use:
+    if not context.dry_run:
+        context.timestamps
+    context.sink.flush()
+    context.issues.close()
+    mp_context = multiprocessing.get_context("fork")
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=mp_context)
+    try:
+        futures: List[Future[_ShardResult]] = []
+        for idx, item in enumerate(items):
+            future = pool.submit(
+                _run_shard,
+                context.dataset.name,
+                context.dry_run,
+                context.data_time,
+                fn,
+                item,
+                path / f"{idx:06d}",
+            )
+            futures.append(future)
+        context.log.info("Running crawl shards", shards=len(futures), workers=workers)
+        for idx, future in enumerate(futures):
+            result = future.result()
+            _merge_shard(context, path / f"{idx:06d}", result)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _run_shard(
+    dataset_name: str,
+    dry_run: bool,
+    data_time: datetime,
+    fn: ShardFunc[Any],
+    item: Any,
+    prefix: Path,
+) -> _ShardResult:
+    from zavod.context import Context
+
+    # Don't re-use the database connections of the parent process:
+    get_cache.cache_clear()
+    get_engine.cache_clear()
+    get_metadata.cache_clear()
+    dataset = get_catalog().require(dataset_name)
+    context = Context(dataset, dry_run=dry_run)
+    context.data_time = data_time
+    context.sink = DatasetSink(dataset, background=False, path=_pack_path(prefix))
+    context.issues = DatasetIssues(dataset, path=_issues_path(prefix))
+    context.resources = DatasetResources(dataset, path=_resources_path(prefix))
+    # The timestamp index is locked by the parent, which applies it on merge:
+    context._timestamps = TimeStampIndex(dataset, compact=True)
+    bind_contextvars(dataset=dataset.name, context=context)
+    try:
+        fn(context, item)
+    finally:
+        context.sink.close()
+        context.issues.close()
+        context.http.close()
+        if context._cache is not None:
+            context._cache.close()
+    stats = context.stats
+    # The sources are returned unhashed, and only saved by the parent if needed:
+    sources = context.sources
+    return (
+        stats.entities,
+        stats.targets,
+        stats.statements,
+        sources.sources,
+        sources.files,
+    )
+
+
+def _merge_shard(context: "Context", prefix: Path, result: _ShardResult) -> None:
+    entities, targets, statements, sources, files = result
+    context.stats.entities += entities
+    context.stats.targets += targets
+    context.stats.statements += statements
+    context.issues.append(_issues_path(prefix))
+    resources = DatasetResources(context.dataset, path=_resources_path(prefix))
+    for resource in resources.all():
+        context.resources.save(resource)
+    context.sources.update(sources, files)
+    pack_path = _pack_path(prefix)
+    if not pack_path.is_file():
+        return
+    with open(pack_path, "r") as fh:
+        batch: List[Statement] = []
+        for stmt in read_pack_statements_decoded(fh):
+            if len(batch) and batch[0].entity_id != stmt.entity_id:
+                _emit_batch(context, batch)
+                batch = []
+            batch.append(stmt)
+        if len(batch):
+            _emit_batch(context, batch)
+
+
+def _emit_batch(context: "Context", statements: List[Statement]) -> None:
+    # The shard emitted each entity as one consecutive batch of statements:
+    entity_id = statements[0].entity_id
+    stmt_ids = (s.id for s in statements if s.id is not None)
+    stamps: Dict[str, str] = context.timestamps.get(entity_id, stmt_ids)
+    for stmt in statements:
+        first_seen: Optional[str] = None
+        if stmt.id is not None:
+            first_seen = stamps.get(stmt.id)
+        if first_seen is not None and first_seen != stmt.first_seen:
+            stmt.first_seen = first_seen
+            context.stats.changed += 1
+    context.sink.emit_many(statements)
+
+
+def _pack_path(prefix: Path) -> Path:
+    return prefix.with_suffix(".pack")
+
+
+def _issues_path(prefix: Path) -> Path:
+    return prefix.with_suffix(".issues.log")
+
+
+def _resources_path(prefix: Path) -> Path:
+    return prefix.with_suffix(".resources.json")
@@ -1,39 +1,128 @@
-from typing import Optional, TextIO
-from normality.encoding import DEFAULT_ENCODING
+from pathlib import Path
+from queue import Queue
+from threading import Thread
+from typing import List, Optional, TextIO
 from nomenklatura.statement import Statement
 from nomenklatura.statement.serialize import PackStatementWriter
 
 
+from zavod import settings
 from zavod.meta import Dataset
-from zavod.archive import dataset_resource_path, STATEMENTS_FILE
+from zavod.archive import dataset_resource_path, statements_file_name
+from zavod.archive import STATEMENTS_FILES
+from zavod.archive.compress import open_write
 
 
 class DatasetSink(object):
-    """Manage a file handle for writing statements to a dataset archive path."""
+    """Manage a file handle for writing statements to a dataset archive path.
 
-    def __init__(self, dataset: Dataset) -> None:
+    In background mode, statements are queued per entity and serialized by a writer
+    thread, so that the crawler doesn't pay the serialization cost inline.
+    """
+
+    def __init__(
+        self,
+        dataset: Dataset,
+        background: Optional[bool] = None,
+        path: Optional[Path] = None,
+    ) -> None:
         self.dataset = dataset
-        self.path = dataset_resource_path(dataset.name, STATEMENTS_FILE)
+        self.custom_path = path is not None
+        if path is None:
+            path = dataset_resource_path(dataset.name, statements_file_name())
+        self.path = path
         self.fh: Optional[TextIO] = None
         self.writer: Optional[PackStatementWriter] = None
+        if background is None:
+            background = settings.SINK_BACKGROUND
+        self.background = background
+        self.queue: Queue[Optional[List[Statement]]] = Queue(settings.SINK_QUEUE_SIZE)
+        self.thread: Optional[Thread] = None
+        self.error: Optional[BaseException] = None
 
-    def emit(self, stmt: Statement) -> None:
-        """Write a statement to the dataset output."""
+    @property
+    def backlog(self) -> int:
+        """Number of entities queued for the background writer."""
+        return self.queue.qsize()
+
+    def _write(self, statements: List[Statement]) -> None:
         if self.fh is None or self.writer is None:
-            self.fh = open(self.path, "w", encoding=DEFAULT_ENCODING)
+            # Don't leave behind statements written in another compression format:
+            for name in STATEMENTS_FILES:
+                if name != self.path.name and not self.custom_path:
+                    dataset_resource_path(self.dataset.name, name).unlink(
+                        missing_ok=True
+                    )
+            self.fh = open_write(self.path)
             self.writer = PackStatementWriter(self.fh)
-        self.writer.write(stmt)
+        for stmt in statements:
+            self.writer.write(stmt)
+
+    def _run(self) -> None:
+        while True:
+            statements = self.queue.get()
+            if statements is None:
+                return
+            # Keep draining after a failure so that emit() never blocks:
+            if self.error is not None:
+                continue
+            try:
+                self._write(statements)
+            except BaseException as exc:
+                self.error = exc
+
+    def _check(self) -> None:
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def emit(self, stmt: Statement) -> None:
+        """Write a statement to the dataset output."""
+        self.emit_many([stmt])
+
+    def emit_many(self, statements: List[Statement]) -> None:
+        """Write a batch of statements, usually those of an entity, to the dataset
+        output."""
+        if not self.background:
+            self._write(statements)
+            return
+        self._check()
+        if self.thread is None:
+            self.thread = Thread(target=self._run, name="sink", daemon=True)
+            self.thread.start()
+        # The caller may still modify the statements after they're queued:
+        self.queue.put([stmt.clone() for stmt in statements])
+
+    def _stop(self) -> None:
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def flush(self) -> None:
+        """Wait for the background writer to drain its queue and stop, and flush
+        the output file. The writer is restarted by the next emitted statement."""
+        self._stop()
+        if self.fh is not None:
+            self.fh.flush()
+        self._check()
 
     def close(self) -> None:
+        self._stop()
         if self.writer is not None:
             self.writer.close()
             self.writer = None
         if self.fh is not None:
             self.fh.close()
             self.fh = None
+        self._check()
 
     def clear(self) -> None:
-        """Delete the dataset statements output file."""
+        """Delete the dataset statements output files."""
         self.close()
-        if self.path.is_file():
-            self.path.unlink()
+        self.path.unlink(missing_ok=True)
+        if not self.custom_path:
+            # A stale file in another compression format would otherwise be read
+            # in place of the new output:
+            for name in STATEMENTS_FILES:
+                dataset_resource_path(self.dataset.name, name).unlink(missing_ok=True)
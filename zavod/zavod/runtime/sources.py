@@ -0,0 +1,129 @@
+import json
+from hashlib import sha1
+from pathlib import Path
+from functools import cached_property
+from typing import Any, Dict, Optional, Tuple
+from banal import hash_data
+
+from zavod.logs import get_logger
+from zavod.meta import Dataset
+from zavod.archive import dataset_resource_path, get_artifact_object
+from zavod.archive import iter_dataset_versions, SOURCES_FILE
+
+log = get_logger(__name__)
+
+
+def file_checksum(path: Path) -> str:
+    """Compute the SHA1 checksum of a file."""
+    digest = sha1()
+    with open(path, "rb") as fh:
+        while True:
+            chunk = fh.read(65536)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def code_fingerprint(dataset: Dataset) -> str:
+    """Fingerprint the metadata and crawler code of a dataset, and the version of
+    zavod, since a change to any of them can change the output of a crawl."""
+    from zavod import __version__
+
+    parts = [__version__]
+    if dataset.base_path is None:
+        parts.append(hash_data(dataset._data))
+    else:
+        # The metadata is hashed from disk because loading the lookups consumes
+        # their options from the parsed dataset metadata:
+        for path in sorted(dataset.base_path.iterdir()):
+            if path.is_file() and not path.name.startswith("."):
+                parts.append(f"{path.name}={file_checksum(path)}")
+    return sha1(":".join(parts).encode("utf-8")).hexdigest()
+
+
+class DatasetSources(object):
+    """Record fingerprints of the source data fetched by a crawler, which are
+    published with each version of the dataset. A crawl whose sources and code are
+    identical to those of the previous version doesn't need to parse them again.
+
+    Source files are only hashed once the crawler compares them to the previous
+    version, so crawlers which don't use the feature don't pay for it."""
+
+    def __init__(self, dataset: Dataset, path: Optional[Path] = None) -> None:
+        self.dataset = dataset
+        if path is None:
+            path = dataset_resource_path(dataset.name, SOURCES_FILE)
+        self.path = path
+        self.sources: Dict[str, str] = {}
+        self.files: Dict[str, Path] = {}
+        self.enabled = False
+        """Whether the fingerprint is saved, set once the crawler uses it."""
+
+    @cached_property
+    def code(self) -> str:
+        """Fingerprint of the dataset metadata and crawler code."""
+        return code_fingerprint(self.dataset)
+
+    def add(self, key: str, checksum: str) -> None:
+        """Record the checksum of a source, identified by a key such as its URL."""
+        self.files.pop(key, None)
+        self.sources[key] = checksum
+
+    def add_file(self, key: str, path: Path) -> None:
+        """Record a source file, which is hashed when the fingerprint is needed."""
+        self.sources.pop(key, None)
+        self.files[key] = path
+
+    def update(self, sources: Dict[str, str], files: Dict[str, Path]) -> None:
+        """Record several sources and source files, e.g. those of a crawl shard."""
+        for key, checksum in sources.items():
+            self.add(key, checksum)
+        for key, path in files.items():
+            self.add_file(key, path)
+
+    def checksums(self) -> Dict[str, str]:
+        """Hash the pending source files and return the checksums of all sources."""
+        for key, path in list(self.files.items()):
+            # A file removed by the crawler is left out, which won't match the
+            # fingerprint of a crawl that still had it:
+            if path.is_file():
+                self.sources[key] = file_checksum(path)
+            self.files.pop(key)
+        return self.sources
+
+    def fingerprint(self) -> Dict[str, Any]:
+        return {"code": self.code, "sources": self.checksums()}
+
+    def save(self) -> None:
+        with open(self.path, "w") as fh:
+            json.dump(self.fingerprint(), fh, indent=2, sort_keys=True)
+
+    def clear(self) -> None:
+        self.sources = {}
+        self.files = {}
+        self.path.unlink(missing_ok=True)
+
+    def previous(self) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """Get the latest published version of the dataset, and the fingerprint of
+        its sources if it was recorded."""
+        for version in iter_dataset_versions(self.dataset.name):
+            object = get_artifact_object(self.dataset.name, SOURCES_FILE, version.id)
+            if object is None:
+                return version.id, None
+            with object.open() as fh:
+                return version.id, json.load(fh)
+        return None, None
+
+    def unchanged(self) -> Optional[str]:
+        """If the sources recorded so far match those of the latest published
+        version of the dataset, return the ID of that version."""
+        if not len(self.sources) and not len(self.files):
+            return None
+        version, previous = self.previous()
+        if version is None or previous is None:
+            return None
+        if previous != self.fingerprint():
+            log.info("Sources have changed", dataset=self.dataset.name, version=version)
+            return None
+        return version
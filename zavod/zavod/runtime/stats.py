@@ -13,3 +13,5 @@ class ContextStats(object):
         self.changed = 0
         self.entities = 0
         self.targets = 0
+        self.sink_backlog = 0
+        self.unchanged = False
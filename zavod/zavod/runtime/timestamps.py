@@ -1,24 +1,61 @@
+import shutil
 import plyvel  # type: ignore
-from typing import Dict, Iterable
+from typing import Any, Dict, Iterable, List, Optional
 from nomenklatura.statement import Statement
 from rigour.env import ENCODING as E
 
+from zavod import settings
 from zavod.logs import get_logger
 from zavod.meta import Dataset
 from zavod.archive import dataset_state_path, iter_previous_statements
+from zavod.archive import get_statements_object, ARTIFACTS
 
 log = get_logger(__name__)
+# Entity IDs can't start with a NUL byte, so this won't collide with index keys:
+SOURCE_KEY = b"\x00source"
 
 
 class TimeStampIndex(object):
-    def __init__(self, dataset: Dataset) -> None:
-        path = dataset_state_path(dataset.name) / "timestamps"
-        self.db = plyvel.DB(path.as_posix(), create_if_missing=True)
+    """An index of the first_seen timestamp of each statement emitted by the
+    previous version of a dataset.
+
+    By default, the index is a LevelDB keyed by `<entity_id>:<statement_id>`.
+    In compact mode, it is instead held in memory as a mapping of statement ID
+    hashes to an ordinal into the list of distinct timestamps, which is much
+    faster for datasets that fit in RAM.
+
+    The LevelDB index records the archive object it was built from, so that it can
+    be re-used by subsequent runs until a new version of the dataset is published.
+    """
+
+    def __init__(self, dataset: Dataset, compact: bool = False) -> None:
+        self.path = dataset_state_path(dataset.name) / "timestamps"
+        self.compact = compact
+        self.db: Optional[plyvel.DB] = None
+        self.stamps: Dict[int, int] = {}
+        self.values: List[str] = []
+        if not compact:
+            self.db = plyvel.DB(self.path.as_posix(), create_if_missing=True)
 
     def index(self, statements: Iterable[Statement]) -> None:
-        log.info("Building timestamp index...")
-        batch = self.db.write_batch()
+        log.info("Building timestamp index...", compact=self.compact)
         idx = 0
+        if self.db is None:
+            ordinals: Dict[str, int] = {}
+            for idx, stmt in enumerate(statements):
+                if stmt.first_seen is None or stmt.id is None:
+                    continue
+                if len(stmt.first_seen.strip()) == 0:
+                    continue
+                ordinal = ordinals.get(stmt.first_seen)
+                if ordinal is None:
+                    ordinal = ordinals[stmt.first_seen] = len(self.values)
+                    self.values.append(stmt.first_seen)
+                self.stamps[hash(stmt.id)] = ordinal
+            log.info("Index ready.", count=idx)
+            return
+
+        batch = self.db.write_batch()
         for idx, stmt in enumerate(statements):
             if stmt.first_seen is None or stmt.id is None or stmt.entity_id is None:
                 continue
@@ -35,24 +72,96 @@ class TimeStampIndex(object):
 
     @classmethod
     def build(cls, dataset: Dataset) -> "TimeStampIndex":
-        index = cls(dataset)
+        index = cls(dataset, compact=settings.TIMESTAMP_INDEX_COMPACT)
+        # Only versioned artifacts are immutable, the legacy `latest` path isn't:
+        source: Optional[str] = None
+        object = get_statements_object(dataset.name)
+        if object is not None and object.name.startswith(f"{ARTIFACTS}/"):
+            source = object.name
+        if index.db is not None:
+            if source is not None and index.source == source:
+                log.info("Re-using timestamp index.", source=source)
+                return index
+            index.clear()
         index.index(iter_previous_statements(dataset, external=False))
+        if index.db is not None and source is not None:
+            index.db.put(SOURCE_KEY, source.encode(E))
         return index
 
-    def get(self, entity_id: str) -> Dict[str, str]:
+    @property
+    def source(self) -> Optional[str]:
+        """The name of the archive object the index was built from."""
+        if self.db is None:
+            return None
+        value = self.db.get(SOURCE_KEY)
+        if value is None:
+            return None
+        return str(value.decode(E))
+
+    def clear(self) -> None:
+        """Delete all entries from the index."""
+        self.stamps = {}
+        self.values = []
+        if self.db is not None:
+            self.db.close()
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.db = plyvel.DB(self.path.as_posix(), create_if_missing=True)
+
+    def get(
+        self, entity_id: str, statement_ids: Optional[Iterable[str]] = None
+    ) -> Dict[str, str]:
+        """Get the first_seen timestamps of the statements of an entity, keyed by
+        statement ID.
+
+        Args:
+            entity_id: The ID of the entity to look up.
+            statement_ids: The statement IDs to look up. Only required by the
+                compact index, which is not keyed by entity.
+        """
+        if self.db is None:
+            timestamps: Dict[str, str] = {}
+            for stmt_id in statement_ids or []:
+                ordinal = self.stamps.get(hash(stmt_id))
+                if ordinal is not None:
+                    timestamps[stmt_id] = self.values[ordinal]
+            return timestamps
+        return self._scan(self.db, entity_id)
+
+    def get_many(self, entity_ids: Iterable[str]) -> Dict[str, Dict[str, str]]:
+        """Get the first_seen timestamps for a batch of entities, using a single
+        ordered pass over the index. Not supported by the compact index."""
+        if self.db is None:
+            raise RuntimeError("Compact timestamp index is not keyed by entity.")
+        results: Dict[str, Dict[str, str]] = {}
+        with self.db.iterator() as it:
+            for entity_id in sorted(set(entity_ids)):
+                timestamps: Dict[str, str] = {}
+                prefix = f"{entity_id}:".encode(E)
+                offset = len(prefix)
+                it.seek(prefix)
+                for key, value in it:
+                    if not key.startswith(prefix):
+                        break
+                    timestamps[key[offset:].decode(E)] = value.decode(E)
+                results[entity_id] = timestamps
+        return results
+
+    def _scan(self, db: Any, entity_id: str) -> Dict[str, str]:
+        # The delimiter makes sure that `Q1` doesn't also match `Q12:...`:
         timestamps: Dict[str, str] = {}
-        prefix = entity_id.encode(E)
-        with self.db.iterator(prefix=prefix) as it:
+        prefix = f"{entity_id}:".encode(E)
+        offset = len(prefix)
+        with db.iterator(prefix=prefix) as it:
             for key, value in it:
-                stmt_id = key.decode(E).split(":", 1)[1]
-                timestamps[stmt_id] = value.decode(E)
+                timestamps[key[offset:].decode(E)] = value.decode(E)
         return timestamps
 
     def close(self) -> None:
-        self.db.close()
+        if self.db is not None:
+            self.db.close()
 
     def __hash__(self) -> int:
-        return hash(self.db.name)
+        return hash(self.path)
 
     def __repr__(self) -> str:
-        return f"<TimeStampIndex({self.db.name!r})>"
+        return f"<TimeStampIndex({self.path.as_posix()!r})>"
@@ -1,4 +1,4 @@
-from os import environ as env
+from os import environ as env, cpu_count
 from pathlib import Path
 from banal import as_bool
 from normality import stringify
@@ -68,6 +68,53 @@ ENRICH_TOPICS = {
 
 # Store configuration
 STORE_RETAIN_DAYS = int(env_str("ZAVOD_STORE_RETAIN_DAYS", "3"))
+# Number of processes used to load dataset leaves into the store
+STORE_SYNC_WORKERS = int(env_str("ZAVOD_STORE_SYNC_WORKERS", "1"))
+
+# Number of processes used to run the shards of a crawl (`context.map_shards`)
+SHARD_WORKERS = int(env_str("ZAVOD_SHARD_WORKERS", str(cpu_count() or 1)))
+
+# Number of processes used to tokenize entities when building a matching index
+INDEX_TOKENIZE_WORKERS = int(env_str("ZAVOD_INDEX_TOKENIZE_WORKERS", "1"))
+
+# Number of processes used to score match candidates in local enrichment
+ENRICH_WORKERS = int(env_str("ZAVOD_ENRICH_WORKERS", "1"))
+
+# Number of threads and memory budget (in MB, 0 for no limit) of the matching index
+INDEX_THREADS = int(env_str("ZAVOD_INDEX_THREADS", "1"))
+INDEX_MEMORY_BUDGET = int(env_str("ZAVOD_INDEX_MEMORY_BUDGET", "0"))
+
+# Treat tokens occurring more often than this as stopwords in the matching index
+INDEX_MAX_TOKEN_FREQ = int(env_str("ZAVOD_INDEX_MAX_TOKEN_FREQ", "0"))
+
+# Re-use the statements of the previous version if a crawler's sources are unchanged
+REUSE_UNCHANGED = as_bool(env_str("ZAVOD_REUSE_UNCHANGED", "true"))
+
+# Hold the statement timestamp index in memory instead of LevelDB
+TIMESTAMP_INDEX_COMPACT = as_bool(env_str("ZAVOD_TIMESTAMP_INDEX_COMPACT", "false"))
+
+# Compress the statements file written by crawlers: "gz", "zst" or empty
+STATEMENTS_COMPRESSION = env_str("ZAVOD_STATEMENTS_COMPRESSION", "")
+
+# Serialize emitted statements in a background writer thread
+SINK_BACKGROUND = as_bool(env_str("ZAVOD_SINK_BACKGROUND", "false"))
+SINK_QUEUE_SIZE = int(env_str("ZAVOD_SINK_QUEUE_SIZE", "10000"))
+
+# Run each exporter in a worker thread, fed via a bounded queue
+EXPORT_PARALLEL = as_bool(env_str("ZAVOD_EXPORT_PARALLEL", "false"))
+EXPORT_QUEUE_SIZE = int(env_str("ZAVOD_EXPORT_QUEUE_SIZE", "1000"))
+# Number of adjacent entities memoized during export, shared by all exporters
+EXPORT_ADJACENT_CACHE = int(env_str("ZAVOD_EXPORT_ADJACENT_CACHE", "20000"))
+
+# Nesting of adjacent entities in the targets.nested.json export: depth, maximum
+# number of nested entities per property (0 for no limit) and LRU cache size
+NESTED_DEPTH = int(env_str("ZAVOD_NESTED_DEPTH", "1"))
+NESTED_MAX_FANOUT = int(env_str("ZAVOD_NESTED_MAX_FANOUT", "0"))
+NESTED_CACHE_SIZE = int(env_str("ZAVOD_NESTED_CACHE_SIZE", "10000"))
+
+# Number of entity hashes held in memory per version when computing the delta
+# export, beyond which they are spilled to sorted run files on disk
+DELTA_MEMORY_LIMIT = int(env_str("ZAVOD_DELTA_MEMORY_LIMIT", "1000000"))
 
 # Release version
 RELEASE = env_str("ZAVOD_RELEASE", RUN_TIME.strftime("%Y%m%d"))
@@ -83,6 +130,11 @@ ARCHIVE_BUCKET = env.get("OPENSANCTIONS_BACKFILL_BUCKET", ARCHIVE_BUCKET)
 ARCHIVE_PATH = Path(env.get("ZAVOD_ARCHIVE_PATH", DATA_PATH.joinpath("archive")))
 BACKFILL_RELEASE = env_str("ZAVOD_BACKFILL_RELEASE", "latest")
 
+# Number of files uploaded concurrently when publishing a dataset, and the size
+# in MB above which a file is itself uploaded in concurrent parts (0 to disable)
+PUBLISH_WORKERS = int(env_str("ZAVOD_PUBLISH_WORKERS", "4"))
+PUBLISH_MULTIPART_SIZE = int(env_str("ZAVOD_PUBLISH_MULTIPART_SIZE", "256"))
+
 # File path for the resolver path used for entity deduplication
 RESOLVER_PATH = env.get("ZAVOD_RESOLVER_PATH")
 RESOLVER_PATH = env.get("OPENSANCTIONS_RESOLVER_PATH", RESOLVER_PATH)
@@ -91,10 +143,19 @@ RESOLVER_PATH = env.get("OPENSANCTIONS_RESOLVER_PATH", RESOLVER_PATH)
 HTTP_TIMEOUT = 1200
 HTTP_USER_AGENT = "Mozilla/5.0 (zavod)"
 HTTP_USER_AGENT = env_str("ZAVOD_HTTP_USER_AGENT", HTTP_USER_AGENT)
+# Number of threads used by `context.fetch_many` to run requests concurrently
+HTTP_FETCH_WORKERS = int(env_str("ZAVOD_HTTP_FETCH_WORKERS", "8"))
 
 # Database-backed cache settings
 CACHE_DATABASE_URI = env.get("ZAVOD_DATABASE_URI")
 CACHE_DATABASE_URI = env.get("OPENSANCTIONS_DATABASE_URI", CACHE_DATABASE_URI)
+# Cached values larger than this (in bytes) are stored as compressed files next to
+# the local cache database, rather than inside it. Set to 0 to disable.
+CACHE_BLOB_THRESHOLD = int(env_str("ZAVOD_CACHE_BLOB_THRESHOLD", "65536"))
+# Size budget (in MB) for the cache files, evicting the oldest entries beyond it
+CACHE_BLOB_BUDGET = int(env_str("ZAVOD_CACHE_BLOB_BUDGET", "0"))
+# Evict cache entries older than this number of days when closing the cache
+CACHE_MAX_AGE = int(env_str("ZAVOD_CACHE_MAX_AGE", "0"))
 
 # Load DB batch size
 DB_BATCH_SIZE = int(env_str("ZAVOD_DB_BATCH_SIZE", "1000"))
@@ -114,5 +175,7 @@ WD_ACCESS_SECRET = env.get("ZAVOD_WD_ACCESS_SECRET")
 WD_USER = env.get("ZAVOD_WD_USER")
 
 ZYTE_API_KEY = env.get("OPENSANCTIONS_ZYTE_API_KEY", None)
+# Requests per second sent to the Zyte API by each crawler
+ZYTE_API_RATE_LIMIT = float(env_str("ZAVOD_ZYTE_API_RATE_LIMIT", "8"))
 OPENAI_API_KEY = env.get("OPENSANCTIONS_OPENAI_API_KEY", None)
 AZURE_OPENAI_ENDPOINT = env.get("OPENSANCTIONS_AZURE_OPENAI_ENDPOINT", None)
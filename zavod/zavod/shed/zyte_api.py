@@ -1,10 +1,8 @@
 from pathlib import Path
 from lxml import html, etree
-from time import sleep
 from base64 import b64decode
 from typing import Any, Dict, List, Optional, Tuple
 from requests import Session
-from requests.adapters import HTTPAdapter
 from urllib3 import Retry
 from email.message import Message
 import json
@@ -13,6 +11,7 @@ from zavod import settings
 from zavod.archive import dataset_data_path
 from zavod.context import Context
 from zavod.runtime.http_ import request_hash
+from zavod.runtime.http_ import RateLimiter, RateLimitedAdapter
 
 
 ZYTE_API_URL = "https://api.zyte.com/v1/extract"
@@ -39,14 +38,23 @@ def get_content_type(headers: List[Dict[str, str]]) -> Tuple[str, str | None]:
     return media_type, charset
 
 
-def configure_session(session: Session) -> None:
+def configure_session(session: Session) -> RateLimiter:
+    """Mount an adapter for the Zyte API on the session, with its own retries and
+    rate limit, and return its rate limiter."""
+    adapter = session.adapters.get(ZYTE_API_URL)
+    if isinstance(adapter, RateLimitedAdapter):
+        return adapter.limiter
     zyte_retries = Retry(
         total=10,
         backoff_factor=3,
         status_forcelist=list(Retry.RETRY_AFTER_STATUS_CODES) + [520],
         allowed_methods=["POST"],
     )
-    session.mount(ZYTE_API_URL, HTTPAdapter(max_retries=zyte_retries))
+    # The API is limited per account, not by the rate limit of the crawled site:
+    limiter = RateLimiter(settings.ZYTE_API_RATE_LIMIT)
+    adapter = RateLimitedAdapter(limiter, max_retries=zyte_retries)
+    session.mount(ZYTE_API_URL, adapter)
+    return limiter
 
 
 def fetch_resource(
@@ -300,7 +308,7 @@ def fetch_html(
 
     context.log.debug(f"Zyte API request: {url}", data=zyte_data)
     zyte_data["url"] = url
-    configure_session(context.http)
+    limiter = configure_session(context.http)
     api_response = context.http.post(
         ZYTE_API_URL,
         auth=(settings.ZYTE_API_KEY, ""),
@@ -330,7 +338,8 @@ def fetch_html(
                 retries=retries,
                 previous_retries=previous_retries,
             )
-            sleep(pause)
+            # The retry waits for the pause in the rate limiter of the API:
+            limiter.pause(ZYTE_API_URL, pause)
             return fetch_html(
                 context,
                 url,
@@ -1,21 +1,39 @@
 import shutil
+import struct
+import multiprocessing
 import plyvel  # type: ignore
-from typing import List, Optional
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+from tempfile import mkstemp
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from hashlib import sha1
+from typing import Any, BinaryIO, Dict, Generator, List, Optional, Set, Tuple
 from followthemoney.exc import InvalidData
+from followthemoney.property import Property
+from followthemoney.types import registry
 from nomenklatura.statement import Statement
-from nomenklatura.resolver import Linker
-from nomenklatura.store.level import LevelDBStore, LevelDBView
+from nomenklatura.resolver import Linker, Resolver
+from nomenklatura.store.level import LevelDBStore, LevelDBView, LevelDBWriter
+from nomenklatura.store.level import unpack_statement
+from nomenklatura.versions import VersionHistory
 from nomenklatura.publish.dates import simplify_dates
 from nomenklatura.publish.edges import simplify_undirected
 
+from zavod import settings
 from zavod.logs import get_logger
 from zavod.entity import Entity
 from zavod.meta import Dataset
-from zavod.archive import dataset_state_path
-from zavod.archive import iter_dataset_statements
+from zavod.archive import dataset_state_path, dataset_resource_path
+from zavod.archive import iter_dataset_statements, get_versions_data
+from zavod.archive import VERSIONS_FILE, STATEMENTS_FILES
 
 log = get_logger(__name__)
 View = LevelDBView[Dataset, Entity]
+# Bookkeeping for incremental syncs, stored alongside the statements:
+VERSION_PREFIX = b"lv:"
+LINKER_KEY = b"lk"
 
 
 def get_store(dataset: Dataset, linker: Linker[Entity]) -> "Store":
@@ -23,6 +41,66 @@ def get_store(dataset: Dataset, linker: Linker[Entity]) -> "Store":
     return store
 
 
+class CachedView(View):
+    """A view which memoizes the adjacent entities of recently seen entities, so
+    that multiple consumers of the same entity (e.g. exporters) don't assemble its
+    neighbourhood from the store repeatedly. The cache is bounded by the total
+    number of adjacent entities held, and evicts the least recently used."""
+
+    def __init__(self, view: View, max_adjacents: int) -> None:
+        super().__init__(view.store, view.scope, external=view.external)
+        self.max_adjacents = max_adjacents
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._lock = Lock()
+        self._cache: OrderedDict[Tuple[str, bool], List[Tuple[Property, Entity]]] = (
+            OrderedDict()
+        )
+
+    def _fetch(
+        self, entity_id: str, inverted: bool
+    ) -> Optional[List[Tuple[Property, Entity]]]:
+        key = (entity_id, inverted)
+        with self._lock:
+            adjacent = self._cache.get(key)
+            if adjacent is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return adjacent
+
+    def _store(
+        self, entity_id: str, inverted: bool, adjacent: List[Tuple[Property, Entity]]
+    ) -> None:
+        # Entities without adjacents still take up a slot, to bound the entries:
+        weight = max(1, len(adjacent))
+        if weight > self.max_adjacents:
+            return
+        key = (entity_id, inverted)
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = adjacent
+            self._size += weight
+            while self._size > self.max_adjacents:
+                _, evicted = self._cache.popitem(last=False)
+                self._size -= max(1, len(evicted))
+
+    def get_adjacent(
+        self, entity: Entity, inverted: bool = True
+    ) -> Generator[Tuple[Property, Entity], None, None]:
+        if entity.id is None:
+            yield from super().get_adjacent(entity, inverted=inverted)
+            return
+        adjacent = self._fetch(entity.id, inverted)
+        if adjacent is None:
+            adjacent = list(super().get_adjacent(entity, inverted=inverted))
+            self._store(entity.id, inverted, adjacent)
+        yield from adjacent
+
+
 class Store(LevelDBStore[Dataset, Entity]):
     def __init__(
         self,
@@ -54,25 +132,39 @@ class Store(LevelDBStore[Dataset, Entity]):
             entity = simplify_undirected(entity)
         return entity
 
-    def sync(self, clear: bool = False) -> None:
+    def sync(
+        self,
+        clear: bool = False,
+        workers: Optional[int] = None,
+        incremental: bool = False,
+    ) -> None:
+        """Load the statements of all leaf datasets into the store.
+
+        Args:
+            clear: Delete the existing store contents first.
+            workers: Number of processes used to download and decode leaf datasets
+                in parallel. Defaults to the `ZAVOD_STORE_SYNC_WORKERS` setting.
+            incremental: Only reload the leaf datasets which have a new version
+                since they were last loaded into the store.
+        """
+        if workers is None:
+            workers = settings.STORE_SYNC_WORKERS
+        if incremental and not clear:
+            self._sync_incremental(workers)
+            return
         if clear:
             self.clear()
         ds_key = f"dataset:{self.dataset.name}".encode("utf-8")
         if self.db.get(ds_key):
             return
-        log.info("Building local LevelDB aggregator...", scope=self.dataset.name)
-        idx = 0
-        with self.writer() as writer:
-            stmts = iter_dataset_statements(self.dataset, external=True)
-            for idx, stmt in enumerate(stmts):
-                if idx > 0 and idx % 50_000 == 0:
-                    log.info(
-                        "Indexing aggregator...",
-                        statements=idx,
-                        scope=self.dataset.name,
-                        dataset=stmt.dataset,
-                    )
-                writer.add_statement(stmt)
+        log.info(
+            "Building local LevelDB aggregator...",
+            scope=self.dataset.name,
+            workers=workers,
+        )
+        versions = {n: _leaf_version(n) for n in self.dataset.leaf_names}
+        idx = self._load(sorted(versions.keys()), workers)
+        self._put_versions(versions)
         self.db.put(ds_key, b"1")
         self.db.compact_range()
         log.info(
@@ -81,9 +173,289 @@ class Store(LevelDBStore[Dataset, Entity]):
             statements=idx,
         )
 
+    def _sync_incremental(self, workers: int) -> None:
+        digest = _linker_digest(self.linker)
+        stored = self.db.get(LINKER_KEY)
+        if digest is None or stored is None or stored.decode("utf-8") != digest:
+            log.info("Linker has changed, rebuilding store.", scope=self.dataset.name)
+            self.sync(clear=True, workers=workers)
+            return
+        loaded: Dict[str, Optional[str]] = {}
+        with self.db.iterator(prefix=VERSION_PREFIX) as it:
+            for key, value in it:
+                name = key[len(VERSION_PREFIX) :].decode("utf-8")
+                loaded[name] = value.decode("utf-8")
+        versions = {n: _leaf_version(n) for n in self.dataset.leaf_names}
+        changed = [n for n, v in versions.items() if v is None or loaded.get(n) != v]
+        removed = [n for n in loaded.keys() if n not in versions]
+        log.info(
+            "Updating local LevelDB aggregator...",
+            scope=self.dataset.name,
+            leaves=len(versions),
+            changed=len(changed),
+            removed=len(removed),
+        )
+        if not len(changed) and not len(removed):
+            return
+        if set(versions).issubset(changed):
+            # Nothing can be kept, so dropping the store is cheaper than scanning it:
+            self.sync(clear=True, workers=workers)
+            return
+        self._delete_leaves([*changed, *removed])
+        idx = self._load(sorted(changed), workers)
+        self._put_versions({n: versions[n] for n in changed})
+        self.db.compact_range()
+        log.info(
+            "Local LevelDB aggregator is ready.",
+            scope=self.dataset.name,
+            statements=idx,
+        )
+
+    def version(self) -> Optional[str]:
+        """Identify the contents of the store by the versions of the leaf datasets
+        loaded into it, and the linker used to load them. Returns None if these
+        were not recorded for all leaf datasets."""
+        linker = self.db.get(LINKER_KEY)
+        if linker is None:
+            return None
+        digest = sha1(linker)
+        for name in sorted(self.dataset.leaf_names):
+            version = self.db.get(VERSION_PREFIX + name.encode("utf-8"))
+            if version is None:
+                return None
+            digest.update(b"\n" + name.encode("utf-8") + b":" + version)
+        return digest.hexdigest()
+
+    def _put_versions(self, versions: Dict[str, Optional[str]]) -> None:
+        batch = self.db.write_batch()
+        for name, version in versions.items():
+            if version is not None:
+                batch.put(
+                    VERSION_PREFIX + name.encode("utf-8"), version.encode("utf-8")
+                )
+        digest = _linker_digest(self.linker)
+        if digest is not None:
+            batch.put(LINKER_KEY, digest.encode("utf-8"))
+        batch.write()
+
+    def _delete_leaves(self, names: List[str]) -> None:
+        """Remove all statements of the given leaf datasets from the store, using a
+        single scan of the entity index."""
+        if not len(names):
+            return
+        drop = set(names)
+        entities: Dict[str, Set[str]] = {}
+        with self.db.iterator(prefix=b"e:", include_value=False) as it:
+            for key in it:
+                # Dataset names can't contain a colon, canonical IDs might:
+                canonical_id, name = key[2:].decode("utf-8").rsplit(":", 1)
+                if name in drop:
+                    entities.setdefault(canonical_id, set()).add(name)
+        batch = self.db.write_batch()
+        counts: Dict[str, int] = {name: 0 for name in names}
+        for canonical_id, datasets in entities.items():
+            kept: Set[str] = set()
+            dropped: Set[str] = set()
+            for prefix in (f"s:{canonical_id}:", f"x:{canonical_id}:"):
+                with self.db.iterator(prefix=prefix.encode("utf-8")) as it:
+                    for key, value in it:
+                        stmt = unpack_statement(value, canonical_id, False)
+                        removed = stmt.dataset in datasets
+                        refs = dropped if removed else kept
+                        if stmt.prop_type == registry.entity.name:
+                            refs.add(self.linker.get_canonical(stmt.value))
+                        if removed:
+                            batch.delete(key)
+            # Inverted references are shared by all datasets making the link:
+            for ref in dropped.difference(kept):
+                batch.delete(f"i:{ref}:{canonical_id}".encode("utf-8"))
+            for name in datasets:
+                batch.delete(f"e:{canonical_id}:{name}".encode("utf-8"))
+                counts[name] += 1
+        for name in names:
+            batch.delete(f"ls:{name}".encode("utf-8"))
+            batch.delete(VERSION_PREFIX + name.encode("utf-8"))
+        batch.write()
+        for name, count in counts.items():
+            log.info("Removed dataset from aggregator", dataset=name, entities=count)
+
+    def _load(self, names: List[str], workers: int) -> int:
+        if workers > 1 and len(names) > 1:
+            return self._sync_parallel(workers, names)
+        leaves = {leaf.name: leaf for leaf in self.dataset.leaves}
+        idx = 0
+        with self.writer() as writer:
+            for name in names:
+                stmts = iter_dataset_statements(leaves[name], external=True)
+                for stmt in stmts:
+                    idx += 1
+                    if idx % 50_000 == 0:
+                        log.info(
+                            "Indexing aggregator...",
+                            statements=idx,
+                            scope=self.dataset.name,
+                            dataset=stmt.dataset,
+                        )
+                    writer.add_statement(stmt)
+        return idx
+
+    def _sync_parallel(self, workers: int, names: List[str]) -> int:
+        linker = self.linker
+        if isinstance(linker, Resolver):
+            linker = linker.get_linker()
+        total = 0
+        # The parent holds the LevelDB store and its threads, so the workers are
+        # started from a fork server rather than forked from this process:
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=_init_sync_worker,
+            initargs=(linker, _worker_settings()),
+        )
+        with pool:
+            spool_dir = self.path.parent
+            leaves = {leaf.name: leaf for leaf in self.dataset.leaves}
+            futures = [pool.submit(_spool_leaf, leaves[n], spool_dir) for n in names]
+            for future in as_completed(futures):
+                name, path, count, elapsed = future.result()
+                start = perf_counter()
+                try:
+                    with open(path, "rb") as fh:
+                        _ingest_spool(self.db, fh)
+                finally:
+                    path.unlink(missing_ok=True)
+                total += count
+                log.info(
+                    "Loaded dataset into aggregator",
+                    scope=self.dataset.name,
+                    dataset=name,
+                    statements=count,
+                    decode_time=round(elapsed, 2),
+                    ingest_time=round(perf_counter() - start, 2),
+                    rate=round(count / max(elapsed, 0.001)),
+                )
+        return total
+
     def clear(self) -> None:
         """Delete the working directory data for the latest version of the dataset
         from this store."""
         self.db.close()
         shutil.rmtree(self.path, ignore_errors=True)
         self.db = plyvel.DB(self.path.as_posix(), create_if_missing=True)
+
+
+def _leaf_version(name: str) -> Optional[str]:
+    """Identify the version of a leaf dataset that would be loaded into the store:
+    the latest entry in its `versions.json`, either from a local run or the archive.
+    Local statement files are also identified by their modification time, since
+    they can be re-generated without a new version."""
+    path = dataset_resource_path(name, VERSIONS_FILE)
+    data = path.read_text() if path.exists() else get_versions_data(name)
+    if data is None:
+        return None
+    latest = VersionHistory.from_json(data).latest
+    if latest is None:
+        return None
+    for file_name in STATEMENTS_FILES:
+        stmts_path = dataset_resource_path(name, file_name)
+        if stmts_path.exists():
+            stat = stmts_path.stat()
+            return f"{latest.id}:{stat.st_mtime_ns}:{stat.st_size}"
+    return latest.id
+
+
+def _linker_digest(linker: Linker[Entity]) -> Optional[str]:
+    """Fingerprint the entity clusters of a linker, since the store is keyed by
+    canonical ID. Resolvers are mutable, so the store can't be updated in place."""
+    if isinstance(linker, Resolver):
+        return None
+    digest = sha1()
+    for canonical in sorted(c.id for c in linker.canonicals()):
+        referents = sorted(linker.get_referents(canonical))
+        digest.update(f"{canonical}:{','.join(referents)}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Parallel sync: worker processes decode the statements of a leaf dataset and
+# generate the store keys for them, using the same writer code as the store itself.
+# The key/value pairs are written to a spool file in sorted runs, which the main
+# process then ingests as LevelDB write batches.
+_RUN = struct.Struct(">I")
+_PAIR = struct.Struct(">II")
+_worker_linker: Optional[Linker[Entity]] = None
+
+
+class _SpoolBatch(object):
+    def __init__(self, fh: BinaryIO) -> None:
+        self.fh = fh
+        self.pairs: Dict[bytes, bytes] = {}
+
+    def put(self, key: bytes, value: bytes) -> None:
+        self.pairs[key] = value
+
+    def write(self) -> None:
+        self.fh.write(_RUN.pack(len(self.pairs)))
+        for key, value in sorted(self.pairs.items()):
+            self.fh.write(_PAIR.pack(len(key), len(value)))
+            self.fh.write(key)
+            self.fh.write(value)
+
+
+class _SpoolDB(object):
+    # Only provides the write batches used by `LevelDBWriter.add_statement`:
+    def __init__(self, fh: BinaryIO) -> None:
+        self.fh = fh
+
+    def write_batch(self) -> _SpoolBatch:
+        return _SpoolBatch(self.fh)
+
+
+class _SpoolStore(object):
+    def __init__(self, linker: Linker[Entity], fh: BinaryIO) -> None:
+        self.linker = linker
+        self.db = _SpoolDB(fh)
+
+
+def _worker_settings() -> Dict[str, Any]:
+    return {
+        "DATA_PATH": settings.DATA_PATH,
+        "ARCHIVE_BACKEND": settings.ARCHIVE_BACKEND,
+        "ARCHIVE_BUCKET": settings.ARCHIVE_BUCKET,
+        "ARCHIVE_PATH": settings.ARCHIVE_PATH,
+        "STATEMENTS_COMPRESSION": settings.STATEMENTS_COMPRESSION,
+    }
+
+
+def _init_sync_worker(linker: Linker[Entity], config: Dict[str, Any]) -> None:
+    global _worker_linker
+    _worker_linker = linker
+    for key, value in config.items():
+        setattr(settings, key, value)
+
+
+def _spool_leaf(dataset: Dataset, spool_dir: Path) -> Tuple[str, Path, int, float]:
+    assert _worker_linker is not None, "Sync worker is not initialised"
+    start = perf_counter()
+    fd, path = mkstemp(prefix=f"{dataset.name}.", suffix=".spool", dir=spool_dir)
+    count = 0
+    with open(fd, "wb") as fh:
+        store: Any = _SpoolStore(_worker_linker, fh)
+        writer = LevelDBWriter(store)
+        for stmt in iter_dataset_statements(dataset, external=True):
+            writer.add_statement(stmt)
+            count += 1
+        writer.flush()
+    return dataset.name, Path(path), count, perf_counter() - start
+
+
+def _ingest_spool(db: Any, fh: BinaryIO) -> None:
+    while True:
+        header = fh.read(_RUN.size)
+        if not header:
+            break
+        (length,) = _RUN.unpack(header)
+        batch = db.write_batch()
+        for _ in range(length):
+            key_len, value_len = _PAIR.unpack(fh.read(_PAIR.size))
+            batch.put(fh.read(key_len), fh.read(value_len))
+        batch.write()
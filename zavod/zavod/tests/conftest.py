@@ -9,6 +9,7 @@ from zavod import settings
 from zavod.context import Context
 from zavod.meta import get_catalog, load_dataset_from_path, Dataset
 from zavod.integration import get_resolver
+from zavod.archive import get_versions_data
 
 nk_settings.TESTING = True
 settings.DATA_PATH = Path(mkdtemp()).resolve()
@@ -42,6 +43,7 @@ def wrap_test():
     yield
     get_catalog.cache_clear()
     get_engine.cache_clear()
+    get_versions_data.cache_clear()
 
 
 @pytest.fixture(scope="function")
@@ -1,7 +1,12 @@
 from copy import deepcopy
+from typing import Any, List
+from time import perf_counter
 import shutil
 
+import pytest
+
 from nomenklatura.entity import CompositeEntity
+from nomenklatura.enrich.common import EnrichmentException
 from nomenklatura.judgement import Judgement
 
 from zavod import settings
@@ -9,6 +14,8 @@ from zavod.archive import clear_data_path
 from zavod.context import Context
 from zavod.crawl import crawl_dataset
 from zavod.meta import Dataset
+from zavod.entity import Entity
+from zavod.runner import local_enricher
 from zavod.runner.local_enricher import LocalEnricher
 from zavod.integration import get_resolver
 from zavod.store import get_store
@@ -207,3 +214,80 @@ def test_limit(vcontext: Context):
     assert len(results) == 0, results
 
     shutil.rmtree(settings.DATA_PATH, ignore_errors=True)
+
+
+@pytest.fixture(scope="function")
+def scoring_benchmark():
+    """Run the scoring of candidates for all subjects of an enricher, returning
+    the matches and the number of candidate pairs scored per second."""
+
+    def run(enricher: LocalEnricher, subjects: List[Entity]):
+        for subject in subjects:
+            enricher.load(subject)
+        by_id = {s.id: s for s in subjects}
+        candidates = [(by_id[i.id], c) for i, c in enricher.candidates()]
+        start = perf_counter()
+        results = []
+        for entity, (matches, error) in enricher.match_subjects(candidates):
+            assert error is None, error
+            results.append((entity.id, [m.id for m in matches]))
+        elapsed = max(perf_counter() - start, 0.000001)
+        return results, enricher.pairs / elapsed
+
+    return run
+
+
+def test_match_subjects_workers(vcontext: Context, scoring_benchmark):
+    """Scoring candidates in worker processes gives the same results in order"""
+    crawl_dataset(vcontext.dataset)
+    store = get_store(vcontext.dataset, get_resolver())
+    store.sync(clear=True)
+    subjects = list(store.view(vcontext.dataset).entities())
+    store.close()
+
+    enricher = load_enricher(vcontext, DATASET_DATA, "testdataset1")
+    assert enricher.workers == 1
+    serial, rate = scoring_benchmark(enricher, subjects)
+    enricher.close()
+    assert len(serial) > 0
+    assert enricher.pairs > 0
+    assert rate > 0
+
+    dataset_data = deepcopy(DATASET_DATA)
+    dataset_data["config"]["workers"] = 2
+    enricher = load_enricher(vcontext, dataset_data, "testdataset1")
+    assert enricher.workers == 2
+    parallel, rate = scoring_benchmark(enricher, subjects)
+    assert parallel == serial
+    assert rate > 0
+    enricher.close()
+
+    shutil.rmtree(settings.DATA_PATH, ignore_errors=True)
+
+
+def test_match_subjects_error(vcontext: Context, monkeypatch: Any):
+    """Matches found before scoring fails are returned with the error"""
+    crawl_dataset(vcontext.dataset)
+    store = get_store(vcontext.dataset, get_resolver())
+    store.sync(clear=True)
+    subjects = list(store.view(vcontext.dataset).entities())
+    store.close()
+
+    def fail(*args: Any) -> List[int]:
+        raise EnrichmentException("Scoring failed")
+
+    monkeypatch.setattr(local_enricher, "_rank_matches", fail)
+    enricher = load_enricher(vcontext, DATASET_DATA, "testdataset1")
+    for subject in subjects:
+        enricher.load(subject)
+    by_id = {s.id: s for s in subjects}
+    candidates = [(by_id[i.id], c) for i, c in enricher.candidates()]
+    results = list(enricher.match_subjects(candidates))
+    assert len(results) > 0
+    for entity, (matches, error) in results:
+        assert isinstance(error, EnrichmentException)
+        # The match with the same ID is found before the candidates are scored:
+        assert [m.id for m in matches] == [entity.id]
+    enricher.close()
+
+    shutil.rmtree(settings.DATA_PATH, ignore_errors=True)
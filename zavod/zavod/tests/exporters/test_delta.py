@@ -1,6 +1,7 @@
 import json
+import pytest
 from copy import deepcopy
-from typing import Any, Dict
+from typing import Any, Dict, Iterator
 from nomenklatura.versions import Version
 from nomenklatura.judgement import Judgement
 from nomenklatura.resolver import Resolver
@@ -9,9 +10,10 @@ from zavod import settings
 from zavod.meta import Dataset
 from zavod.entity import Entity
 from zavod.runtime.versions import make_version
-from zavod.archive import DELTA_EXPORT_FILE, DATASETS
+from zavod.archive import DELTA_EXPORT_FILE, DATASETS, dataset_state_path
 from zavod.store import get_store
 from zavod.exporters import export_dataset
+from zavod.runtime.delta import HashDelta
 from zavod.publish import _publish_artifacts
 
 
@@ -22,9 +24,10 @@ ENTITY_CX = {"id": "ECX", "schema": "Person", "properties": {"name": ["Carl Saga
 ENTITY_D = {"id": "ED", "schema": "Person", "properties": {"name": ["Dory"]}}
 
 
-def test_delta_exporter(testdataset1: Dataset):
+def test_delta_exporter(testdataset1: Dataset, monkeypatch: Any):
     testdataset1.exports = {DELTA_EXPORT_FILE}
     dataset_path = settings.DATA_PATH / DATASETS / testdataset1.name
+    spool_path = dataset_state_path(testdataset1.name) / "delta_spool.json"
     resolver = Resolver[Entity]()
     store = get_store(testdataset1, resolver)
 
@@ -52,6 +55,8 @@ def test_delta_exporter(testdataset1: Dataset):
 
     _publish_artifacts(testdataset1)
 
+    # Spill the hashes and spool offsets to disk from here on:
+    monkeypatch.setattr(settings, "DELTA_MEMORY_LIMIT", 2)
     version2 = Version.new("bbb")
     make_version(testdataset1, version2, overwrite=True)
     store.clear()
@@ -69,9 +74,13 @@ def test_delta_exporter(testdataset1: Dataset):
     with open(dataset_path.joinpath(DELTA_EXPORT_FILE), "r") as fh:
         objects = [json.loads(line) for line in fh.readlines()]
         assert len(objects) == 3, [o["entity"]["id"] for o in objects]
+        # The operations are sorted by entity ID:
+        ops = [(o["op"], o["entity"]["id"]) for o in objects]
+        assert ops == [("ADD", "EA"), ("MOD", "EC"), ("DEL", "ED")], ops
         for data in objects:
             if data["entity"]["id"] == "EC":
                 assert data["op"] == "MOD"
+                assert data["entity"]["properties"]["name"] == ["Charlie"]
             if data["entity"]["id"] == "EA":
                 assert data["op"] == "ADD"
             if data["entity"]["id"] == "ED":
@@ -107,3 +116,26 @@ def test_delta_exporter(testdataset1: Dataset):
                 assert data["op"] == "DEL"
             if data["entity"]["id"] == "ECX":
                 assert data["op"] == "DEL"
+    assert not spool_path.exists()
+
+    # An entity which is missing from the spool is skipped:
+    generate = HashDelta.generate
+
+    def missing(self: HashDelta) -> Iterator[Any]:
+        yield from generate(self)
+        yield ("ADD", "EZZ")
+
+    monkeypatch.setattr(HashDelta, "generate", missing)
+    export_dataset(testdataset1, view)
+    with open(dataset_path.joinpath(DELTA_EXPORT_FILE), "r") as fh:
+        ids = [json.loads(line)["entity"]["id"] for line in fh.readlines()]
+        assert "EZZ" not in ids, ids
+
+    # The spool file is removed if the export fails:
+    def fail(self: HashDelta) -> Iterator[Any]:
+        raise RuntimeError("Delta failed")
+
+    monkeypatch.setattr(HashDelta, "generate", fail)
+    with pytest.raises(RuntimeError):
+        export_dataset(testdataset1, view)
+    assert not spool_path.exists()
@@ -1,3 +1,4 @@
+import pytest
 from csv import DictReader
 from followthemoney.cli.util import path_entities
 from followthemoney.proxy import EntityProxy
@@ -7,16 +8,19 @@ from nomenklatura.stream import StreamEntity
 from nomenklatura.statement import Statement, CSV
 from nomenklatura.statement.serialize import read_path_statements
 from datetime import datetime
+from typing import Dict
 
 from zavod import settings
 from zavod.store import get_store
 from zavod.integration import get_resolver
-from zavod.exporters import export_dataset
+from zavod.context import Context
+from zavod.exporters import export_dataset, export_data
 from zavod.archive import clear_data_path, DATASETS
 from zavod.exporters.ftm import FtMExporter
 from zavod.exporters.names import NamesExporter
 from zavod.exporters.simplecsv import SimpleCSVExporter
 from zavod.exporters.statements import StatementsCSVExporter
+from zavod.exporters.parquet import StatementsParquetExporter
 from zavod.meta import Dataset, load_dataset_from_path
 from zavod.crawl import crawl_dataset
 from zavod.tests.conftest import DATASET_2_YML, COLLECTION_YML
@@ -98,6 +102,30 @@ def test_export(testdataset1: Dataset):
         assert "Oswell E. Spencer" in {t["name"] for t in targets}
 
 
+def test_export_parallel(testdataset1: Dataset):
+    dataset_path = settings.DATA_PATH / DATASETS / testdataset1.name
+    clear_data_path(testdataset1.name)
+    crawl_dataset(testdataset1)
+
+    resolver = get_resolver()
+    store = get_store(testdataset1, resolver)
+    store.sync(clear=True)
+    view = store.view(testdataset1)
+
+    def run_export(parallel: bool) -> Dict[str, bytes]:
+        context = Context(testdataset1)
+        context.begin(clear=False)
+        export_data(context, view, parallel=parallel)
+        context.close()
+        return {f: (dataset_path / f).read_bytes() for f in default_exports}
+
+    serial = run_export(False)
+    parallel = run_export(True)
+    store.close()
+    assert serial == parallel
+    assert len(parallel["targets.nested.json"]) > 0
+
+
 def test_minimal_export_config(testdataset2: Dataset):
     """Test export when dataset.exporters is empty list"""
     dataset_path = settings.DATA_PATH / "datasets" / testdataset2.name
@@ -307,3 +335,21 @@ def test_statements(testdataset1: Dataset):
     statements = list(read_path_statements(path, CSV))
     entities = [s.canonical_id for s in statements if s.prop == Statement.BASE]
     assert len(entities) == 12
+
+
+def test_statements_parquet(testdataset1: Dataset):
+    pq = pytest.importorskip("pyarrow.parquet")
+    dataset_path = settings.DATA_PATH / "datasets" / testdataset1.name
+    clear_data_path(testdataset1.name)
+
+    crawl_dataset(testdataset1)
+    harnessed_export(StatementsCSVExporter, testdataset1)
+    harnessed_export(StatementsParquetExporter, testdataset1)
+
+    csv_path = dataset_path / "statements.csv"
+    statements = {s.id: s for s in read_path_statements(csv_path, CSV)}
+    table = pq.read_table(dataset_path / "statements.parquet")
+    assert table.num_rows == len(statements)
+    assert table.schema.field("external").type == "bool"
+    for row in table.to_pylist():
+        assert row == statements[row["id"]].to_dict()
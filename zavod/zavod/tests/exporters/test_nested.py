@@ -1,8 +1,11 @@
-from json import loads
+from json import dumps, loads
 from datetime import datetime
 
 from zavod import settings
 from zavod.meta import Dataset
+from zavod.context import Context
+from zavod.store import get_store
+from zavod.integration import get_dataset_linker
 from zavod.archive import clear_data_path
 from zavod.exporters.nested import NestedTargetsJSONExporter
 from zavod.crawl import crawl_dataset
@@ -41,3 +44,43 @@ def test_nested_targets(testdataset1: Dataset):
     assert fam["id"] == family_id
     assert fam["properties"]["person"][0] == "osv-john-doe"
     assert fam["properties"]["relative"][0]["id"] == "osv-jane-doe"
+
+
+def test_nested_cache_and_caps(testdataset1: Dataset):
+    crawl_dataset(testdataset1)
+    context = Context(testdataset1)
+    store = get_store(testdataset1, get_dataset_linker(testdataset1))
+    store.sync()
+    view = store.view(testdataset1)
+    targets = [e for e in view.entities() if e.target]
+    for depth in (1, 2):
+        settings.NESTED_DEPTH = depth
+        exporter = NestedTargetsJSONExporter(context, view)
+        exporter.setup()
+        for entity in targets:
+            data, _ = exporter._nest(entity, depth, [])
+            # Round-trip through JSON, as tuples and lists differ:
+            expected = entity.to_nested_dict(view, depth=depth)
+            assert loads(dumps(data)) == loads(dumps(expected))
+        misses = exporter.misses
+        assert misses > 0
+        # Nesting the same targets again is served from the cache:
+        for entity in targets:
+            exporter._nest(entity, depth, [])
+        assert exporter.hits > 0
+        assert exporter.misses < misses * 2
+        exporter.fh.close()
+
+    settings.NESTED_DEPTH = 1
+    settings.NESTED_MAX_FANOUT = 1
+    try:
+        exporter = NestedTargetsJSONExporter(context, view)
+        exporter.setup()
+        for entity in targets:
+            data, _ = exporter._nest(entity, 1, [])
+            for values in data["properties"].values():
+                assert len(values) == 1 or not isinstance(values[0], dict)
+        exporter.fh.close()
+    finally:
+        settings.NESTED_MAX_FANOUT = 0
+    store.close()
@@ -1,5 +1,9 @@
+import pytest
+from io import BytesIO
+from pathlib import Path
+from zipfile import ZipFile
 from lxml import etree
-from zavod.helpers.xml import remove_namespace
+from zavod.helpers.xml import remove_namespace, iter_xml_elements
 from zavod.tests.conftest import XML_DOC
 
 
@@ -9,3 +13,30 @@ def test_xml_remove_namespace():
     assert doc.find(".//name") is None
     new_doc = remove_namespace(doc)
     assert new_doc.findtext(".//name") == "Peter Smith"
+
+
+def test_iter_xml_elements(tmp_path: Path):
+    names = [e.text for e in iter_xml_elements(XML_DOC, "name")]
+    assert names == ["Peter Smith"]
+    ns = {"x": "http://www.ibm.com"}
+    names = [e.text for e in iter_xml_elements(XML_DOC, "x:name", namespaces=ns)]
+    assert names == ["Peter Smith"]
+    with pytest.raises(ValueError):
+        list(iter_xml_elements(XML_DOC, "y:name", namespaces=ns))
+
+    items = "".join(f"<item><id>{i}</id></item>" for i in range(1000))
+    doc = f"<root><meta/>{items}</root>".encode("utf-8")
+    for idx, elem in enumerate(iter_xml_elements(BytesIO(doc), "item")):
+        assert elem.findtext("id") == str(idx)
+        # Processed siblings are cleared and removed from the tree:
+        previous = elem.getprevious()
+        if idx > 0:
+            assert previous is not None and len(previous) == 0
+            assert previous.getprevious() is None
+    assert idx == 999
+
+    zip_path = tmp_path / "doc.zip"
+    with ZipFile(zip_path, "w") as zf:
+        zf.writestr("data/doc.xml", doc)
+    elems = iter_xml_elements(zip_path, "id", member="data/doc.xml")
+    assert [e.text for e in elems] == [str(i) for i in range(1000)]
@@ -1,11 +1,14 @@
 from pathlib import Path
 from tempfile import mkdtemp
+from typing import Any, List, Tuple
 
 from normality import slugify
 from nomenklatura import CompositeEntity
 
 from zavod.entity import Entity
+from zavod.integration import duckdb_index
 from zavod.integration.duckdb_index import DuckDBIndex
+from zavod.integration.tokenizer import TOKENIZER_VERSION
 from zavod.crawl import crawl_dataset
 from zavod.integration import get_resolver
 from zavod.meta.dataset import Dataset
@@ -55,6 +58,23 @@ def test_pairs(testdataset_dedupe: Dataset):
     assert bond == 2.0, bond
 
 
+def test_tokenize_workers(testdataset_dedupe: Dataset):
+    crawl_dataset(testdataset_dedupe)
+    store = get_store(testdataset_dedupe, get_resolver())
+    store.sync(clear=True)
+    view = store.view(testdataset_dedupe)
+
+    index = DuckDBIndex(view, Path(mkdtemp()).resolve())
+    index.build()
+    serial = list(index.pairs())
+
+    # Tokenizing in worker processes builds the same index:
+    data_dir = Path(mkdtemp()).resolve()
+    index = DuckDBIndex(view, data_dir, {"tokenize_workers": 2})
+    index.build()
+    assert list(index.pairs()) == serial
+
+
 def test_match(testdataset1: Dataset, testdataset_dedupe: Dataset):
     crawl_dataset(testdataset_dedupe)
     data_dir = Path(mkdtemp()).resolve()
@@ -90,6 +110,29 @@ def test_match(testdataset1: Dataset, testdataset_dedupe: Dataset):
     assert john_matches[0][1] > john_matches[1][1], john_matches[1]
 
 
+def test_max_candidates(testdataset1: Dataset, testdataset_dedupe: Dataset):
+    crawl_dataset(testdataset_dedupe)
+    store = get_store(testdataset_dedupe, get_resolver())
+    store.sync(clear=True)
+    view = store.view(testdataset_dedupe)
+
+    index = DuckDBIndex(view, Path(mkdtemp()).resolve(), {"max_candidates": 2})
+    index.build()
+    # Sorts first, so it wasn't truncated when only the last subject was:
+    john = CompositeEntity.from_data(testdataset1, {**JOHN, "id": "id-a-john"})
+    index.add_matching_subject(john)
+    bond = CompositeEntity.from_data(testdataset1, BOND)
+    index.add_matching_subject(bond)
+
+    entity_matches = {}
+    for entity_id, matches in index.matches():
+        entity_matches[entity_id.id] = [(match.id, score) for match, score in matches]
+    assert len(entity_matches["id-a-john"]) == 2, entity_matches
+    assert entity_matches["id-a-john"][0][0] == "matching-john-smith-us"
+    assert entity_matches["id-a-john"][0][1] >= entity_matches["id-a-john"][1][1]
+    assert len(entity_matches["id-bond"]) == 1, entity_matches
+
+
 def test_stopwords(testdataset1: Dataset):
     def e(name: str) -> Entity:
         data = {
@@ -149,3 +192,134 @@ def test_stopwords(testdataset1: Dataset):
 
     assert len(entity_matches[too_common_first_name.id]) == 3
     assert len(entity_matches[matching_last_name.id]) == 1
+
+    # Capping token frequency at 2 -> ignore FirstA, even without stopwords
+    data_dir = Path(mkdtemp()).resolve()
+    options = {"stopwords_pct": 0, "max_token_freq": 2, "threads": 2}
+    index = DuckDBIndex(view, data_dir, options)
+    index.build()
+    stats = {s["field"]: s for s in index.field_stats()}
+    assert stats["wd"]["max_freq"] <= 2, stats
+    assert stats["name"]["rows"] == 5, stats
+
+    index.add_matching_subject(too_common_first_name)
+    index.add_matching_subject(matching_last_name)
+    entity_matches = {}
+    for entity_id, matches in index.matches():
+        entity_matches[entity_id] = [(match.id, score) for match, score in matches]
+
+    assert too_common_first_name.id not in entity_matches
+    assert entity_matches[matching_last_name.id][0][0] == "id-firsta-lasta"
+
+    # The cap can be set per field
+    data_dir = Path(mkdtemp()).resolve()
+    index = DuckDBIndex(view, data_dir, {"max_token_freq": {"wd": 2}})
+    index.build()
+    stats = {s["field"]: s for s in index.field_stats()}
+    assert stats["wd"]["max_freq"] <= 2, stats
+    assert stats["ph"]["max_freq"] > 2, stats
+
+
+def test_persistent(testdataset1: Dataset):
+    def e(name: str) -> Entity:
+        data = {
+            "schema": "Person",
+            "id": f"id-{slugify(name)}",
+            "properties": {"name": [name]},
+        }
+        return Entity.from_data(testdataset1, data)
+
+    def frequencies(index: DuckDBIndex):
+        query = "SELECT field, token, id, tf FROM term_frequencies"
+        return sorted(index.con.execute(query).fetchall())
+
+    store = get_store(testdataset1, get_resolver())
+    writer = store.writer()
+    for name in ("Jane Doe", "John Doe", "John Smith", "Mary Smith"):
+        writer.add_entity(e(name))
+    writer.flush()
+    view = store.view(testdataset1)
+
+    data_dir = Path(mkdtemp()).resolve()
+    index = DuckDBIndex(view, data_dir, persistent=True)
+    index.build(version="v1")
+    initial = frequencies(index)
+    index.close()
+
+    # The same version is re-used without re-indexing the view:
+    writer.add_entity(e("Not Indexed"))
+    writer.flush()
+    index = DuckDBIndex(view, data_dir, persistent=True)
+    index.build(version="v1")
+    assert frequencies(index) == initial
+    index.close()
+
+    # A new version only updates changed entities:
+    writer.pop("id-john-smith")
+    mary = e("Mary Smith")
+    mary.add("name", "Mary Jones")
+    writer.add_entity(mary)
+    writer.flush()
+    index = DuckDBIndex(view, data_dir, persistent=True)
+    index.build(version="v2")
+    updated = frequencies(index)
+    assert updated != initial
+    assert "id-john-smith" not in {row[2] for row in updated}
+    assert "id-not-indexed" in {row[2] for row in updated}
+    index.close()
+
+    fresh = DuckDBIndex(view, Path(mkdtemp()).resolve())
+    fresh.build()
+    assert frequencies(fresh) == updated
+
+
+def test_persistent_stopwords(testdataset1: Dataset, monkeypatch: Any):
+    def e(name: str) -> Entity:
+        data = {
+            "schema": "Person",
+            "id": f"id-{slugify(name)}",
+            "properties": {"name": [name]},
+        }
+        return Entity.from_data(testdataset1, data)
+
+    def table(index: DuckDBIndex, query: str) -> List[Tuple[Any, ...]]:
+        return sorted(index.con.execute(query).fetchall())
+
+    tf_query = "SELECT field, token, id, tf FROM term_frequencies"
+    stopwords_query = "SELECT field, token FROM stopwords"
+    store = get_store(testdataset1, get_resolver())
+    writer = store.writer()
+    for name in ("Anna Berg", "Anna Cole", "Boris Dahl", "Boris Eck", "Clara Fox"):
+        writer.add_entity(e(name))
+    writer.flush()
+    view = store.view(testdataset1)
+    options = {"stopwords_pct": 10}
+
+    data_dir = Path(mkdtemp()).resolve()
+    index = DuckDBIndex(view, data_dir, options, persistent=True)
+    index.build(version="v1")
+    index.close()
+
+    # A name becoming more common than the current stopwords replaces them, and
+    # the entities using either are updated like in a fresh build:
+    for name in ("Clara Gray", "Clara Hill", "Clara Ives"):
+        writer.add_entity(e(name))
+    writer.flush()
+    index = DuckDBIndex(view, data_dir, options, persistent=True)
+    index.build(version="v2")
+    fresh = DuckDBIndex(view, Path(mkdtemp()).resolve(), options)
+    fresh.build()
+    assert table(index, stopwords_query) == table(fresh, stopwords_query)
+    assert table(index, tf_query) == table(fresh, tf_query)
+    digests = table(index, "SELECT id, digest FROM digests")
+    index.close()
+
+    # A new tokenizer version invalidates the tokens of all entities:
+    monkeypatch.setattr(duckdb_index, "TOKENIZER_VERSION", TOKENIZER_VERSION + 1)
+    index = DuckDBIndex(view, data_dir, options, persistent=True)
+    index.build(version="v3")
+    updated = table(index, "SELECT id, digest FROM digests")
+    assert [i for i, _ in updated] == [i for i, _ in digests]
+    assert not set(updated).intersection(digests)
+    assert table(index, tf_query) == table(fresh, tf_query)
+    index.close()
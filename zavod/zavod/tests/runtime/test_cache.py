@@ -0,0 +1,65 @@
+from hashlib import sha1
+from typing import Any
+
+from zavod import settings
+from zavod.meta import Dataset
+from zavod.runtime.cache import get_cache, get_engine, get_metadata
+from zavod.runtime.cache import BlobCache, BLOB_MARKER
+
+
+def test_blob_cache(testdataset1: Dataset, monkeypatch: Any):
+    monkeypatch.setattr(settings, "CACHE_DATABASE_URI", None)
+    get_cache.cache_clear()
+    cache = get_cache(testdataset1)
+    assert isinstance(cache, BlobCache)
+    cache.threshold = 100
+    small = "hello"
+    large = "hello, world! " * 100
+    cache.set("small", small)
+    cache.set("large1", large)
+    cache.set("large2", large)
+    assert cache.get("small") == small
+    assert cache.get("large1", max_age=5) == large
+    assert cache.get("large2") == large
+    files = list(cache.path.glob("*/*.gz"))
+    assert len(files) == 1
+    assert files[0].stat().st_size < len(large)
+    stored = {v.key: v.text for v in cache.all(None)}
+    assert stored["small"] == small
+    assert stored["large1"] is not None and stored["large1"].startswith(BLOB_MARKER)
+
+    # Files which are no longer referenced are deleted:
+    cache.delete("large1")
+    cache.evict()
+    assert len(list(cache.path.glob("*/*.gz"))) == 1
+    cache.delete("large2")
+    cache.evict()
+    assert len(list(cache.path.glob("*/*.gz"))) == 0
+
+    # Size budget evicts the oldest files first:
+    cache.set("older", "a" * 1000)
+    cache.set("newer", "b" * 1000)
+    size = sum(p.stat().st_size for p in cache.path.glob("*/*.gz"))
+    cache.evict(max_size=size - 1)
+    assert cache.get("older") is None
+    assert cache.get("newer") == "b" * 1000
+
+    # Missing files are treated as a cache miss:
+    for path in cache.path.glob("*/*.gz"):
+        path.unlink()
+    assert cache.get("newer") is None
+    assert cache.get("small") == small
+
+    # Closing the cache deletes files orphaned by overwritten entries, even
+    # without an age limit or size budget:
+    assert settings.CACHE_MAX_AGE == 0 and settings.CACHE_BLOB_BUDGET == 0
+    cache.set("large", "c" * 1000)
+    cache.set("large", "d" * 1000)
+    assert len(list(cache.path.glob("*/*.gz"))) == 2
+    cache.close()
+    files = list(cache.path.glob("*/*.gz"))
+    assert len(files) == 1
+    assert files[0].name.startswith(sha1(("d" * 1000).encode()).hexdigest())
+    get_cache.cache_clear()
+    get_engine.cache_clear()
+    get_metadata.cache_clear()
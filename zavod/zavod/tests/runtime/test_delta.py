@@ -0,0 +1,27 @@
+from pathlib import Path
+
+from zavod.runtime.delta import SortedHashes
+
+
+def test_sorted_hashes(tmp_path: Path):
+    items = [(f"e{i:03d}", f"h{i}") for i in (5, 3, 9, 1, 7, 2, 8)]
+    memory = SortedHashes(tmp_path / "memory", 100)
+    spilled = SortedHashes(tmp_path / "spilled", 2)
+    for hashes in (memory, spilled):
+        for entity_id, entity_hash in items:
+            hashes.add(entity_id, entity_hash)
+        # The latest hash for an ID wins, even across run files:
+        hashes.add("e003", "changed")
+        hashes.add("x:y", "colon")
+    assert memory.runs == []
+    assert len(spilled.runs) == 4
+    assert list(memory) == list(spilled)
+    result = dict(spilled)
+    assert list(result) == sorted(result)
+    assert result["e003"] == "changed"
+    assert result["x:y"] == "colon"
+    assert len(result) == len(items) + 1
+
+    spilled.clear()
+    assert not spilled.path.exists()
+    assert list(spilled) == []
@@ -0,0 +1,107 @@
+import pytest
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+from typing import Any, Dict, Generator, List, Tuple, Type
+from requests.exceptions import RetryError
+
+from zavod.meta.http import HTTP
+from zavod.runtime import http_
+from zavod.runtime.http_ import RateLimiter, RateLimitedAdapter
+from zavod.runtime.http_ import make_session, get_rate_limiter
+
+
+def test_rate_limiter(monkeypatch: Any):
+    sleeps: List[float] = []
+    monkeypatch.setattr(http_, "sleep", sleeps.append)
+
+    unlimited = RateLimiter()
+    for _ in range(5):
+        assert unlimited.wait("https://example.com/") == 0.0
+    assert unlimited.waits == 0
+
+    limiter = RateLimiter(10.0, burst=2)
+    for _ in range(4):
+        limiter.wait("https://example.com/a")
+    # Other hosts have their own bucket:
+    assert limiter.wait("https://other.com/a") == 0.0
+    assert limiter.requests == 5
+    assert limiter.waits == 2
+    assert 0.25 < sum(sleeps) < 0.35
+
+    limiter.throttle("https://example.com/", 30)
+    assert limiter.throttled == 1
+    assert limiter.wait("https://example.com/b") > 29
+    assert limiter.wait("https://other.com/b") < 1
+
+
+class _ThrottlingHandler(BaseHTTPRequestHandler):
+    # Responses to send, in order; the last one is repeated:
+    responses: List[Tuple[int, Dict[str, str]]] = []
+    hits = 0
+
+    def do_GET(self) -> None:
+        cls = type(self)
+        status, headers = cls.responses[min(cls.hits, len(cls.responses) - 1)]
+        cls.hits += 1
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+@contextmanager
+def _serve(
+    responses: List[Tuple[int, Dict[str, str]]],
+) -> Generator[Tuple[str, Type[_ThrottlingHandler]], None, None]:
+    handler = type("Handler", (_ThrottlingHandler,), {"responses": responses})
+    server = HTTPServer(("127.0.0.1", 0), handler)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}/", handler
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_rate_limited_adapter(monkeypatch: Any):
+    sleeps: List[float] = []
+    monkeypatch.setattr(http_, "sleep", sleeps.append)
+    # The default retry configuration, which includes 429 and 503:
+    http_conf = HTTP({})
+    session = make_session(http_conf)
+    limiter = get_rate_limiter(session)
+    assert limiter is not None
+    assert isinstance(session.get_adapter("https://example.com/"), RateLimitedAdapter)
+
+    # Every retry of a throttled request goes through the limiter:
+    with _serve([(429, {"Retry-After": "120"})]) as (url, handler):
+        with pytest.raises(RetryError):
+            session.get(url)
+    retries = http_conf.total_retries
+    assert handler.hits == retries + 1
+    assert limiter.requests == retries + 1
+    assert limiter.throttled == retries + 1
+    assert len(sleeps) == retries
+    assert all(119 < s <= 120 for s in sleeps)
+
+    # Without Retry-After, the retry backoff pauses the host:
+    sleeps.clear()
+    with _serve([(503, {}), (503, {}), (200, {})]) as (url, handler):
+        assert session.get(url).status_code == 200
+    assert handler.hits == 3
+    assert len(sleeps) == 1
+    assert sleeps[0] > 0
+
+    # Statuses which aren't configured for retries are returned as they are:
+    session.close()
+    session = make_session(HTTP({"retry_statuses": [500]}))
+    with _serve([(429, {}), (200, {})]) as (url, handler):
+        assert session.get(url).status_code == 429
+    assert handler.hits == 1
+    session.close()
@@ -3,7 +3,9 @@ from nomenklatura.statement.serialize import PACK
 
 from zavod import settings
 from zavod.meta import Dataset
+from zavod.archive import dataset_resource_path, STATEMENTS_FILE
 from zavod.context import Context
+from zavod.runtime.sink import DatasetSink
 
 
 def test_dataset_sink(testdataset1: Dataset):
@@ -26,3 +28,53 @@ def test_dataset_sink(testdataset1: Dataset):
         assert "name" in props, props
     context.sink.clear()
     assert not context.sink.path.is_file()
+
+
+def test_dataset_sink_background(testdataset1: Dataset):
+    context = Context(testdataset1)
+    context.sink = DatasetSink(testdataset1, background=True)
+    for idx in range(100):
+        entity = context.make("Person")
+        entity.id = f"foo-{idx}"
+        entity.add("name", f"Foo {idx}")
+        context.emit(entity)
+    assert context.sink.thread is not None
+    assert context.sink.backlog >= 0
+    context.sink.close()
+    assert context.sink.thread is None
+    with open(context.sink.path, "rb") as fh:
+        stmts = list(read_statements(fh, PACK))
+    assert len(stmts) == 200
+    assert stmts[0].entity_id == "foo-0"
+    assert stmts[-1].entity_id == "foo-99"
+    context.sink.clear()
+
+
+def test_dataset_sink_clear_compressed(testdataset1: Dataset):
+    stale = dataset_resource_path(testdataset1.name, f"{STATEMENTS_FILE}.gz")
+    stale.parent.mkdir(parents=True, exist_ok=True)
+    stale.write_bytes(b"stale")
+    sink = DatasetSink(testdataset1, background=False)
+    assert sink.path.name == STATEMENTS_FILE
+    sink.clear()
+    assert not stale.exists()
+
+
+def test_dataset_sink_background_snapshot(testdataset1: Dataset):
+    context = Context(testdataset1)
+    sink = DatasetSink(testdataset1, background=True)
+    entity = context.make("Person")
+    entity.id = "foo"
+    entity.add("name", "Foo")
+    statements = list(entity.statements)
+    for stmt in statements:
+        stmt.dataset = testdataset1.name
+    sink.emit_many(statements)
+    for stmt in statements:
+        stmt.value = "changed"
+    sink.close()
+    with open(sink.path, "rb") as fh:
+        stmts = list(read_statements(fh, PACK))
+    assert len(stmts) == 2
+    assert "changed" not in [s.value for s in stmts]
+    sink.clear()
@@ -0,0 +1,90 @@
+from datetime import timedelta
+
+import requests_mock
+
+from zavod import settings
+from zavod.meta import Dataset
+from zavod.context import Context
+from zavod.archive import iter_local_statements, publish_artifact
+from zavod.archive import publish_dataset_version, SOURCES_FILE
+from zavod.runtime.sources import DatasetSources, file_checksum
+
+URL = "https://test.com/source.csv"
+
+
+def _crawl(dataset: Dataset, name: str, content: str, days: int = 0) -> Context:
+    context = Context(dataset)
+    context.data_time = context.data_time + timedelta(days=days)
+    context.begin(clear=True)
+    with requests_mock.Mocker() as m:
+        m.get(URL, text=content)
+        context.fetch_resource(name, URL)
+    return context
+
+
+def test_sources_fingerprint(testdataset1: Dataset):
+    sources = DatasetSources(testdataset1)
+    assert sources.unchanged() is None
+    path = sources.path.parent / "source.csv"
+    path.write_text("a,b,c")
+    sources.add_file(URL, path)
+    assert sources.files == {URL: path}
+    assert sources.sources == {}
+    assert sources.fingerprint()["sources"] == {URL: file_checksum(path)}
+    assert sources.files == {}
+    assert sources.code == DatasetSources(testdataset1).fingerprint()["code"]
+    assert not sources.path.exists()
+    sources.save()
+    assert sources.path.is_file()
+    # Nothing has been published yet:
+    assert sources.unchanged() is None
+    sources.clear()
+    assert not sources.path.exists()
+
+
+def test_skip_unchanged(testdataset1: Dataset):
+    context = _crawl(testdataset1, "source.csv", "a,b,c")
+    assert context.skip_unchanged() is False
+    entity = context.make("Person")
+    entity.id = "jane"
+    entity.add("name", "Jane Doe")
+    entity.add("topics", "sanction")
+    context.emit(entity, target=True)
+    other = context.make("Person")
+    other.id = "john"
+    other.add("name", "John Doe")
+    context.emit(other)
+    context.close()
+    for name in ("statements.pack", SOURCES_FILE):
+        path = settings.DATA_PATH / "datasets" / testdataset1.name / name
+        publish_artifact(path, testdataset1.name, settings.RUN_VERSION, name)
+    publish_dataset_version(testdataset1.name)
+    previous = list(iter_local_statements(testdataset1))
+
+    context = _crawl(testdataset1, "source.csv", "a,b,c", days=1)
+    assert context.skip_unchanged() is True
+    assert context.stats.unchanged
+    assert context.stats.entities == 2
+    assert context.stats.targets == 1
+    assert context.stats.statements == len(previous)
+    assert context.stats.changed == len(previous)
+    context.close()
+    statements = list(iter_local_statements(testdataset1))
+    assert {s.id for s in statements} == {s.id for s in previous}
+    for stmt in statements:
+        assert stmt.first_seen == previous[0].first_seen
+        assert stmt.last_seen == context.data_time_iso
+        assert stmt.last_seen != stmt.first_seen
+
+    context = _crawl(testdataset1, "source2.csv", "a,b,c,d", days=1)
+    assert context.skip_unchanged() is False
+    assert not context.stats.unchanged
+    context.close()
+
+    settings.REUSE_UNCHANGED = False
+    try:
+        context = _crawl(testdataset1, "source.csv", "a,b,c", days=1)
+        assert context.skip_unchanged() is False
+        context.close()
+    finally:
+        settings.REUSE_UNCHANGED = True
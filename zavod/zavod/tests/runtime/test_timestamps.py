@@ -1,12 +1,15 @@
 from datetime import timedelta
 from shutil import copyfile
 from rigour.time import utc_now
+from nomenklatura.statement import Statement
 
 from zavod import settings
 from zavod.meta import Dataset
 from zavod.crawl import crawl_dataset
-from zavod.archive import iter_dataset_statements
-from zavod.runtime.timestamps import TimeStampIndex
+from zavod.context import Context
+from zavod.archive import iter_dataset_statements, publish_artifact
+from zavod.archive import publish_dataset_version
+from zavod.runtime.timestamps import TimeStampIndex, SOURCE_KEY
 
 
 def test_timestamps(testdataset1: Dataset):
@@ -60,3 +63,78 @@ def test_backfill(testdataset1: Dataset):
             continue
         assert stamps.get(stmt.id, second_time) != ""
         assert stamps.get(stmt.id, second_time) == prev_time
+
+
+def test_timestamps_exact_key(testdataset1: Dataset):
+    index = TimeStampIndex(dataset=testdataset1)
+    stmts = []
+    for entity_id in ("Q1", "Q12", "Q123"):
+        stmt = Statement(entity_id, "name", "Person", entity_id, testdataset1.name)
+        stmt.first_seen = "2020-01-01T00:00:00"
+        stmts.append(stmt)
+    index.index(stmts)
+    stamps = index.get("Q1")
+    assert list(stamps.keys()) == [stmts[0].id]
+
+    many = index.get_many(["Q123", "Q1", "Q2"])
+    assert many["Q1"] == stamps
+    assert list(many["Q123"].keys()) == [stmts[2].id]
+    assert many["Q2"] == {}
+    index.close()
+
+
+def test_timestamps_compact(testdataset1: Dataset):
+    crawl_dataset(testdataset1)
+    stmts = list(iter_dataset_statements(testdataset1))
+    index = TimeStampIndex(dataset=testdataset1, compact=True)
+    index.index(stmts)
+    john = [s.id for s in stmts if s.entity_id == "osv-john-doe"]
+    stamps = index.get("osv-john-doe", john)
+    assert len(stamps) == len(john)
+    for stmt_id in john:
+        assert stamps[stmt_id] == settings.RUN_TIME_ISO
+    assert index.get("osv-john-doe", ["test"]) == {}
+    assert len(index.values) == 1
+    index.close()
+
+
+def _publish_statements(dataset: Dataset) -> None:
+    crawl_dataset(dataset)
+    path = settings.DATA_PATH / "datasets" / dataset.name / "statements.pack"
+    publish_artifact(path, dataset.name, settings.RUN_VERSION, "statements.pack")
+    publish_dataset_version(dataset.name)
+
+
+def test_timestamps_reuse(testdataset1: Dataset):
+    _publish_statements(testdataset1)
+    index = TimeStampIndex.build(dataset=testdataset1)
+    assert index.source is not None
+    assert settings.RUN_VERSION.id in index.source
+    stamps = index.get("osv-john-doe")
+    assert len(stamps)
+    index.db.put(b"osv-john-doe:marker", b"x")
+    index.close()
+
+    # Same source version, the index is not rebuilt:
+    index = TimeStampIndex.build(dataset=testdataset1)
+    assert index.get("osv-john-doe")["marker"] == "x"
+    index.close()
+
+    # A stale source marker triggers a rebuild:
+    index = TimeStampIndex(dataset=testdataset1)
+    index.db.put(SOURCE_KEY, b"artifacts/other")
+    index.close()
+    index = TimeStampIndex.build(dataset=testdataset1)
+    assert "marker" not in index.get("osv-john-doe")
+    assert index.get("osv-john-doe") == stamps
+    index.close()
+
+
+def test_timestamps_preload(testdataset1: Dataset):
+    _publish_statements(testdataset1)
+    context = Context(testdataset1)
+    context.preload_timestamps()
+    assert context._timestamps_future is not None
+    assert len(context.timestamps.get("osv-john-doe"))
+    assert context._timestamps_future is None
+    context.close()
@@ -1,9 +1,12 @@
-from typing import cast
+from typing import Any, cast
 from datetime import datetime
+from threading import Lock
+from time import sleep
 
 import pytest
 import requests_mock
 from requests.adapters import HTTPAdapter
+from requests.exceptions import HTTPError
 import orjson
 from lxml import etree
 
@@ -251,6 +254,127 @@ def test_context_fetchers_exceptions(testdataset1: Dataset):
     context.close()
 
 
+def test_context_fetch_many(testdataset1: Dataset):
+    context = Context(testdataset1)
+    testdataset1.http.max_concurrency = 2
+    lock = Lock()
+    active = [0, 0]
+
+    def respond(request: Any, ctx: Any) -> str:
+        with lock:
+            active[0] += 1
+            active[1] = max(active)
+        sleep(0.01)
+        with lock:
+            active[0] -= 1
+        return request.url
+
+    urls = [f"https://test.com/page/{i}" for i in range(20)]
+    with requests_mock.Mocker() as m:
+        m.get(requests_mock.ANY, text=respond)
+        results = list(context.fetch_many(urls, cache_days=14, workers=6))
+        assert [url for url, _ in results] == urls
+        assert [text for _, text in results] == urls
+        assert m.call_count == len(urls)
+        assert active[1] <= 2
+
+        # All responses are now cached:
+        results = list(context.fetch_many(urls, cache_days=14, ordered=False))
+        assert sorted(url for url, _ in results) == sorted(urls)
+        assert m.call_count == len(urls)
+
+    with requests_mock.Mocker() as m:
+        m.get(requests_mock.ANY, status_code=500)
+        with pytest.raises(HTTPError):
+            list(context.fetch_many(["https://test.com/fail"]))
+
+    testdataset1.http.max_concurrency = 4
+    context.close()
+    get_cache.cache_clear()
+    get_engine.cache_clear()
+    get_metadata.cache_clear()
+
+
+def test_context_revalidation(testdataset1: Dataset):
+    context = Context(testdataset1)
+    url = "https://test.com/data.csv"
+    etag = {"ETag": '"v1"'}
+    with requests_mock.Mocker() as m:
+        m.get(
+            url,
+            [
+                {"text": "a,b", "headers": etag},
+                {"status_code": 304},
+                {"text": "a,b,c", "headers": {"ETag": '"v2"'}},
+            ],
+        )
+        path, changed = context.revalidate_resource("data.csv", url)
+        assert changed is True
+        path, changed = context.revalidate_resource("data.csv", url)
+        assert changed is False
+        assert m.last_request.headers["If-None-Match"] == '"v1"'
+        assert path.read_text() == "a,b"
+        path = context.fetch_resource("data.csv", url, revalidate=True)
+        assert path.read_text() == "a,b,c"
+        assert m.call_count == 3
+
+    # Expired cache entries are revalidated:
+    with requests_mock.Mocker() as m:
+        m.get(url, [{"text": "a,b", "headers": etag}, {"status_code": 304}])
+        assert context.fetch_text(url, cache_days=0) == "a,b"
+        assert context.fetch_text(url, cache_days=0) == "a,b"
+        assert m.last_request.headers["If-None-Match"] == '"v1"'
+        assert m.call_count == 2
+
+    context.close()
+    get_cache.cache_clear()
+    get_engine.cache_clear()
+    get_metadata.cache_clear()
+
+
+def _crawl_shard(context: Context, item: int) -> None:
+    entity = context.make("Person")
+    entity.id = f"shard-{item}"
+    entity.add("name", f"Shard {item}")
+    context.emit(entity, target=True)
+    context.issues.write({"level": "warning", "event": "Shard issue", "item": item})
+    context.sources.add(f"source-{item}", f"checksum-{item}")
+    path = context.get_resource_path(f"shard-{item}.json")
+    path.write_text("{}")
+    context.export_resource(path, title=f"Shard {item}")
+
+
+def test_context_map_shards(testdataset1: Dataset):
+    context = Context(testdataset1)
+    context.begin(clear=True)
+    context.map_shards(range(5), _crawl_shard, workers=2)
+    assert context.stats.entities == 5
+    assert context.stats.targets == 5
+    assert context.stats.statements == 10
+    context.close()
+
+    stmts = list(iter_dataset_statements(testdataset1))
+    entity_ids = [s.entity_id for s in stmts if s.prop == "id"]
+    assert entity_ids == [f"shard-{i}" for i in range(5)]
+    assert all(s.first_seen == context.data_time_iso for s in stmts)
+    issues = [i for i in context.issues.all() if i["message"] == "Shard issue"]
+    assert sorted(i["data"]["item"] for i in issues) == list(range(5))
+    resources = [r.name for r in context.resources.all()]
+    assert resources == [f"shard-{i}.json" for i in range(5)]
+    assert len(context.sources.sources) == 5
+    assert context.sources.sources["source-3"] == "checksum-3"
+    # The crawler doesn't compare its sources, so they aren't published:
+    assert not context.sources.path.exists()
+
+
+def test_context_map_shards_dry_run(testdataset1: Dataset):
+    context = Context(testdataset1, dry_run=True)
+    context.map_shards(range(2), _crawl_shard, workers=2)
+    assert context.stats.entities == 2
+    assert context._timestamps is None
+    context.close()
+
+
 def test_crawl_dataset(testdataset1: Dataset):
     DatasetSink(testdataset1).clear()
     assert len(list(iter_dataset_statements(testdataset1))) == 0
@@ -1,12 +1,17 @@
+import os
+from pathlib import Path
 from typing import Optional
 from nomenklatura.versions import VersionHistory
+from rigour.mime.types import JSON
 
 from zavod import settings
 from zavod.meta import Dataset
+from zavod.archive import backend
 from zavod.archive import get_dataset_artifact, clear_data_path
 from zavod.archive import iter_dataset_statements, iter_previous_statements
 from zavod.archive import STATISTICS_FILE, INDEX_FILE, STATEMENTS_FILE
 from zavod.archive import DATASETS, ARTIFACTS, VERSIONS_FILE
+from zavod.archive import TTL_SHORT, _publish_object
 from zavod.crawl import crawl_dataset
 from zavod.store import get_store
 from zavod.exporters import export_dataset
@@ -70,6 +75,36 @@ def test_publish_dataset(testdataset1: Dataset):
     assert path.exists()
 
 
+def test_publish_compressed(testdataset1: Dataset):
+    settings.STATEMENTS_COMPRESSION = "gz"
+    try:
+        crawl_dataset(testdataset1)
+        data_path = settings.DATA_PATH / DATASETS / testdataset1.name
+        assert data_path.joinpath(f"{STATEMENTS_FILE}.gz").exists()
+        assert not data_path.joinpath(STATEMENTS_FILE).exists()
+        local = list(iter_dataset_statements(testdataset1))
+        assert len(local) > 5
+
+        store = get_store(testdataset1, get_resolver())
+        store.sync()
+        export_dataset(testdataset1, store.view(testdataset1))
+        store.close()
+        publish_dataset(testdataset1, latest=False)
+        history = _read_history(testdataset1.name)
+        assert history is not None and history.latest is not None
+        artifact_path = settings.ARCHIVE_PATH / ARTIFACTS / testdataset1.name
+        artifact_path = artifact_path / history.latest.id
+        assert artifact_path.joinpath(f"{STATEMENTS_FILE}.gz").exists()
+        assert not artifact_path.joinpath(STATEMENTS_FILE).exists()
+
+        # Stream decode from the archive:
+        clear_data_path(testdataset1.name)
+        previous = list(iter_previous_statements(testdataset1))
+        assert [s.id for s in previous] == [s.id for s in local]
+    finally:
+        settings.STATEMENTS_COMPRESSION = ""
+
+
 def test_publish_failure(testdataset1: Dataset):
     arch_path = settings.ARCHIVE_PATH / DATASETS
     art_path = settings.ARCHIVE_PATH / ARTIFACTS
@@ -93,3 +128,51 @@ def test_publish_failure(testdataset1: Dataset):
     assert artifact_path.joinpath("issues.json").exists()
     assert artifact_path.joinpath("index.json").exists()
     assert latest_path.joinpath("index.json").exists()
+
+
+def test_publish_resumable(testdataset1: Dataset, monkeypatch):
+    crawl_dataset(testdataset1)
+    store = get_store(testdataset1, get_resolver())
+    store.sync()
+    export_dataset(testdataset1, store.view(testdataset1))
+    store.close()
+    publish_dataset(testdataset1, latest=True)
+
+    release_path = settings.ARCHIVE_PATH / DATASETS / settings.RELEASE
+    release_path = release_path / testdataset1.name
+    entities_path = release_path / "entities.ftm.json"
+    mtime = entities_path.stat().st_mtime_ns
+    index_path = release_path / INDEX_FILE
+    index_path.unlink()
+
+    # Unchanged files are skipped, missing ones are uploaded again:
+    publish_dataset(testdataset1, latest=True)
+    assert entities_path.stat().st_mtime_ns == mtime
+    assert index_path.exists()
+
+    # Large files are copied in concurrent parts:
+    monkeypatch.setattr(backend, "BLOB_CHUNK", 256 * 1024)
+    monkeypatch.setattr(settings, "PUBLISH_MULTIPART_SIZE", 1)
+    source = settings.DATA_PATH / "large.bin"
+    source.write_bytes(os.urandom(2 * 1024 * 1024 + 17))
+    object = backend.FileSystemBackend().get_object("large.bin")
+    assert object.checksum() is None
+    object.publish(source, checksum=backend.file_md5(source))
+    assert object.path.read_bytes() == source.read_bytes()
+    assert object.checksum() == backend.file_md5(source)
+    assert not list(object.path.parent.glob(".*.tmp"))
+
+    # The checksum and metadata are kept next to the object rather than read
+    # from it, and an object is published again if only its metadata changed:
+    checksum = backend.file_md5(source)
+
+    def fail(path: Path) -> str:
+        raise AssertionError("Object was read: %s" % path)
+
+    monkeypatch.setattr(backend, "file_md5", fail)
+    assert object.checksum() == checksum
+    assert object.is_published(checksum)
+    assert not object.is_published(checksum, ttl=TTL_SHORT)
+    _publish_object(object, source, checksum, ttl=TTL_SHORT)
+    assert object.is_published(checksum, ttl=TTL_SHORT)
+    assert not object.is_published(checksum, mime_type=JSON, ttl=TTL_SHORT)
@@ -1,8 +1,16 @@
+from typing import Any, List
+from nomenklatura.statement import write_statements, PACK
+from nomenklatura.versions import Version
+
 from zavod import settings
-from zavod.meta import Dataset
+from zavod.archive import dataset_resource_path, iter_local_statements
+from zavod.archive import STATEMENTS_FILE
+from zavod.meta import Dataset, load_dataset_from_path
 from zavod.crawl import crawl_dataset
-from zavod.integration import get_resolver
-from zavod.store import get_store
+from zavod.integration import get_resolver, get_dataset_linker
+from zavod.runtime.versions import make_version
+from zavod.store import get_store, CachedView
+from zavod.tests.conftest import DATASET_2_YML
 
 
 def test_store_access(testdataset1: Dataset):
@@ -33,3 +41,104 @@ def test_store_access(testdataset1: Dataset):
     store.clear()
     empty = store.view(testdataset1, external=False)
     assert len(list(empty.entities())) == 0
+
+
+def test_cached_view(testdataset1: Dataset):
+    resolver = get_resolver()
+    crawl_dataset(testdataset1)
+    store = get_store(testdataset1, resolver)
+    store.sync()
+    view = store.view(testdataset1)
+    cached = CachedView(view, 100)
+    for entity in view.entities():
+        expected = [(p.name, a.id) for p, a in view.get_adjacent(entity)]
+        first = [(p.name, a.id) for p, a in cached.get_adjacent(entity)]
+        second = [(p.name, a.id) for p, a in cached.get_adjacent(entity)]
+        assert first == expected
+        assert second == expected
+    assert cached.hits == cached.misses
+    assert cached.misses > 5
+
+    tiny = CachedView(view, 1)
+    for entity in view.entities():
+        list(tiny.get_adjacent(entity))
+        list(tiny.get_adjacent(entity))
+    assert tiny._size <= 1
+
+    # An entry with exactly as many adjacents as the limit is kept:
+    for entity in view.entities():
+        count = len(list(view.get_adjacent(entity)))
+        if count > 1:
+            exact = CachedView(view, count)
+            list(exact.get_adjacent(entity))
+            list(exact.get_adjacent(entity))
+            assert exact.hits == 1
+            assert exact._size == count
+    store.close()
+
+
+def test_store_sync_parallel(testdataset1: Dataset, collection: Dataset):
+    dataset2 = load_dataset_from_path(DATASET_2_YML)
+    assert dataset2 is not None
+    crawl_dataset(testdataset1)
+    crawl_dataset(dataset2)
+    resolver = get_resolver()
+
+    store = get_store(collection, resolver)
+    store.sync(clear=True, workers=1)
+    serial = {k: v for k, v in store.db.iterator()}
+    store.sync(clear=True, workers=2)
+    parallel = {k: v for k, v in store.db.iterator()}
+    assert serial == parallel
+    view = store.view(collection)
+    assert len(list(view.entities())) > 20
+    store.close()
+
+
+def test_store_sync_incremental(
+    testdataset1: Dataset, collection: Dataset, monkeypatch: Any
+):
+    dataset2 = load_dataset_from_path(DATASET_2_YML)
+    assert dataset2 is not None
+    crawl_dataset(testdataset1)
+    crawl_dataset(dataset2)
+    linker = get_dataset_linker(collection)
+
+    store = get_store(collection, linker)
+    store.sync(incremental=True)
+    full = {k: v for k, v in store.db.iterator()}
+    assert store.db.get(f"lv:{testdataset1.name}".encode("utf-8")) is not None
+
+    # Nothing changed, so nothing is reloaded:
+    stmt_key = next(k for k, v in full.items() if k.startswith(b"s:osv-john-doe:"))
+    store.db.delete(stmt_key)
+    store.sync(incremental=True)
+    assert store.db.get(stmt_key) is None
+
+    # Re-generate one leaf with fewer entities:
+    path = dataset_resource_path(dataset2.name, STATEMENTS_FILE)
+    stmts = list(iter_local_statements(dataset2))
+    kept = {s.entity_id for s in stmts[: len(stmts) // 2]}
+    with open(path, "wb") as fh:
+        write_statements(fh, PACK, [s for s in stmts if s.entity_id in kept])
+    make_version(dataset2, Version.new("x"), overwrite=True)
+    store.sync(incremental=True)
+    assert store.db.get(stmt_key) is None
+    updated = {k: v for k, v in store.db.iterator()}
+    assert len(updated) < len(full)
+
+    store.sync(clear=True)
+    rebuilt = {k: v for k, v in store.db.iterator()}
+    assert updated == {k: v for k, v in rebuilt.items() if k != stmt_key}
+
+    # When all leaves have changed, the store is cleared instead of scanned:
+    def fail(names: List[str]) -> None:
+        raise AssertionError("Leaves were deleted from the store: %s" % names)
+
+    monkeypatch.setattr(store, "_delete_leaves", fail)
+    make_version(testdataset1, Version.new("y"), overwrite=True)
+    make_version(dataset2, Version.new("z"), overwrite=True)
+    store.sync(incremental=True)
+    reloaded = {k: v for k, v in store.db.iterator() if not k.startswith(b"lv:")}
+    assert reloaded == {k: v for k, v in rebuilt.items() if not k.startswith(b"lv:")}
+    store.close()
@@ -1,3 +1,5 @@
+import math
+import pytest
 from nomenklatura.judgement import Judgement
 from nomenklatura.statement import CSV, read_path_statements
 
@@ -5,6 +7,8 @@ from zavod.meta import Dataset
 from zavod.integration import get_resolver
 from zavod.crawl import crawl_dataset
 from zavod.tools.dump_file import dump_dataset_to_file
+from zavod.exporters import parquet
+from zavod.exporters.parquet import PARQUET
 from zavod.archive import iter_dataset_statements, dataset_state_path
 
 
@@ -35,3 +39,20 @@ def test_dump_file(testdataset1: Dataset):
     assert canonical.id in canon_ids
 
     get_resolver.cache_clear()
+
+
+def test_dump_file_parquet(testdataset1: Dataset, monkeypatch):
+    pq = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(parquet, "ROW_GROUP_SIZE", 10)
+    crawl_dataset(testdataset1)
+    stmts = list(iter_dataset_statements(testdataset1))
+
+    out_path = dataset_state_path(testdataset1.name) / "dump.parquet"
+    dump_dataset_to_file(testdataset1, get_resolver(), out_path, format=PARQUET)
+    meta = pq.read_metadata(out_path)
+    assert meta.num_rows == len(stmts)
+    assert meta.num_row_groups == math.ceil(len(stmts) / 10)
+    ids = pq.read_table(out_path, columns=["id"]).column("id").to_pylist()
+    assert set(ids) == {s.id for s in stmts}
+
+    get_resolver.cache_clear()
@@ -1,10 +1,12 @@
 from pathlib import Path
+from typing import Any
 from nomenklatura.resolver import Linker
 from nomenklatura.statement.serialize import get_statement_writer
 
 from zavod.logs import get_logger
 from zavod.meta import Dataset
 from zavod.entity import Entity
+from zavod.exporters.parquet import PARQUET, ParquetStatementWriter
 from zavod.tools.util import iter_output_statements
 
 log = get_logger(__name__)
@@ -18,16 +20,20 @@ def dump_dataset_to_file(
     external: bool = True,
 ) -> None:
     """Dump all the statements in the given scope to a file in one of the
-    formats supported by nomenklatura.
+    formats supported by nomenklatura, or to Parquet.
 
     Args:
         scope: The dataset to load from the archive.
         out_path: The database URI to load into.
-        format: Format name defined by nomenklatura
+        format: Format name defined by nomenklatura, or `parquet`.
         external: Include statements that are enrichment candidates.
     """
     with open(out_path, "wb") as fh:
-        writer = get_statement_writer(fh, format)
+        writer: Any = (
+            ParquetStatementWriter(fh)
+            if format == PARQUET
+            else get_statement_writer(fh, format)
+        )
         total_count: int = 0
         for dataset in scope.leaves:
             stmts = iter_output_statements(dataset, linker, external=external)